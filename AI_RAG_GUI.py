@@ -1,20 +1,100 @@
+import time
+STARTUP_START = time.perf_counter()
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 import os
+import threading
 import webbrowser
 import json
-from helpers import Chroma_Database
-from autogen import AssistantAgent, UserProxyAgent
+from concurrent.futures import ThreadPoolExecutor
+from task_runner import Background_Tasks, collection_task_name
+from metrics import metrics
+from context_packing import Context_Packer, format_context_stats
+# chromadb (through helpers), autogen and httpx take seconds to import: they are imported on first use,
+# off the Tk thread (see load_backend), so the window shows up at once
+STARTUP_TIMINGS = {'gui imports': time.perf_counter() - STARTUP_START}
+
+def load_backend(RAG_config, progress = None):
+    """
+    Imports the heavy modules and builds the database client, the answer cache and the LLM client.
+    Runs on a worker thread at startup (and headless in benchmarks/bench_startup.py).
+
+    Returns:
+    tuple: (dict with 'cdb', 'service_client', 'collection_names', 'answer_cache' and 'llm_client',
+            dict of the time spent in each step)
+    """
+    timings = {}
+    step_start = time.perf_counter()
+
+    def step_done(name):
+        nonlocal step_start
+        timings[name] = time.perf_counter() - step_start
+        step_start = time.perf_counter()
+
+    if progress is not None:
+        progress('importing modules')
+    from helpers import Chroma_Database
+    from rag_client import RAG_Service_Client
+    from answer_cache import Answer_Cache
+    from llm_client import OpenAI_Chat_Client
+    step_done('backend imports')
+
+    if progress is not None:
+        progress('opening database')
+    chroma_config = RAG_config['chroma_config']
+    rag_config = RAG_config['rag_config']
+    # with a service_url, the GUI is a thin client of rag_service.py instead of opening the database itself
+    service_url = RAG_config.get('service_config', {}).get('service_url')
+    service_client = None
+    if service_url:
+        service_client = RAG_Service_Client(service_url, config_json=chroma_config)
+        cdb = service_client
+    else:
+        cdb = Chroma_Database(config_json=chroma_config)
+    collection_names = cdb.list_collection_names()
+    step_done('database')
+
+    answer_cache_config = rag_config.get('answer_cache', {})
+    answer_cache = None
+    # in thin-client mode the service keeps the answer cache
+    if answer_cache_config.get('enabled', True) and service_client is None:
+        try:
+            answer_cache = Answer_Cache(
+                    db_path = os.path.join(chroma_config['CHROMA_DATA_PATH'], 'answer_cache.sqlite3'),
+                    max_entries = answer_cache_config.get('max_entries', 5000))
+        except Exception as exp_txt:
+            print(f"Answer cache disabled, could not open it: {exp_txt}")
+    llm_client = OpenAI_Chat_Client.from_config(rag_config['llm_agent_config'], system_message="You are a smart AI")
+    step_done('caches and LLM client')
+    return {'cdb': cdb,
+            'service_client': service_client,
+            'collection_names': collection_names,
+            'answer_cache': answer_cache,
+            'llm_client': llm_client}, timings
 
 class MiniRAGTool:
+    # rows of the collection files table loaded at a time, more are loaded when scrolling to the end
+    FILES_PAGE_SIZE = 500
+
     def __init__(self, root):
         self.root = root
         self.root.title("Mini RAG tool")
         self.root.minsize(600, 400)
+        self.cdb = None
+        self.extra_collections = []  # searched together with the selected collection
+        self.listed_collection = None  # collection shown in the files table, with its number of documents
+        self.listed_documents_total = 0
+        # the collection last selected; opening one runs in the background, one at a time, the last selection wins
+        self.loading_collection = None
+        self.collection_guard = threading.Lock()
+        # query rewrites run here, next to the retrieval of the query as typed
+        self.rewrite_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="rewrite")
         
         self.create_widgets()
         self.configure_grid()
         self.binding_actions()
+        self.tasks = Background_Tasks(self.root)
+        self.root.after_idle(lambda: STARTUP_TIMINGS.setdefault('window shown', time.perf_counter() - STARTUP_START))
         self.init_RAG()
     
     def create_widgets(self):
@@ -37,6 +117,10 @@ class MiniRAGTool:
         self.selected_collection = tk.StringVar()
         self.collection_dropdown = ttk.Combobox(self.main_collection_frame, textvariable=self.selected_collection)
         self.collection_dropdown.grid(row=0, column=1, padx=5, pady=5, sticky='ew')
+        self.more_collections_btn = tk.Button(self.main_collection_frame, text="More...", command=self.choose_extra_collections)
+        self.more_collections_btn.grid(row=0, column=2, padx=5, pady=5)
+        self.extra_collections_var = tk.StringVar()
+        tk.Label(self.main_collection_frame, textvariable=self.extra_collections_var).grid(row=1, column=0, columnspan=3, padx=5, sticky='w')
         
         # Main response frame
         self.main_response_frame = ttk.Frame(self.main_tab)
@@ -71,6 +155,8 @@ class MiniRAGTool:
         self.ask_Y_scrollbar.grid(row=1, column=1, sticky="ns")
         self.ask_btn = tk.Button(self.main_ask_frame, text="Ask", command=self.ask, height=3, width=5)
         self.ask_btn.grid(row=1, column=2)
+        self.cancel_ask_btn = tk.Button(self.main_ask_frame, text="Cancel", command=lambda: self.tasks.cancel('ask'), width=5)
+        self.cancel_ask_btn.grid(row=2, column=2)
 
         # Config frame
         self.config_frame = ttk.Frame(self.config_tab)
@@ -80,11 +166,22 @@ class MiniRAGTool:
         self.optimized_DB_query_check.grid(row=0, column=0, padx=5, pady=5, sticky='w')
         self.query_nr_results = tk.Scale(self.config_frame, from_=1, to=10, orient='horizontal', label='Query results (document chunks used)')
         self.query_nr_results.grid(row=1, column=0, padx=5, pady=5, sticky='ew')
+        self.query_mode_frame = ttk.Frame(self.config_frame)
+        self.query_mode_frame.grid(row=2, column=0, padx=5, pady=5, sticky='w')
+        tk.Label(self.query_mode_frame, text="Search mode:").grid(row=0, column=0, sticky='w')
+        self.query_mode_var = tk.StringVar(value='vector')
+        # vector: embedding similarity, keyword: exact terms (no model call), hybrid: both
+        self.query_mode_dropdown = ttk.Combobox(self.query_mode_frame, textvariable=self.query_mode_var,
+                                                values=('vector', 'keyword', 'hybrid'), state='readonly', width=10)
+        self.query_mode_dropdown.grid(row=0, column=1, padx=5, sticky='w')
         self.use_llm_response_var = tk.BooleanVar()
         self.use_llm_response_check = tk.Checkbutton(self.config_frame, text="Use LLM interpretation on queried results", variable=self.use_llm_response_var)
-        self.use_llm_response_check.grid(row=2, column=0, padx=5, pady=5, sticky='w')
+        self.use_llm_response_check.grid(row=3, column=0, padx=5, pady=5, sticky='w')
+        self.profile_next_ask_var = tk.BooleanVar()
+        self.profile_next_ask_check = tk.Checkbutton(self.config_frame, text="Profile next ask (cProfile)", variable=self.profile_next_ask_var)
+        self.profile_next_ask_check.grid(row=4, column=0, padx=5, pady=5, sticky='w')
         self.config_btn = tk.Button(self.config_frame, text="Advance", command=self.open_advance_config)
-        self.config_btn.grid(row=3, column=0, sticky='w')
+        self.config_btn.grid(row=5, column=0, sticky='w')
 
         # Collections frame
         self.edit_collection_frame_1 = ttk.Frame(self.collections_tab)
@@ -93,14 +190,17 @@ class MiniRAGTool:
         self.edit_selected_collection = tk.StringVar()
         self.edit_collection_dropdown = ttk.Combobox(self.edit_collection_frame_1, textvariable=self.edit_selected_collection)
         self.edit_collection_dropdown.grid(row=0, column=1, padx=5, pady=5, sticky='ew')
-        tk.Label(self.edit_collection_frame_1, text="Collection files:").grid(row=1, column=0, padx=5, pady=2, sticky='w')
+        self.collection_files_var = tk.StringVar(value="Collection files:")
+        tk.Label(self.edit_collection_frame_1, textvariable=self.collection_files_var).grid(row=1, column=0, columnspan=2, padx=5, pady=2, sticky='w')
 
         self.edit_collection_frame_2 = ttk.Frame(self.collections_tab)
         self.edit_collection_frame_2.grid(row=1, column=0, padx=5, pady=5, sticky='nsew')
         self.edit_coll_table_Y_scrollbar = ttk.Scrollbar(self.edit_collection_frame_2, orient="vertical")
-        self.edit_coll_files_table = ttk.Treeview(self.edit_collection_frame_2, columns=("File name", "Path"), show='headings', height=10, yscrollcommand=self.edit_coll_table_Y_scrollbar.set)
+        self.edit_coll_files_table = ttk.Treeview(self.edit_collection_frame_2, columns=("File name", "Path", "Chunks"), show='headings', height=10, yscrollcommand=self.on_collection_files_scrolled)
         self.edit_coll_files_table.heading("File name", text="File name")
         self.edit_coll_files_table.heading("Path", text="Path")
+        self.edit_coll_files_table.heading("Chunks", text="Chunks")
+        self.edit_coll_files_table.column("Chunks", width=60, stretch=False, anchor='e')
         self.edit_coll_files_table.grid(row=0, column=0, padx=5, pady=5, sticky='nsew')
         self.edit_coll_table_Y_scrollbar.config(command=self.edit_coll_files_table.yview)
         self.edit_coll_table_Y_scrollbar.grid(row=0, column=1, sticky="ns")
@@ -117,10 +217,21 @@ class MiniRAGTool:
         self.delete_doc.grid(row=1, column=1, padx=5, pady=5, sticky='w')
         self.check_collection = tk.Button(self.edit_collection_frame_3, text="Recheck docs", command=self.recheck_folder)
         self.check_collection.grid(row=2, column=0, padx=5, pady=5, sticky='w')
+        self.cancel_collection_task_btn = tk.Button(self.edit_collection_frame_3, text="Cancel task", command=lambda: self.tasks.cancel_all('collection'))
+        self.cancel_collection_task_btn.grid(row=2, column=1, padx=5, pady=5, sticky='w')
+
+        # Status bar (background tasks progress)
+        self.status_frame = ttk.Frame(self.root)
+        self.status_frame.grid(row=1, column=0, padx=5, pady=2, sticky='ew')
+        self.status_var = tk.StringVar(value="Ready")
+        tk.Label(self.status_frame, textvariable=self.status_var, anchor='w').grid(row=0, column=0, sticky='ew')
+        self.status_progress = ttk.Progressbar(self.status_frame, mode='indeterminate', length=120)
+        self.status_progress.grid(row=0, column=1, padx=5, sticky='e')
 
     def configure_grid(self):
         self.root.grid_rowconfigure(0, weight=1)
         self.root.grid_columnconfigure(0, weight=1)
+        self.status_frame.grid_columnconfigure(0, weight=1)
         self.main_tab.grid_rowconfigure(1, weight=2)
         self.main_tab.grid_rowconfigure(2, weight=1)
         self.main_tab.grid_columnconfigure(0, weight=1)
@@ -159,11 +270,24 @@ class MiniRAGTool:
             messagebox.showwarning("Warning", "Can't have a blank collection name!\nPlease enter a valid name!")
             return
         print(f'Add collection= {coll_to_add}')
-        collection_names = [collection.name for collection in self.cdb.client.list_collections()]
-        if coll_to_add in collection_names:
+
+        def create(task):
+            # in thin-client mode every call here is a request to the service: off the Tk thread
+            with self.collection_guard:
+                collection_names = self.cdb.list_collection_names()
+                if coll_to_add in collection_names:
+                    return None
+                task.progress('creating the collection')
+                self.cdb.init_collection(collection_name=coll_to_add)
+                return collection_names + [coll_to_add]
+
+        self.submit_collection_read("create", coll_to_add, create,
+                                    lambda collection_names: self.on_collection_added(coll_to_add, collection_names))
+
+    def on_collection_added(self, coll_to_add, collection_names):
+        if collection_names is None:
             messagebox.showwarning("Warning", f"Collection name '{coll_to_add}' already exists!\nPlease choose another name.")
             return
-        collection_names.append(coll_to_add)
         self.collection_dropdown['values'] = collection_names
         self.edit_collection_dropdown['values'] = collection_names
         self.selected_collection.set(coll_to_add)
@@ -172,14 +296,25 @@ class MiniRAGTool:
 
     def delete_collection(self):
         coll_to_delete = self.edit_selected_collection.get()
-        collection_names = [collection.name for collection in self.cdb.client.list_collections()]
-        if coll_to_delete not in collection_names:
+        if coll_to_delete not in self.edit_collection_dropdown['values']:
             return
         result = messagebox.askokcancel("Confirmation", f"Are you sure you want to permanently delete collection '{coll_to_delete}'?")
         if not result:
             return
-        self.cdb.client.delete_collection(coll_to_delete)
-        collection_names.remove(coll_to_delete)
+        # stop the tasks still writing to it, the delete waits for their write lock
+        self.cancel_collection_tasks(coll_to_delete)
+
+        def delete(task, cdb):
+            cdb.delete_collection(coll_to_delete)
+            return cdb.list_collection_names()
+
+        self.submit_collection_write("delete collection", coll_to_delete, delete,
+                                     on_done=lambda collection_names: self.on_collection_deleted(coll_to_delete, collection_names),
+                                     create_session=False)
+
+    def on_collection_deleted(self, coll_to_delete, collection_names):
+        if coll_to_delete in self.extra_collections:
+            self.set_extra_collections([name for name in self.extra_collections if name != coll_to_delete])
         self.collection_dropdown['values'] = collection_names
         self.edit_collection_dropdown['values'] = collection_names
         if len(collection_names):
@@ -200,10 +335,14 @@ class MiniRAGTool:
         if collection_to_add_in != loaded_collection:
             self.selected_collection.set(collection_to_add_in)
             self.load_collection(self.selected_collection.get())
-        check_result = self.cdb.docs_check_sync(folder_selected)
-        print(f"Folder selected: {folder_selected} and found {len(check_result['new_doc_ids'])} txt files to add...")
-        self.cdb.add_to_collection()
-        self.load_collection_files(None)
+
+        def ingest(task, session):
+            check_result = session.docs_check_sync(folder_selected, progress=task.progress)
+            print(f"Folder selected: {folder_selected} and found {len(check_result['new_doc_ids'])} txt files to add...")
+            session.add_to_collection(progress=task.progress)
+
+        self.submit_collection_write("ingest", collection_to_add_in, ingest,
+                                     on_done=lambda _: self.load_collection_files(None))
 
     def delete_documents(self):
         items_ids_to_delete = self.edit_coll_files_table.selection()
@@ -217,9 +356,10 @@ class MiniRAGTool:
         ids_to_delete = []
         for each_item in items_ids_to_delete:
             values = self.edit_coll_files_table.item(each_item, "values")
-            ids_to_delete += values[2].split()
-        self.cdb.delete_from_collection(ids_to_delete)
-        self.load_collection_files(None)
+            ids_to_delete += values[3].split()
+        self.submit_collection_write("delete documents", self.edit_collection_dropdown.get(),
+                                     lambda task, session: session.delete_from_collection(ids_to_delete),
+                                     on_done=lambda _: self.load_collection_files(None))
 
     def recheck_folder(self):
         collection_to_add_in = self.edit_collection_dropdown.get()
@@ -227,31 +367,122 @@ class MiniRAGTool:
         if collection_to_add_in != loaded_collection:
             self.selected_collection.set(collection_to_add_in)
             self.load_collection(self.selected_collection.get())
-        folders_to_check = set()  # Use a set to store unique values
-        for item_id in self.edit_coll_files_table.get_children():
-            values = self.edit_coll_files_table.item(item_id, "values")
-            folders_to_check.add(values[1])  # Add the value from the second column
-        folders_to_check = list(folders_to_check)  # Convert the set back to a list if needed
-        check_result = self.cdb.docs_check_sync(folders_to_check)
+
+        def check(task, cdb):
+            if collection_to_add_in not in cdb.list_collection_names():
+                return None
+            # every folder of the collection, not only those of the rows loaded in the table; listed here, off the
+            # Tk thread, as the first listing may rebuild the catalog
+            task.progress('listing folders')
+            folders_to_check = cdb.list_document_folders(collection_to_add_in)
+            session = cdb.open_session(collection_to_add_in)
+            return session, session.docs_check_sync(folders_to_check, progress=task.progress)
+
+        self.submit_collection_write("recheck", collection_to_add_in, check,
+                                     on_done=lambda result: self.on_recheck_done(collection_to_add_in, result),
+                                     create_session=False)
+
+    def on_recheck_done(self, collection_name, result):
+        if result is None:
+            # not in the database (any more)
+            return
+        session, check_result = result
         if not len(check_result['new_doc_ids']) and not len(check_result['doc_ids_to_delete']):
             messagebox.showwarning("Info", "No change detected!")
-        else:
-            result = messagebox.askokcancel("Confirmation", f"Change detected, update database?")
-            if not result:
-                return
+            return
+        result = messagebox.askokcancel("Confirmation", f"Change detected, update database?")
+        if not result:
+            return
+
+        def update(task, _):
+            # reuse the session holding the sync result
             if len(check_result['doc_ids_to_delete']):
-                self.cdb.delete_from_collection(check_result['doc_ids_to_delete'])
+                session.delete_from_collection(check_result['doc_ids_to_delete'])
             if len(check_result['new_doc_ids']):
-                self.cdb.add_to_collection()
-            self.load_collection_files(None)
+                session.add_to_collection(progress=task.progress)
+
+        self.submit_collection_write("update", collection_name, update,
+                                     on_done=lambda _: self.load_collection_files(None), create_session=False)
+
+    def submit_collection_write(self, action, collection_name, func, on_done = None, create_session = True):
+        """
+        Runs func(task, session) in the background while holding the collection's write lock,
+        so conflicting writes to one collection run one after the other while other
+        collections stay usable.
+        """
+        def run(task):
+            lock = self.cdb.write_lock(collection_name)
+            if not lock.acquire(blocking=False):
+                task.progress('waiting for another write to finish')
+                while not lock.acquire(timeout=0.2):
+                    task.check_cancelled()
+            try:
+                session = self.cdb.open_session(collection_name) if create_session else self.cdb
+                return func(task, session)
+            finally:
+                lock.release()
+
+        task = self.tasks.submit(collection_task_name(action, collection_name), run,
+                                 on_done=lambda result: self.on_task_finished(on_done, result),
+                                 on_error=lambda exp: self.on_task_error(action, exp),
+                                 on_progress=self.on_task_progress,
+                                 on_cancelled=lambda: self.on_task_finished(None, None),
+                                 group='collection')
+        if task is None:
+            messagebox.showwarning("Info", f"A '{action}' task is already running on '{collection_name}'.")
+
+    def cancel_collection_tasks(self, collection_name):
+        # the tasks of this collection only, not of collections whose name starts the same
+        for action in ("ingest", "recheck", "update", "delete documents"):
+            self.tasks.cancel(collection_task_name(action, collection_name))
+
+    def on_task_progress(self, task, stage, value):
+        self.status_var.set(self.tasks.describe())
+        self.status_progress.start(10)
+
+    def on_task_finished(self, callback, result):
+        self.status_var.set(self.tasks.describe() or "Ready")
+        if not len(self.tasks.running):
+            self.status_progress.stop()
+        self.export_metrics()
+        if callback is not None:
+            callback(result)
+
+    def export_metrics(self):
+        # metrics file refreshed after every task, e.g. for node_exporter's textfile collector (.prom) or as JSON lines
+        metrics_file = getattr(self, 'metrics_config', {}).get('metrics_file')
+        if metrics_file:
+            try:
+                metrics.export(metrics_file)
+            except OSError as exp:
+                print(f"Could not write the metrics file {metrics_file}: {exp}")
+
+    def on_task_error(self, action, exp):
+        self.on_task_finished(None, None)
+        print(f"Task '{action}' failed: {exp}")
+        messagebox.showerror("Error", f"'{action}' failed:\n\n{exp}")
 
     def load_collection(self, collection_name = None):
         self.reset()
+        if self.cdb is None:
+            # still starting up
+            return
+        if not isinstance(collection_name, str):
+            # selected in the dropdown: called with the event
+            collection_name = self.selected_collection.get()
         if collection_name == '':
             message = "No collection in the Database !!!\n\nCreate one in the 'Collections' tab!"
             self.set_response_field_text(message)
             return 
-        self.cdb.init_collection(collection_name=collection_name)
+        self.loading_collection = collection_name
+
+        def open_collection(task):
+            # a blocking request in thin-client mode; skipped when another collection was selected while it waited
+            with self.collection_guard:
+                if self.loading_collection == collection_name:
+                    self.cdb.init_collection(collection_name=collection_name)
+
+        self.submit_collection_read("open", collection_name, open_collection, None)
 
     def on_tab_selected(self, event):
         selected_tab = event.widget.select()
@@ -264,21 +495,78 @@ class MiniRAGTool:
     def load_collection_files(self, _):
         # Clear any existing rows
         self.edit_coll_files_table.delete(*self.edit_coll_files_table.get_children())
+        self.listed_collection = None
+        self.collection_files_var.set("Collection files:")
         edit_selected_collection = self.edit_selected_collection.get()
+        if self.cdb is None:
+            return
         if edit_selected_collection == '':
             self.edit_coll_files_table.insert("","end", values=("No collection in database!",""))
             return
-        collection = self.cdb.client.get_collection(name=edit_selected_collection)
-        all_doc_chunks = collection.get(include=['metadatas'])
-        for idx, each in enumerate(all_doc_chunks['ids']):
-            doc_id = each.split('>')[0]
-            doc_chunk_ids = [ids for ids in all_doc_chunks['ids'] if ids.split('>')[0] == doc_id]
-            all_doc_chunks['metadatas'][idx]['doc_ids'] = doc_chunk_ids
-        doc_chunks = [doc for doc in all_doc_chunks['metadatas'] if doc['doc_chunk'] == '0']
-        # Populate the table with new data
-        for each_doc in doc_chunks:
+        self.listed_collection = edit_selected_collection
+        self.listed_documents_total = 0
+        self.collection_files_var.set("Collection files: loading...")
+
+        def load(task):
+            if edit_selected_collection not in self.cdb.list_collection_names():
+                return None
+            # the first call of the process (or after an interrupted write) rebuilds the catalog from every chunk
+            task.progress('reading the document catalog')
+            return (self.cdb.count_documents(edit_selected_collection),
+                    self.cdb.list_documents(edit_selected_collection, offset=0, limit=self.FILES_PAGE_SIZE))
+
+        task = self.submit_collection_read("catalog", edit_selected_collection, load,
+                                           lambda result: self.on_collection_files_loaded(edit_selected_collection, result))
+        if task is None:
+            # a page of the same collection is still being read: reload once it is done
+            self.root.after(100, lambda: self.load_collection_files(None))
+
+    def load_more_collection_files(self):
+        # next page of documents from the collection's catalog
+        loaded_rows = len(self.edit_coll_files_table.get_children())
+        collection_name = self.listed_collection
+        if collection_name is None or loaded_rows >= self.listed_documents_total:
+            return
+        self.submit_collection_read("catalog", collection_name,
+                                    lambda task: self.cdb.list_documents(collection_name, offset=loaded_rows, limit=self.FILES_PAGE_SIZE),
+                                    lambda documents: self.show_collection_files(collection_name, loaded_rows, None, documents))
+
+    def submit_collection_read(self, action, collection_name, func, on_done):
+        # opening collections and reading catalogs run in the background too; one task per action and collection,
+        # a scroll while a catalog read runs is ignored
+        return self.tasks.submit(collection_task_name(action, collection_name), func,
+                                 on_done=lambda result: self.on_task_finished(on_done, result),
+                                 on_error=lambda exp: self.on_task_error(action, exp),
+                                 on_progress=self.on_task_progress,
+                                 on_cancelled=lambda: self.on_task_finished(None, None))
+
+    def on_collection_files_loaded(self, collection_name, result):
+        if result is not None:
+            self.show_collection_files(collection_name, 0, *result)
+        elif collection_name == self.listed_collection:
+            self.listed_collection = None
+            self.collection_files_var.set("Collection files:")
+            self.edit_coll_files_table.insert("","end", values=("No collection in database!",""))
+
+    def show_collection_files(self, collection_name, offset, documents_total, documents):
+        if collection_name != self.listed_collection or offset != len(self.edit_coll_files_table.get_children()):
+            # another collection was selected, or the table reloaded, meanwhile
+            return
+        if documents_total is not None:
+            self.listed_documents_total = documents_total
+            self.collection_files_var.set(f"Collection files: {documents_total}")
+        for each_doc in documents:
             directory_path, file_name = os.path.split(each_doc['doc_path'])
-            self.edit_coll_files_table.insert("","end", values=(file_name, directory_path, each_doc['doc_ids']))
+            self.edit_coll_files_table.insert("","end", values=(file_name, directory_path, each_doc['chunk_count'], each_doc['chunk_ids']))
+        if not len(documents):
+            # the collection changed since it was counted
+            self.listed_documents_total = offset
+
+    def on_collection_files_scrolled(self, first, last):
+        self.edit_coll_table_Y_scrollbar.set(first, last)
+        # rows are loaded on demand, when the end of the loaded ones comes into view
+        if float(last) >= 0.95 and len(self.edit_coll_files_table.get_children()) < self.listed_documents_total:
+            self.root.after_idle(self.load_more_collection_files)
 
     def populate_table(self, data_list):
         # Clear any existing rows
@@ -319,45 +607,199 @@ class MiniRAGTool:
         except Exception as e:
             print(f"An error occurred while opening the file: {e}")
 
+    def choose_extra_collections(self):
+        # multi-selection of the collections searched together with the selected one
+        if self.cdb is None:
+            return
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Also search in")
+        dialog.transient(self.root)
+        tk.Label(dialog, text="Also search in collections:").grid(row=0, column=0, columnspan=2, padx=5, pady=5, sticky='w')
+        collection_names = [name for name in self.collection_dropdown['values'] if name != self.selected_collection.get()]
+        listbox = tk.Listbox(dialog, selectmode=tk.MULTIPLE, height=min(max(len(collection_names), 1), 15), exportselection=False)
+        listbox.grid(row=1, column=0, columnspan=2, padx=5, pady=5, sticky='nsew')
+        for i, name in enumerate(collection_names):
+            listbox.insert(tk.END, name)
+            if name in self.extra_collections:
+                listbox.selection_set(i)
+
+        def on_ok():
+            self.set_extra_collections([collection_names[i] for i in listbox.curselection()])
+            dialog.destroy()
+
+        tk.Button(dialog, text="OK", command=on_ok, width=8).grid(row=2, column=0, padx=5, pady=5)
+        tk.Button(dialog, text="Cancel", command=dialog.destroy, width=8).grid(row=2, column=1, padx=5, pady=5)
+        dialog.grid_columnconfigure(0, weight=1)
+        dialog.grid_rowconfigure(1, weight=1)
+
+    def set_extra_collections(self, collection_names):
+        self.extra_collections = list(collection_names)
+        self.extra_collections_var.set(f"Also searching: {', '.join(self.extra_collections)}" if len(self.extra_collections) else '')
+
     def ask(self):
-        self.set_response_field_text('Processing...\n\nPlease wait!')
+        if self.tasks.is_running('ask'):
+            return
         optimized_DB_query = self.optimized_DB_query_var.get()
         use_llm_response = self.use_llm_response_var.get()
         self.cdb.config_json['query_nr_results'] = self.query_nr_results.get()
+        self.cdb.config_json['query_mode'] = self.query_mode_var.get()
         user_query = self.ask_field.get("1.0", tk.END).strip()
         if user_query == '':
             self.set_response_field_text('No text in the search field!')
             return
-        if optimized_DB_query:
-            optimized_DB_query_prompt_template = self.RAG_config['rag_config']['optimized_DB_query_prompt_template']
-            prompt_1 = f"{optimized_DB_query_prompt_template}{user_query}"
-            chat_history_1 = self.user_proxy.initiate_chat(self.assistant, message=prompt_1, max_turns=1)
-            user_query = chat_history_1.chat_history[-1]['content']
-        query_results = self.cdb.query_collection(query_texts = user_query)
+        collection_name = self.selected_collection.get()
+        if collection_name == '':
+            self.set_response_field_text("No collection in the Database !!!\n\nCreate one in the 'Collections' tab!")
+            return
+        collection_names = [collection_name] + [name for name in self.extra_collections
+                                                if name != collection_name and name in self.collection_dropdown['values']]
+        self.set_response_field_text('Processing...\n\nPlease wait!')
+        self.streaming_answer = False
+        # one-shot: only this ask is profiled
+        profile = self.profile_next_ask_var.get()
+        self.profile_next_ask_var.set(False)
+        self.tasks.submit('ask', lambda task: self.run_ask(task, collection_names, user_query, optimized_DB_query, use_llm_response, profile),
+                          on_done=lambda result: self.on_task_finished(self.show_ask_result, result),
+                          on_error=lambda exp: self.on_task_finished(self.set_response_field_text, f"!!! ERROR while asking !!!\n\n{exp}"),
+                          on_progress=self.on_task_progress,
+                          on_cancelled=lambda: self.on_task_finished(self.append_response_field_text, '\n\n[Cancelled]'),
+                          on_stream=self.on_answer_token)
+
+    def run_ask(self, task, collection_names, user_query, optimized_DB_query, use_llm_response, profile = False):
+        # Runs on a worker thread: no widget access here, the result is shown by show_ask_result
+        if isinstance(collection_names, str):
+            collection_names = [collection_names]
+        if profile:
+            profile_dir = self.RAG_config.get('metrics_config', {}).get('profile_dir')
+            with metrics.profile('ask', profile_dir) as profile_result:
+                result = self.run_ask(task, collection_names, user_query, optimized_DB_query, use_llm_response)
+            print(profile_result['report'])
+            if 'path' in profile_result:
+                print(f"Profile saved to {profile_result['path']}")
+            return result
+        with metrics.span('ask', collections=collection_names, optimized_DB_query=optimized_DB_query,
+                          use_llm_response=use_llm_response, service=self.service_client is not None):
+            return self.run_ask_stages(task, collection_names, user_query, optimized_DB_query, use_llm_response)
+
+    def run_ask_stages(self, task, collection_names, user_query, optimized_DB_query, use_llm_response):
+        if self.service_client is not None:
+            task.progress('asking the service')
+            return self.service_client.ask(collection_names, user_query, optimized_DB_query, use_llm_response,
+                                           n_results = self.cdb.config_json['query_nr_results'],
+                                           mode = self.cdb.config_json['query_mode'])
+        from helpers import format_query_results, pipelined_retrieve
+        llm_model = self.RAG_config['rag_config']['llm_agent_config']['model']
+        collection_stats = {}
+
+        def retrieve(query_text):
+            with metrics.span('ask.retrieve'):
+                # all the selected collections and '|' sub-queries at once, merged into the overall closest chunks
+                query_results, stats = self.cdb.query_collections(collection_names, query_text)
+            collection_stats.update(stats)
+            return query_results
+
+        rag_config = self.RAG_config['rag_config']
+        if optimized_DB_query and rag_config.get('pipelined_rewrite', True):
+            task.progress('optimising query and retrieving')
+            query_results, optimized_query = pipelined_retrieve(user_query, self.rewrite_query, retrieve, self.rewrite_executor,
+                                                                rag_config.get('rewrite_timeout_s', 10),
+                                                                self.cdb.config_json['query_nr_results'])
+            if optimized_query is not None:
+                user_query = optimized_query
+        else:
+            if optimized_DB_query:
+                task.progress('optimising query')
+                user_query = self.rewrite_query(user_query)
+            task.progress('retrieving')
+            query_results = retrieve(user_query)
+        if len(collection_names) > 1:
+            print("Collections searched: " + ', '.join(f"{name} {stats['latency_s'] * 1000:.0f}ms" + (" (failed)" if 'error' in stats else '')
+                                                      for name, stats in collection_stats.items()))
+        print(f"Query cache: {self.cdb.query_cache.stats()}")
         # create respond prompt template with each chunk from the resulted vector database query
-        chunks = ""
-        chunk_count = 0
-        chunks_info = []
-        for query_count in range(len(query_results['documents'])):
-            for query_result_count in range(len(query_results['documents'][query_count])):
-                chunk_data = query_results['metadatas'][query_count][query_result_count]
-                chunk_data['relevance'] = 1 - query_results['distances'][query_count][query_result_count]
-                chunks_info.append(chunk_data)
-                chunk_count += 1
-                chunks += f"Chunk {chunk_count}:\n{query_results['documents'][query_count][query_result_count]}\n"
-        if len(chunks_info) == 0:
+        with metrics.span('ask.prompt') as prompt_span:
+            chunks, chunks_info = format_query_results(query_results)
+            if use_llm_response and self.context_packer is not None:
+                # merged neighbours, no duplicates, within the token budget
+                chunks, context_stats = self.context_packer.pack(query_results)
+                prompt_span['attributes'].update(context_stats)
+                print(format_context_stats(context_stats))
+        if use_llm_response:
+            task.progress('generating answer')
+            with metrics.span('ask.answer') as answer_span:
+                response_prompt_template = self.RAG_config['rag_config']['response_prompt_template']
+                answer = None
+                if self.answer_cache is not None:
+                    answer = self.answer_cache.get_answer(llm_model, response_prompt_template, user_query, chunks)
+                answer_span['attributes']['cached'] = answer is not None
+                if answer is None:
+                    prompt_2  = f"{response_prompt_template}{user_query}\n\nCHUNKS:\n\n{chunks}"
+                    if self.RAG_config['rag_config'].get('stream_response', True):
+                        answer = self.stream_answer(task, prompt_2)
+                    else:
+                        assistant, user_proxy = self.get_agents()
+                        assistant.reset()
+                        chat_history_2 = user_proxy.initiate_chat(assistant, message=prompt_2, max_turns=1)
+                        answer = chat_history_2.summary
+                    if self.answer_cache is not None:
+                        self.answer_cache.put_answer(llm_model, response_prompt_template, user_query, chunks, answer)
+                else:
+                    print(f"Answer cache hit: {self.answer_cache.stats()['answers']}")
+            task.progress('answer tokens', len(answer.split()))
+        else:
+            answer = 'Info found in the below documents.\n\nLLM not selected to interpret it.'
+        task.check_cancelled()
+        return {'answer': answer, 'chunks_info': chunks_info}
+
+    def rewrite_query(self, user_query):
+        # optimised DB query (may run on a rewrite_executor thread: it uses the pooled LLM client, not the agents)
+        llm_model = self.RAG_config['rag_config']['llm_agent_config']['model']
+        prompt_template = self.RAG_config['rag_config']['optimized_DB_query_prompt_template']
+        with metrics.span('ask.rewrite') as rewrite_span:
+            optimized_query = None
+            if self.answer_cache is not None:
+                optimized_query = self.answer_cache.get_rewrite(llm_model, prompt_template, user_query)
+            rewrite_span['attributes']['cached'] = optimized_query is not None
+            if optimized_query is None:
+                optimized_query = self.llm_client.complete(f"{prompt_template}{user_query}")
+                if self.answer_cache is not None:
+                    self.answer_cache.put_rewrite(llm_model, prompt_template, user_query, optimized_query)
+        return optimized_query
+
+    def stream_answer(self, task, prompt):
+        # Streams the answer tokens to the response field (through task.stream) and records TTFT and tokens/sec
+        nr_tokens = 0
+
+        def on_token(token):
+            nonlocal nr_tokens
+            nr_tokens += 1
+            task.stream(token)
+            if nr_tokens % 10 == 0:
+                task.progress('tokens generated', nr_tokens)
+
+        answer, stats = self.llm_client.stream(prompt, on_token=on_token)
+        self.answer_stats.append(stats)
+        if self.context_packer is not None:
+            self.context_packer.observe_prefill(prompt, stats['ttft_s'])
+        ttft = f"{stats['ttft_s']:.2f}s" if stats['ttft_s'] is not None else "-"
+        tokens_per_s = f"{stats['tokens_per_s']:.1f}" if stats['tokens_per_s'] is not None else "-"
+        print(f"Answer streamed: {stats['tokens']} tokens, TTFT {ttft}, {tokens_per_s} tokens/s")
+        return answer
+
+    def on_answer_token(self, token):
+        if not self.streaming_answer:
+            # first token replaces the 'Processing...' message
+            self.streaming_answer = True
+            self.response_field.delete('1.0', tk.END)
+        self.append_response_field_text(token)
+
+    def show_ask_result(self, result):
+        if len(result['chunks_info']) == 0:
             self.files_table.delete(*self.files_table.get_children())
             self.files_table.insert("", "end", values=("No data", ""))
         else:
-            self.populate_table(chunks_info)
-        if use_llm_response:
-            response_prompt_template = self.RAG_config['rag_config']['response_prompt_template']
-            prompt_2  = f"{response_prompt_template}{user_query}\n\nCHUNKS:\n\n{chunks}"
-            self.assistant.reset()
-            chat_history_2 = self.user_proxy.initiate_chat(self.assistant, message=prompt_2, max_turns=1)
-            self.set_response_field_text(chat_history_2.summary)
-        else:
-            self.set_response_field_text('Info found in the below documents.\n\nLLM not selected to interpret it.')
+            self.populate_table(result['chunks_info'])
+        self.set_response_field_text(result['answer'])
 
     def reset(self):
         self.response_field.delete('1.0', tk.END)
@@ -368,7 +810,10 @@ class MiniRAGTool:
     def set_response_field_text(self, text):
         self.response_field.delete('1.0', tk.END)
         self.response_field.insert(tk.END, text)
-        self.response_field.update()
+
+    def append_response_field_text(self, text):
+        self.response_field.insert(tk.END, text)
+        self.response_field.see(tk.END)
 
     def init_RAG(self):
         try:
@@ -381,11 +826,12 @@ class MiniRAGTool:
         chroma_config = self.RAG_config['chroma_config']
         rag_config = self.RAG_config['rag_config']
         self.query_nr_results.set(value=chroma_config['query_nr_results'])
+        self.query_mode_var.set(value=chroma_config.get('query_mode', 'vector'))
         self.optimized_DB_query_var.set(value=rag_config['optimized_DB_query'])
         self.use_llm_response_var.set(value=rag_config['use_llm_response'])
         os.environ['AUTOGEN_USE_DOCKER'] = rag_config['AUTOGEN_USE_DOCKER']
         llm_agent_config = rag_config['llm_agent_config']
-        llm_config = {
+        self.llm_config = {
             "config_list" :[
                 {
                     "model": llm_agent_config['model'],
@@ -395,48 +841,76 @@ class MiniRAGTool:
             ],
             "cache_seed": llm_agent_config['cache_seed'],
         }
+        self.agents = None
+        self.agents_lock = threading.Lock()
+        self.answer_stats = []
+        self.context_packer = Context_Packer.from_config(self.RAG_config)
+        self.metrics_config = self.RAG_config.get('metrics_config', {})
+        metrics.configure(self.metrics_config)
+
+        # the database, caches and LLM client are built in the background while the window is already usable
+        self.set_backend_ready(False)
+        self.tasks.submit('startup', lambda task: load_backend(self.RAG_config, progress=task.progress),
+                          on_done=lambda result: self.on_task_finished(self.on_backend_loaded, result),
+                          on_error=lambda exp: self.on_task_finished(self.set_response_field_text,
+                                                                     f"!!! ERROR loading Chroma Database !!!\n\n{exp}"),
+                          on_progress=self.on_task_progress)
+
+    def on_backend_loaded(self, result):
+        backend, timings = result
+        self.cdb = backend['cdb']
+        self.service_client = backend['service_client']
+        self.answer_cache = backend['answer_cache']
+        self.llm_client = backend['llm_client']
+        chroma_config = self.RAG_config['chroma_config']
+        collection_names = backend['collection_names']
+        self.edit_collection_dropdown['values'] = collection_names
+        self.collection_dropdown['values'] = collection_names
+        if chroma_config['default_COLLECTION_NAME'] in collection_names:
+            self.selected_collection.set(chroma_config['default_COLLECTION_NAME'])
+        elif not len(collection_names):
+            pass
+        else:
+            self.selected_collection.set(collection_names[0])
         try:
-            self.cdb = Chroma_Database(config_json=chroma_config)
-            collection_names = [collection.name for collection in self.cdb.client.list_collections()]
-            self.edit_collection_dropdown['values'] = collection_names
-            self.collection_dropdown['values'] = collection_names
-            if chroma_config['default_COLLECTION_NAME'] in collection_names:
-                self.selected_collection.set(chroma_config['default_COLLECTION_NAME'])
-            elif not len(collection_names):
-                pass
-            else:
-                self.selected_collection.set(collection_names[0])
             self.load_collection(self.selected_collection.get())
         except Exception as exp_txt:
             message = f"!!! ERROR loading Chroma Database !!!\n\n{exp_txt}"
             self.set_response_field_text(message)
             return
+        self.set_backend_ready(True)
+        STARTUP_TIMINGS.update(timings)
+        STARTUP_TIMINGS['ready'] = time.perf_counter() - STARTUP_START
+        print("Startup timings: " + ", ".join(f"{step} {elapsed:.2f}s" for step, elapsed in STARTUP_TIMINGS.items()))
 
-        try:
-            # Create the agent that uses the LLM.
-            self.assistant = AssistantAgent(
-                name = "agent", 
-                llm_config=llm_config,
-                system_message="You are a smart AI")
-        except Exception as exp_txt:
-            message = f"!!! ERROR loading the AssistantAgent !!!\n\n{exp_txt}"
-            self.set_response_field_text(message)
-            return
-        
-        try:
-            # Create the agent that represents the user in the conversation.
-            self.user_proxy = UserProxyAgent(
-                name = "user", 
-                code_execution_config=False,
-                #llm_config=llm_config,
-                #is_termination_msg=lambda x: x.get("content", "") and x.get("content", "").rstrip().endswith("TERMINATE"),
-                #human_input_mode="TERMINATE",
-                #system_message="You will check the received response from the agent and reply with propper instructions so he can generate the optimal query for a vector database search.",
-                )
-        except Exception as exp_txt:
-            message = f"!!! ERROR loading the UserProxyAgent !!!\n\n{exp_txt}"
-            self.set_response_field_text(message)
-            return
+    def set_backend_ready(self, ready):
+        # the buttons needing the database stay disabled until it is loaded
+        state = 'normal' if ready else 'disabled'
+        for button in (self.ask_btn, self.add_collection_btn, self.delete_collection_btn,
+                       self.add_doc, self.delete_doc, self.check_collection):
+            button.config(state=state)
+
+    def get_agents(self):
+        # autogen is imported and the agents are built the first time they are needed
+        with self.agents_lock:
+            if self.agents is None:
+                from autogen import AssistantAgent, UserProxyAgent
+                # Create the agent that uses the LLM.
+                assistant = AssistantAgent(
+                    name = "agent", 
+                    llm_config=self.llm_config,
+                    system_message="You are a smart AI")
+                # Create the agent that represents the user in the conversation.
+                user_proxy = UserProxyAgent(
+                    name = "user", 
+                    code_execution_config=False,
+                    #llm_config=llm_config,
+                    #is_termination_msg=lambda x: x.get("content", "") and x.get("content", "").rstrip().endswith("TERMINATE"),
+                    #human_input_mode="TERMINATE",
+                    #system_message="You will check the received response from the agent and reply with propper instructions so he can generate the optimal query for a vector database search.",
+                    )
+                self.agents = (assistant, user_proxy)
+            return self.agents
 
     def load_RAG_config(self):
         script_dir = os.path.dirname(__file__)
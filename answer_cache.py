@@ -0,0 +1,49 @@
+import hashlib
+import json
+from disk_cache import Disk_Cache
+from metrics import metrics
+
+def normalise_query(query):
+    return ' '.join(query.split()).lower()
+
+def make_key(*parts):
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+class Answer_Cache:
+    """
+    Persistent cache of the LLM steps of an Ask:
+    - the optimised-query rewrite, keyed by (model, prompt template, normalised user query)
+    - the final answer, keyed by (model, prompt template, normalised query, CHUNKS text of the prompt), so an
+      answer goes stale by itself once the documents, or the context packing settings, change what the model sees.
+    """
+    def __init__(self, db_path, max_entries = 5000):
+        self.rewrites = Disk_Cache(db_path, table='query_rewrites', max_entries=max_entries)
+        self.answers = Disk_Cache(db_path, table='answers', max_entries=max_entries)
+
+    @staticmethod
+    def rewrite_key(model, prompt_template, user_query):
+        return make_key(model, prompt_template, normalise_query(user_query))
+
+    @staticmethod
+    def answer_key(model, prompt_template, user_query, chunks):
+        chunks_hash = hashlib.sha256(chunks.encode('utf-8')).hexdigest()
+        return make_key(model, prompt_template, normalise_query(user_query), chunks_hash)
+
+    def get_rewrite(self, model, prompt_template, user_query):
+        value = self.rewrites.get(self.rewrite_key(model, prompt_template, user_query))
+        metrics.count('rag_cache_requests_total', cache='rewrites', result='miss' if value is None else 'hit')
+        return value.decode('utf-8') if value is not None else None
+
+    def put_rewrite(self, model, prompt_template, user_query, optimized_query):
+        self.rewrites.put(self.rewrite_key(model, prompt_template, user_query), optimized_query.encode('utf-8'))
+
+    def get_answer(self, model, prompt_template, user_query, chunks):
+        value = self.answers.get(self.answer_key(model, prompt_template, user_query, chunks))
+        metrics.count('rag_cache_requests_total', cache='answers', result='miss' if value is None else 'hit')
+        return value.decode('utf-8') if value is not None else None
+
+    def put_answer(self, model, prompt_template, user_query, chunks, answer):
+        self.answers.put(self.answer_key(model, prompt_template, user_query, chunks), answer.encode('utf-8'))
+
+    def stats(self):
+        return {'rewrites': self.rewrites.stats(), 'answers': self.answers.stats()}
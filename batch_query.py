@@ -0,0 +1,338 @@
+"""
+Headless batch query runner, for regression sets and other offline workloads.
+
+Reads queries from a JSONL file (one {"id": ..., "query": "...", "collection": optional} object per line, or
+"collections": [...] to search several collections at once),
+retrieves the chunks of many queries at once (one batched embedding call and one collection query per batch),
+optionally answers them with the LLM using a bounded number of concurrent requests, and writes one JSONL line
+per query with the answer, the retrieved chunk ids, their relevances, per-stage timings and the prompt
+tokens saved by the context packing.
+Uses the prompt templates and settings of config.json, like the GUI.
+
+Usage:
+    python batch_query.py queries.jsonl answers.jsonl [--collection NAME] [--batch-size 256]
+                          [--llm-concurrency 4] [--optimize-query | --no-optimize-query] [--no-llm] [--no-answer-cache]
+                          [--mode vector|keyword|hybrid] [--metrics-out metrics.prom]
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from helpers import Chroma_Database, batched, format_query_results, pipelined_retrieve
+from answer_cache import Answer_Cache
+from llm_client import OpenAI_Chat_Client
+from metrics import metrics
+from context_packing import Context_Packer
+
+class Batch_Query_Runner:
+    def __init__(self, config_json: dict, cdb = None, optimized_DB_query = None, use_llm_response = None,
+                 llm_concurrency = 4, use_answer_cache = True, query_mode = None):
+        chroma_config = config_json['chroma_config']
+        rag_config = config_json['rag_config']
+        self.rag_config = rag_config
+        self.cdb = cdb if cdb is not None else Chroma_Database(config_json=chroma_config)
+        self.default_collection = chroma_config['default_COLLECTION_NAME']
+        self.optimized_DB_query = rag_config['optimized_DB_query'] if optimized_DB_query is None else optimized_DB_query
+        self.use_llm_response = rag_config['use_llm_response'] if use_llm_response is None else use_llm_response
+        # single queries (query_one) retrieve the query as typed while it is rewritten
+        self.pipelined_rewrite = rag_config.get('pipelined_rewrite', True)
+        self.rewrite_timeout_s = rag_config.get('rewrite_timeout_s', 10)
+        self.llm_model = rag_config['llm_agent_config']['model']
+        self.query_mode = chroma_config.get('query_mode', 'vector') if query_mode is None else query_mode
+        self.llm_concurrency = max(1, llm_concurrency)
+        self.llm_client = OpenAI_Chat_Client.from_config(rag_config['llm_agent_config'], system_message="You are a smart AI",
+                                                         max_connections=self.llm_concurrency)
+        self.answer_cache = None
+        answer_cache_config = rag_config.get('answer_cache', {})
+        if use_answer_cache and answer_cache_config.get('enabled', True):
+            self.answer_cache = Answer_Cache(db_path = os.path.join(chroma_config['CHROMA_DATA_PATH'], 'answer_cache.sqlite3'),
+                                             max_entries = answer_cache_config.get('max_entries', 5000))
+        self.sessions = {}
+        # the service queries and writes from several threads
+        self.sessions_guard = threading.Lock()
+        self.rewrite_executor = ThreadPoolExecutor(max_workers=self.llm_concurrency, thread_name_prefix="rewrite")
+        self.context_packer = Context_Packer.from_config(config_json)
+
+    def session(self, collection_name):
+        with self.sessions_guard:
+            if collection_name not in self.sessions:
+                self.sessions[collection_name] = self.cdb.open_session(collection_name)
+            return self.sessions[collection_name]
+
+    def forget_session(self, collection_name):
+        # the collection was deleted: the next query opens it again (a query already holding the session fails)
+        with self.sessions_guard:
+            self.sessions.pop(collection_name, None)
+
+    def rewrite_query(self, query):
+        # optimised DB query for one query text (same prompt and cache as the GUI)
+        prompt_template = self.rag_config['optimized_DB_query_prompt_template']
+        optimized_query = None
+        with metrics.span('ask.rewrite') as rewrite_span:
+            if self.answer_cache is not None:
+                optimized_query = self.answer_cache.get_rewrite(self.llm_model, prompt_template, query)
+            rewrite_span['attributes']['cached'] = optimized_query is not None
+            if optimized_query is None:
+                optimized_query = self.llm_client.complete(f"{prompt_template}{query}")
+                if self.answer_cache is not None:
+                    self.answer_cache.put_rewrite(self.llm_model, prompt_template, query, optimized_query)
+        return optimized_query
+
+    def rewrite(self, result):
+        start_time = time.perf_counter()
+        result['optimized_query'] = self.rewrite_query(result['query'])
+        result['timings']['rewrite_s'] = time.perf_counter() - start_time
+
+    def retrieve_pipelined(self, result, n_results = None, mode = None):
+        # retrieval of the query as typed overlapped with its rewrite (see pipelined_retrieve); errors are raised
+        start_time = time.perf_counter()
+        rewrite_timings = {}
+
+        def rewrite(query):
+            rewrite_start = time.perf_counter()
+            optimized_query = self.rewrite_query(query)
+            rewrite_timings['rewrite_s'] = time.perf_counter() - rewrite_start
+            return optimized_query
+
+        def retrieve(query):
+            query_result = self.new_result(None, query, result['collection'])
+            self.retrieve([query_result], n_results, mode)
+            if query_result['error'] is not None:
+                raise RuntimeError(query_result['error'])
+            if 'collection_latencies' in query_result:
+                result['collection_latencies'] = query_result['collection_latencies']
+            return query_result['query_results']
+
+        result['query_results'], result['optimized_query'] = pipelined_retrieve(
+            result['query'], rewrite, retrieve, self.rewrite_executor, self.rewrite_timeout_s,
+            n_results or self.cdb.config_json['query_nr_results'])
+        if result['optimized_query'] is not None:
+            result['timings']['rewrite_s'] = rewrite_timings['rewrite_s']
+        # retrieval time includes the wait for the rewrite, which overlaps it
+        result['timings']['retrieval_s'] = time.perf_counter() - start_time
+
+    def retrieve(self, results, n_results = None, mode = None):
+        # one batched retrieval per collection present in the batch; queries over several collections, or made of
+        # '|'-separated sub-queries (searched separately and merged, as in the GUI), one by one
+        by_collection = {}
+        for each_result in results:
+            if each_result['error'] is not None:
+                continue
+            if isinstance(each_result['collection'], list) or '|' in (each_result['optimized_query'] or each_result['query']):
+                try:
+                    self.retrieve_federated(each_result, n_results, mode)
+                except Exception as exp:
+                    each_result['error'] = f"retrieval failed: {exp}"
+            else:
+                by_collection.setdefault(each_result['collection'], []).append(each_result)
+        # opening a session on an unknown name would create the collection
+        existing_names = set(self.cdb.list_collection_names()) if len(by_collection) else set()
+        for collection_name, collection_results in by_collection.items():
+            if collection_name not in existing_names:
+                for each_result in collection_results:
+                    each_result['error'] = f"Collection '{collection_name}' does not exist"
+                continue
+            start_time = time.perf_counter()
+            try:
+                with metrics.span('ask.retrieve', collection=collection_name, queries=len(collection_results)):
+                    query_results = self.session(collection_name).query_collection_batch(
+                                        [each_result['optimized_query'] or each_result['query'] for each_result in collection_results],
+                                        n_results, mode or self.query_mode)
+            except Exception as exp:
+                for each_result in collection_results:
+                    each_result['error'] = f"retrieval failed: {exp}"
+                continue
+            # the batch cost is shared by its queries
+            retrieval_s = (time.perf_counter() - start_time) / len(collection_results)
+            for each_result, each_query_results in zip(collection_results, query_results):
+                each_result['query_results'] = each_query_results
+                each_result['timings']['retrieval_s'] = retrieval_s
+
+    def retrieve_federated(self, result, n_results = None, mode = None):
+        # the query (split into its sub-queries) searched in all of result's collections concurrently,
+        # merged into the overall closest chunks
+        start_time = time.perf_counter()
+        collection_names = result['collection'] if isinstance(result['collection'], list) else [result['collection']]
+        with metrics.span('ask.retrieve', collections=len(collection_names)):
+            result['query_results'], collection_stats = self.cdb.query_collections(
+                                                            collection_names, result['optimized_query'] or result['query'],
+                                                            mode=mode or self.query_mode, n_results=n_results)
+        result['collection_latencies'] = {collection_name: {key: value for key, value in stats.items() if key != 'chunks'}
+                                          for collection_name, stats in collection_stats.items()}
+        result['timings']['retrieval_s'] = time.perf_counter() - start_time
+
+    def answer(self, result):
+        # LLM answer for one query, from the retrieved chunks
+        start_time = time.perf_counter()
+        query_results = result['query_results']
+        user_query = result['optimized_query'] or result['query']
+        prompt_template = self.rag_config['response_prompt_template']
+        with metrics.span('ask.prompt') as prompt_span:
+            if self.context_packer is not None:
+                chunks, result['context'] = self.context_packer.pack(query_results)
+                prompt_span['attributes'].update(result['context'])
+            else:
+                chunks, _ = format_query_results(query_results)
+        answer = None
+        with metrics.span('ask.answer') as answer_span:
+            if self.answer_cache is not None:
+                answer = self.answer_cache.get_answer(self.llm_model, prompt_template, user_query, chunks)
+            result['answer_cached'] = answer_span['attributes']['cached'] = answer is not None
+            if answer is None:
+                answer = self.llm_client.complete(f"{prompt_template}{user_query}\n\nCHUNKS:\n\n{chunks}")
+                if self.answer_cache is not None:
+                    self.answer_cache.put_answer(self.llm_model, prompt_template, user_query, chunks, answer)
+        result['answer'] = answer
+        result['timings']['answer_s'] = time.perf_counter() - start_time
+
+    def run_stage(self, executor, stage, results):
+        # runs stage(result) for every result still without error, at most llm_concurrency at a time
+        def run(each_result):
+            try:
+                stage(each_result)
+            except Exception as exp:
+                each_result['error'] = f"{stage.__name__} failed: {exp}"
+        list(executor.map(run, [each_result for each_result in results if each_result['error'] is None]))
+
+    @staticmethod
+    def new_result(query_id, query, collection_name):
+        return {'id': query_id,
+                'query': query,
+                'collection': collection_name,
+                'optimized_query': None,
+                'answer': None,
+                'error': None,
+                'timings': {}}
+
+    @staticmethod
+    def finish_result(result):
+        # replaces the raw query results with the chunk ids, paths and relevances written out
+        query_results = result.pop('query_results', None)
+        if query_results is not None:
+            result['chunk_ids'] = query_results['ids'][0]
+            result['doc_paths'] = [(metadata or {}).get('doc_path') for metadata in query_results['metadatas'][0]]
+            result['relevances'] = [1 - distance for distance in query_results['distances'][0]]
+            if isinstance(result['collection'], list):
+                result['chunk_collections'] = [(metadata or {}).get('collection') for metadata in query_results['metadatas'][0]]
+        return result
+
+    def run(self, queries, collection_name = None, batch_size = 256):
+        """
+        Runs the queries (dicts with 'query' and optional 'id' / 'collection') batch by batch and
+        yields one result dict per query, in input order.
+        """
+        if collection_name is None:
+            collection_name = self.default_collection
+        with ThreadPoolExecutor(max_workers=self.llm_concurrency, thread_name_prefix="batch_query") as executor:
+            for batch in batched(enumerate(queries), max_items=batch_size):
+                results = [self.new_result(each_query.get('id', line_nr), each_query['query'],
+                                           each_query.get('collections') or each_query.get('collection') or collection_name)
+                           for line_nr, each_query in batch]
+                if self.optimized_DB_query:
+                    self.run_stage(executor, self.rewrite, results)
+                self.retrieve(results)
+                if self.use_llm_response:
+                    self.run_stage(executor, self.answer, results)
+                for each_result in results:
+                    yield self.finish_result(each_result)
+
+    def query_one(self, query, collection_name = None, optimized_DB_query = None, use_llm_response = None, n_results = None,
+                  mode = None):
+        """
+        Runs a single query through the same stages, on the calling thread; errors are raised.
+        collection_name can be a list of collections, searched together. None options fall back to the runner's settings.
+        With 'pipelined_rewrite' the query rewrite overlaps the retrieval of the query as typed (see retrieve_pipelined).
+        """
+        if isinstance(collection_name, list) and len(collection_name) == 1:
+            collection_name = collection_name[0]
+        result = self.new_result(None, query, collection_name or self.default_collection)
+        with metrics.span('ask', collection=result['collection']):
+            optimize_query = self.optimized_DB_query if optimized_DB_query is None else optimized_DB_query
+            if optimize_query and self.pipelined_rewrite:
+                self.retrieve_pipelined(result, n_results, mode)
+            else:
+                if optimize_query:
+                    self.rewrite(result)
+                self.retrieve([result], n_results, mode)
+                if result['error'] is not None:
+                    raise RuntimeError(result['error'])
+            if self.use_llm_response if use_llm_response is None else use_llm_response:
+                self.answer(result)
+        return self.finish_result(result)
+
+    def run_file(self, input_path, output_path, collection_name = None, batch_size = 256):
+        # JSONL in, JSONL out; returns a summary with the per-stage totals
+        start_time = time.perf_counter()
+        summary = {'queries': 0, 'errors': 0, 'rewrite_s': 0.0, 'retrieval_s': 0.0, 'answer_s': 0.0,
+                   'context_tokens_saved': 0, 'prefill_saved_s': 0.0}
+        with open(input_path, 'r', encoding='utf-8') as input_file, open(output_path, 'w', encoding='utf-8') as output_file:
+            queries = (json.loads(line) for line in input_file if line.strip())
+            for each_result in self.run(queries, collection_name, batch_size):
+                output_file.write(json.dumps(each_result, ensure_ascii=False) + '\n')
+                summary['queries'] += 1
+                summary['errors'] += each_result['error'] is not None
+                for stage, elapsed in each_result['timings'].items():
+                    summary[stage] += elapsed
+                if 'context' in each_result:
+                    summary['context_tokens_saved'] += each_result['context']['tokens_saved']
+                    summary['prefill_saved_s'] += each_result['context']['prefill_saved_s']
+        summary['total_s'] = time.perf_counter() - start_time
+        summary['queries_per_s'] = summary['queries'] / summary['total_s'] if summary['total_s'] > 0 else 0.0
+        return summary
+
+    def close(self):
+        self.rewrite_executor.shutdown(wait=False)
+        self.llm_client.close()
+
+def load_config(config_path = None):
+    if config_path is None:
+        config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.json')
+    with open(config_path, 'r') as json_file:
+        return json.load(json_file)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a JSONL file of queries against a collection, without the GUI.")
+    parser.add_argument('input', help="JSONL file, one {\"id\": ..., \"query\": \"...\"} object per line")
+    parser.add_argument('output', help="JSONL file receiving one result per query")
+    parser.add_argument('--config', default=None, help="config file (default: config.json next to this script)")
+    parser.add_argument('--collection', default=None, help="collection queried when a line does not name one")
+    parser.add_argument('--batch-size', type=int, default=256, help="queries retrieved together")
+    parser.add_argument('--llm-concurrency', type=int, default=4, help="LLM requests running at the same time")
+    parser.add_argument('--optimize-query', dest='optimized_DB_query', action='store_true', default=None)
+    parser.add_argument('--no-optimize-query', dest='optimized_DB_query', action='store_false')
+    parser.add_argument('--no-llm', dest='use_llm_response', action='store_false', default=None,
+                        help="retrieval only, no LLM answer")
+    parser.add_argument('--no-answer-cache', dest='use_answer_cache', action='store_false',
+                        help="always ask the LLM, e.g. for regression runs against a new model")
+    parser.add_argument('--mode', dest='query_mode', choices=('vector', 'keyword', 'hybrid'), default=None,
+                        help="retrieval mode (default: query_mode of the config)")
+    parser.add_argument('--metrics-out', default=None,
+                        help="file receiving the stage latencies and counters: Prometheus text for .prom, JSON lines otherwise")
+    args = parser.parse_args()
+
+    config_json = load_config(args.config)
+    metrics.configure(config_json.get('metrics_config', {}))
+    runner = Batch_Query_Runner(config_json,
+                                optimized_DB_query=args.optimized_DB_query,
+                                use_llm_response=args.use_llm_response,
+                                llm_concurrency=args.llm_concurrency,
+                                use_answer_cache=args.use_answer_cache,
+                                query_mode=args.query_mode)
+    try:
+        summary = runner.run_file(args.input, args.output, args.collection, args.batch_size)
+    finally:
+        runner.close()
+    print(f"{summary['queries']} queries ({summary['errors']} errors) in {summary['total_s']:.2f}s, "
+          f"{summary['queries_per_s']:.1f} queries/s")
+    print(f"Stage totals: rewrite {summary['rewrite_s']:.2f}s, retrieval {summary['retrieval_s']:.2f}s, "
+          f"answer {summary['answer_s']:.2f}s")
+    if summary['context_tokens_saved']:
+        print(f"Context packing saved {summary['context_tokens_saved']} prompt tokens, ~{summary['prefill_saved_s']:.1f}s of prefill")
+    if args.metrics_out:
+        metrics.export(args.metrics_out)
+        print(f"Metrics written to {args.metrics_out}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+Benchmark of OpenAI_Embedding_Client against the local stub server: ingest throughput for
+several concurrency levels, and a run with injected failures to check retries and output order.
+
+Usage:
+    python benchmarks/bench_embedding_client.py [--texts 2048] [--latency-ms 40] [--slots 8]
+"""
+import argparse
+import bench_utils
+from embedding_client import OpenAI_Embedding_Client
+from openai_stub_server import Stub_OpenAI_Server, stub_embedding
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--texts', type=int, default=2048)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--latency-ms', type=float, default=40.0)
+    parser.add_argument('--per-item-latency-ms', type=float, default=0.5)
+    parser.add_argument('--slots', type=int, default=8)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--fail-rate', type=float, default=0.2)
+    args = parser.parse_args()
+
+    texts = [f"document {i} talks about topic {i % 97} and item {i % 13}" for i in range(args.texts)]
+    batches = [texts[i:i + args.batch_size] for i in range(0, len(texts), args.batch_size)]
+    rows = []
+    with Stub_OpenAI_Server(latency_ms=args.latency_ms, per_item_latency_ms=args.per_item_latency_ms,
+                            slots=args.slots) as server:
+        base_elapsed = None
+        for concurrency in args.concurrency:
+            client = OpenAI_Embedding_Client('stub', server.api_base, 'stub', max_concurrent_requests=concurrency)
+            _, elapsed = bench_utils.timed(client.embed_batches, batches)
+            client.close()
+            base_elapsed = base_elapsed or elapsed
+            rows.append([concurrency, f"{elapsed:.2f}", f"{len(texts) / elapsed:.0f}", f"{base_elapsed / elapsed:.2f}x"])
+    bench_utils.print_table(['concurrency', 'time [s]', 'texts/s', 'speedup'], rows)
+
+    with Stub_OpenAI_Server(latency_ms=args.latency_ms, slots=args.slots, fail_rate=args.fail_rate) as server:
+        client = OpenAI_Embedding_Client('stub', server.api_base, 'stub', max_concurrent_requests=max(args.concurrency),
+                                         max_retries=8, retry_backoff_s=0.01)
+        embeddings = client.embed_batches(batches)
+        client.close()
+        in_order = embeddings == [stub_embedding(text, server.dim) for text in texts]
+        print(f"\nWith {args.fail_rate:.0%} failed requests: {server.stats['failed_requests']} retried, "
+              f"{len(embeddings)} embeddings returned, order preserved: {in_order}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark of re-indexing slightly edited documents (the daily log / manual case): a corpus is
+ingested, a few lines of every document are edited, inserted or appended, and the folder is synced
+again. Compares fixed and content-defined chunk boundaries by the number of chunks that had to be
+embedded again, against the local stub server with the embedding cache disabled.
+
+Usage:
+    python benchmarks/bench_incremental_reindex.py [--docs 20] [--lines 2000] [--latency-ms 20]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import bench_utils
+from helpers import Chroma_Database
+from openai_stub_server import Stub_OpenAI_Server
+
+def make_lines(rng, vocabulary, nr_lines):
+    return [' '.join(rng.choice(vocabulary) for _ in range(rng.randint(5, 20))) + '.' for _ in range(nr_lines)]
+
+def edit_lines(rng, vocabulary, lines):
+    # one changed line, one inserted line and a few appended lines, like a log or manual updated during the day
+    lines = list(lines)
+    lines[rng.randrange(len(lines))] = ' '.join(make_lines(rng, vocabulary, 1))
+    lines.insert(rng.randrange(len(lines)), ' '.join(make_lines(rng, vocabulary, 1)))
+    return lines + make_lines(rng, vocabulary, 5)
+
+def write_corpus(folder, corpus):
+    for name, lines in corpus.items():
+        with open(os.path.join(folder, name), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines))
+
+def sync(cdb, folder):
+    sync_result = cdb.docs_check_sync(folder)
+    cdb.delete_from_collection(sync_result['doc_ids_to_delete'])
+    cdb.add_to_collection()
+    return cdb.last_add_stats
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--docs', type=int, default=20)
+    parser.add_argument('--lines', type=int, default=2000)
+    parser.add_argument('--max-words', type=int, default=1000)
+    parser.add_argument('--overlap-words', type=int, default=50)
+    parser.add_argument('--latency-ms', type=float, default=20.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with open(os.path.join(bench_utils.REPO_ROOT, 'config.json'), 'r') as f:
+        base_config = json.load(f)['chroma_config']
+    tmp_dir = tempfile.mkdtemp(prefix='bench_reindex_')
+    rows = []
+    try:
+        with Stub_OpenAI_Server(latency_ms=args.latency_ms) as server:
+            for boundaries in ['fixed', 'content']:
+                rng = random.Random(args.seed)
+                vocabulary = [f"term{i}" for i in range(5000)]
+                corpus = {f"doc_{i}.txt": make_lines(rng, vocabulary, args.lines) for i in range(args.docs)}
+                docs_folder = os.path.join(tmp_dir, boundaries, 'docs')
+                os.makedirs(docs_folder)
+                write_corpus(docs_folder, corpus)
+
+                config = json.loads(json.dumps(base_config))
+                config['CHROMA_DATA_PATH'] = os.path.join(tmp_dir, boundaries, 'db')
+                config['OpenAI_embedding_config'].update(api_base=server.api_base, client='pooled')
+                config['embedding_cache'] = {'enabled': False}
+                config['query_cache'] = {'enabled': False}
+                config['add_to_collection_config'].update(max_words_per_chunk=args.max_words,
+                                                          overlap_words=args.overlap_words,
+                                                          chunk_boundaries=boundaries)
+                cdb = Chroma_Database(config)
+                cdb.init_collection('bench_reindex')
+                initial_stats, initial_s = bench_utils.timed(sync, cdb, docs_folder)
+                initial_chunks = initial_stats['embedded']
+
+                write_corpus(docs_folder, {name: edit_lines(rng, vocabulary, lines) for name, lines in corpus.items()})
+                stats, elapsed = bench_utils.timed(sync, cdb, docs_folder)
+                rows.append([boundaries, initial_chunks, f"{initial_s:.2f}", stats['embedded'], stats['reused'],
+                             stats['unchanged'], stats['deleted'], f"{stats['embedded'] / initial_chunks:.1%}", f"{elapsed:.2f}"])
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    bench_utils.print_table(['boundaries', 'chunks', 'ingest [s]', 're-embedded', 'reused', 'unchanged',
+                             'deleted', 're-embedded share', 'resync [s]'], rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Peak memory and throughput of reading, hashing and splitting one large text file:
+- memory: the whole file read and decoded (read_file_hashed), then split (split_documents)
+- streamed: hashed and checked from its memory map, then split while streaming it (Streamed_Chunks),
+  the path add_to_collection takes for files above 'stream_threshold_mb'
+Every chunk is hashed, as when it is written. Each mode runs in its own process so its peak RSS is its own.
+
+Usage:
+    python benchmarks/bench_large_file.py [--mb 256]
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import bench_utils
+from helpers import (Streamed_Chunks, check_mapped_file, get_chunk_hash, make_text_splitter, read_file_hashed,
+                     split_documents)
+from synthetic_corpus import generate_corpus
+
+def run_mode(mode, file_path, add_config):
+    start = time.perf_counter()
+    splitter = make_text_splitter(add_config)
+    if mode == 'memory':
+        content, content_hash = read_file_hashed(file_path)
+        each_doc = next(split_documents([{'document': content}], splitter))
+        del content
+        chunk_hashes = each_doc['chunk_hashes']
+    else:
+        content_hash = check_mapped_file(file_path)
+        chunk_hashes = [get_chunk_hash(chunk) for chunk in Streamed_Chunks(file_path, splitter)]
+    return {'mode': mode, 'seconds': time.perf_counter() - start, 'peak_rss_mb': bench_utils.peak_rss_mb(),
+            'chunks': len(chunk_hashes), 'content_hash': content_hash, 'chunks_hash': get_chunk_hash(''.join(chunk_hashes))}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mb', type=int, default=256, help="size of the generated file")
+    parser.add_argument('--run-mode', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--file', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    with open(os.path.join(bench_utils.REPO_ROOT, 'config.json'), 'r') as f:
+        add_config = json.load(f)['chroma_config']['add_to_collection_config']
+    if args.run_mode:
+        print(json.dumps(run_mode(args.run_mode, args.file, add_config)))
+        return
+
+    tmp_dir = tempfile.mkdtemp(prefix='bench_large_file_')
+    try:
+        # one big file made of synthetic documents
+        generate_corpus(os.path.join(tmp_dir, 'docs'), max(1, args.mb // 4), 600_000, distribution='fixed')
+        file_path = os.path.join(tmp_dir, 'large.txt')
+        with open(file_path, 'wb') as large_file:
+            for file_name in sorted(os.listdir(os.path.join(tmp_dir, 'docs'))):
+                with open(os.path.join(tmp_dir, 'docs', file_name), 'rb') as f:
+                    shutil.copyfileobj(f, large_file)
+        size_mb = os.path.getsize(file_path) / 1e6
+        print(f"File: {size_mb:.0f} MB")
+        baseline = subprocess.run([sys.executable, '-c', 'import bench_utils, helpers; print(bench_utils.peak_rss_mb())'],
+                                  cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True)
+        rows = []
+        results = []
+        for mode in ('memory', 'streamed'):
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), '--run-mode', mode, '--file', file_path],
+                                    capture_output=True, text=True, check=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            results.append(result)
+            rows.append([mode, f"{result['seconds']:.1f}", f"{size_mb / result['seconds']:.1f}", result['chunks'],
+                         f"{result['peak_rss_mb']:.0f}" if result['peak_rss_mb'] is not None else '-'])
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    print()
+    bench_utils.print_table(['mode', 'seconds', 'MB/s', 'chunks', 'peak RSS [MB]'], rows)
+    print(f"(peak RSS after the imports alone: {float(baseline.stdout.strip()):.0f} MB)")
+    print(f"same content hash and chunks: {len({(result['content_hash'], result['chunks_hash']) for result in results}) == 1}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Benchmark of the BM25 keyword index (lexical_index.py) on a synthetic corpus:
+- index size on disk against the size of the indexed text
+- build cost (full ingest) and update cost (re-indexed and deleted chunks)
+- query latency of keyword queries on the index alone, and of query_collection in 'vector', 'keyword'
+  and 'hybrid' modes against the local stub embedding server (query cache disabled, every query new)
+Every document gets a part number like PN-12345 so exact-term lookups can be timed too.
+
+Usage:
+    python benchmarks/bench_lexical_index.py [--docs 300] [--mean-words 1000] [--queries 200] [--latency-ms 20]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import bench_utils
+from helpers import Chroma_Database, make_text_splitter, read_text_files
+from lexical_index import Lexical_Index
+from openai_stub_server import Stub_OpenAI_Server
+from synthetic_corpus import generate_corpus, make_queries
+
+def add_part_numbers(docs_folder, rng):
+    # one part number per document, returned so they can be looked up
+    part_numbers = []
+    for file_name in sorted(os.listdir(docs_folder)):
+        part_number = f"PN-{rng.randrange(10000, 99999)}"
+        with open(os.path.join(docs_folder, file_name), 'a', encoding='utf-8') as f:
+            f.write(f"\nReplacement part: {part_number}.\n")
+        part_numbers.append(part_number)
+    return part_numbers
+
+def split_corpus(docs_folder, add_config):
+    splitter = make_text_splitter(add_config)
+    chunk_ids, chunks = [], []
+    for doc_nr, document in enumerate(read_text_files(docs_folder)['documents']):
+        for chunk_nr, chunk in enumerate(splitter.split_text(document)):
+            chunk_ids.append(f"{doc_nr}>{chunk_nr}")
+            chunks.append(chunk)
+    return chunk_ids, chunks
+
+def latency_row(name, latencies):
+    return [name, len(latencies), f"{bench_utils.percentile(latencies, 50) * 1000:.2f}",
+            f"{bench_utils.percentile(latencies, 95) * 1000:.2f}", f"{bench_utils.percentile(latencies, 99) * 1000:.2f}"]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--docs', type=int, default=300)
+    parser.add_argument('--mean-words', type=int, default=1000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--n-results', type=int, default=5)
+    parser.add_argument('--update-fraction', type=float, default=0.01, help="share of the chunks re-indexed / deleted")
+    parser.add_argument('--latency-ms', type=float, default=20.0, help="stub embedding server latency")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    tmp_dir = tempfile.mkdtemp(prefix='bench_lexical_')
+    try:
+        docs_folder = os.path.join(tmp_dir, 'docs')
+        corpus = generate_corpus(docs_folder, args.docs, args.mean_words, seed=args.seed)
+        part_numbers = add_part_numbers(docs_folder, rng)
+        with open(os.path.join(bench_utils.REPO_ROOT, 'config.json'), 'r') as f:
+            config = json.load(f)['chroma_config']
+        chunk_ids, chunks = split_corpus(docs_folder, config['add_to_collection_config'])
+        text_bytes = sum(len(chunk.encode('utf-8')) for chunk in chunks)
+        print(f"Corpus: {corpus['files']} files, {len(chunks)} chunks, {text_bytes / 1e6:.1f} MB of chunk text")
+
+        # index alone: build, size, updates, queries
+        index = Lexical_Index(os.path.join(tmp_dir, 'bench.sqlite3'))
+        start = time.perf_counter()
+        for i in range(0, len(chunks), 1024):
+            index.upsert(chunk_ids[i:i + 1024], chunks[i:i + 1024])
+        build_s = time.perf_counter() - start
+        size_before_optimize = index.size_bytes()
+        index.optimize()
+        size_rows = [['index (as built)', f"{size_before_optimize / 1e6:.1f}", f"{size_before_optimize / text_bytes:.2f}"],
+                     ['index (after optimize)', f"{index.size_bytes() / 1e6:.1f}", f"{index.size_bytes() / text_bytes:.2f}"]]
+
+        nr_updated = max(1, int(len(chunks) * args.update_fraction))
+        updated = rng.sample(range(len(chunks)), nr_updated)
+        _, update_s = bench_utils.timed(index.upsert, [chunk_ids[i] for i in updated], [chunks[i][::-1] for i in updated])
+        deleted = rng.sample(range(len(chunks)), nr_updated)
+        _, delete_s = bench_utils.timed(index.delete, [chunk_ids[i] for i in deleted])
+        cost_rows = [['build', len(chunks), f"{build_s:.2f}", f"{len(chunks) / build_s:.0f}", f"{build_s / len(chunks) * 1000:.3f}"],
+                     ['re-index', nr_updated, f"{update_s:.3f}", f"{nr_updated / update_s:.0f}", f"{update_s / nr_updated * 1000:.3f}"],
+                     ['delete', nr_updated, f"{delete_s:.3f}", f"{nr_updated / delete_s:.0f}", f"{delete_s / nr_updated * 1000:.3f}"]]
+
+        # same vocabulary as the corpus, a different slice of queries for every run below
+        all_queries = make_queries(args.queries * (1 + len(Chroma_Database.QUERY_MODES)), seed=args.seed)
+        word_queries = all_queries[:args.queries]
+        code_queries = [f"Which document lists part {part_number}?" for part_number in rng.choices(part_numbers, k=args.queries)]
+        latency_rows = [latency_row('index: words', [bench_utils.timed(index.search, query, args.n_results)[1] for query in word_queries]),
+                        latency_row('index: part numbers', [bench_utils.timed(index.search, query, args.n_results)[1] for query in code_queries])]
+        index.close()
+
+        # through query_collection, against the stub embedding server
+        with Stub_OpenAI_Server(latency_ms=args.latency_ms) as server:
+            config['CHROMA_DATA_PATH'] = os.path.join(tmp_dir, 'db')
+            config['OpenAI_embedding_config']['api_base'] = server.api_base
+            config['query_cache'] = {'enabled': False}
+            config['query_nr_results'] = args.n_results
+            cdb = Chroma_Database(config)
+            cdb.init_collection('bench_lexical')
+            cdb.docs_check_sync(docs_folder)
+            cdb.add_to_collection()
+            for mode_nr, mode in enumerate(Chroma_Database.QUERY_MODES, start=1):
+                # every mode gets queries it has not seen, so the embedding cache of the queries does not help
+                queries = all_queries[mode_nr * args.queries:(mode_nr + 1) * args.queries]
+                embedded_before = server.stats['embedded_texts']
+                latencies = [bench_utils.timed(cdb.query_collection, query, mode=mode)[1] for query in queries]
+                latency_rows.append(latency_row(f"query_collection: {mode}", latencies) + [server.stats['embedded_texts'] - embedded_before])
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    print()
+    bench_utils.print_table(['size', 'MB', 'x chunk text'], size_rows)
+    print()
+    bench_utils.print_table(['operation', 'chunks', 'total [s]', 'chunks/s', 'per chunk [ms]'], cost_rows)
+    print()
+    bench_utils.print_table(['queries', 'n', 'p50 [ms]', 'p95 [ms]', 'p99 [ms]', 'embedded texts'],
+                            [row + ['-'] * (6 - len(row)) for row in latency_rows])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Scaling of the CPU-bound ingest stages (hashing, decoding, splitting) with the number of processes of the
+ingest CPU pool ('cpu_workers' in 'add_to_collection_config'), on a synthetic corpus:
+- hash: hash_text_files over the folder (no manifest, every file hashed)
+- read + split: the documents add_to_collection hands to the embedding / write stage
+1 worker is the in-process path. Pool start-up (spawning the processes) is timed apart, it is paid
+once per process. Every run is checked to give the same chunks as the in-process path.
+
+Usage:
+    python benchmarks/bench_parallel_ingest.py [--docs 400] [--mean-words 5000] [--workers 1 4 0]
+(0 = one process per core)
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import bench_utils
+from helpers import (FILE_BATCH_ITEMS, CPU_Pool, discover_text_files, hash_text_files, make_text_splitter, read_documents,
+                     read_split_documents_parallel, split_documents)
+from synthetic_corpus import generate_corpus
+
+def chunk_hashes(documents):
+    return [(each_doc['doc_id'], tuple(each_doc['chunk_hashes'])) for each_doc in documents]
+
+def run_stages(files, add_config, pool):
+    # (hash seconds, read + split seconds, chunk hashes)
+    executor = pool.get_executor()
+    _, hash_s = bench_utils.timed(lambda: list(hash_text_files(files, None, executor, 2 * pool.workers)))
+    if executor is None:
+        documents, split_s = bench_utils.timed(lambda: chunk_hashes(split_documents(read_documents(files), make_text_splitter(add_config))))
+    else:
+        documents, split_s = bench_utils.timed(lambda: chunk_hashes(read_split_documents_parallel(files, add_config, executor, 2 * pool.workers)))
+    return hash_s, split_s, documents
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--docs', type=int, default=400)
+    parser.add_argument('--mean-words', type=int, default=5000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 0], help="pool sizes to run, 0 = one per core")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with open(os.path.join(bench_utils.REPO_ROOT, 'config.json'), 'r') as f:
+        add_config = json.load(f)['chroma_config']['add_to_collection_config']
+    tmp_dir = tempfile.mkdtemp(prefix='bench_parallel_ingest_')
+    rows = []
+    try:
+        docs_folder = os.path.join(tmp_dir, 'docs')
+        corpus = generate_corpus(docs_folder, args.docs, args.mean_words, seed=args.seed)
+        print(f"Corpus: {corpus['files']} files, {corpus['words']} words, {corpus['bytes'] / 1e6:.1f} MB, {os.cpu_count()} cores")
+        files = list(discover_text_files(docs_folder))
+        reference = None
+        baseline = None
+        for workers in args.workers:
+            pool = CPU_Pool(workers)
+            # the executor spawns its processes as work comes in: a warm-up run with a batch per process, timed as the start-up
+            _, startup_s = bench_utils.timed(run_stages, files[:pool.workers * FILE_BATCH_ITEMS], add_config, pool)
+            runs = [run_stages(files, add_config, pool) for _ in range(args.repeat)]
+            pool.close()
+            hash_s = min(run[0] for run in runs)
+            split_s = min(run[1] for run in runs)
+            if reference is None:
+                reference = runs[0][2]
+            same_chunks = all(run[2] == reference for run in runs)
+            if baseline is None:
+                baseline = (hash_s, split_s)
+            rows.append([pool.workers, f"{startup_s:.2f}",
+                         f"{corpus['bytes'] / 1e6 / hash_s:.0f}", f"{baseline[0] / hash_s:.2f}x",
+                         f"{corpus['bytes'] / 1e6 / split_s:.1f}", f"{baseline[1] / split_s:.2f}x",
+                         'yes' if same_chunks else 'NO'])
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    print()
+    bench_utils.print_table(['workers', 'start-up [s]', 'hash [MB/s]', 'hash speed-up',
+                             'read+split [MB/s]', 'read+split speed-up', 'same chunks'], rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+End-to-end benchmark suite of the RAG pipeline, on a synthetic corpus and against the local stub server
+(no model, no GPU, no network):
+    read_text_files, split_text, docs_check_sync (new folder, then in sync), add_to_collection,
+    query_collection (cold, then cached) and ask (retrieval, prompt building and streamed answer)
+Each stage reports its throughput, the p50/p95/p99 latency of its operations and the peak RSS reached so far.
+Results go to a JSON file so runs of different versions can be compared with --compare.
+
+Usage:
+    python benchmarks/bench_pipeline.py [--docs 200] [--mean-words 2000] [--queries 200]
+                                        [--output pipeline.json] [--compare previous.json]
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import bench_utils
+from helpers import Chroma_Database, make_text_splitter, read_text_files
+from batch_query import Batch_Query_Runner
+from openai_stub_server import Stub_OpenAI_Server
+from synthetic_corpus import SIZE_DISTRIBUTIONS, generate_corpus, make_queries
+
+class Stage_Results:
+    def __init__(self):
+        self.stages = {}
+
+    def record(self, name, latencies, items, unit, nr_bytes = None, elapsed = None):
+        """
+        latencies: seconds taken by each operation of the stage; items: work done (in unit) over
+        elapsed seconds (the sum of the latencies by default).
+        """
+        if elapsed is None:
+            elapsed = sum(latencies)
+        result = {'operations': len(latencies),
+                  'total_s': elapsed,
+                  'throughput': items / elapsed if elapsed > 0 else None,
+                  'throughput_unit': f"{unit}/s",
+                  'p50_ms': bench_utils.percentile(latencies, 50) * 1000,
+                  'p95_ms': bench_utils.percentile(latencies, 95) * 1000,
+                  'p99_ms': bench_utils.percentile(latencies, 99) * 1000,
+                  'peak_rss_mb': bench_utils.peak_rss_mb()}
+        if nr_bytes is not None and elapsed > 0:
+            result['mb_per_s'] = nr_bytes / 1e6 / elapsed
+        self.stages[name] = result
+        print(f"{name}: {result['throughput']:.1f} {result['throughput_unit']}, p50 {result['p50_ms']:.2f}ms")
+
+def timed_calls(func, args_list):
+    # latency of func(*args) for every args in args_list
+    latencies = []
+    for args in args_list:
+        _, elapsed = bench_utils.timed(func, *args)
+        latencies.append(elapsed)
+    return latencies
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=bench_utils.REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_suite(args, tmp_dir, results):
+    docs_folder = os.path.join(tmp_dir, 'docs')
+    corpus = generate_corpus(docs_folder, args.docs, args.mean_words, args.distribution, args.sigma,
+                             args.vocabulary, seed=args.seed)
+    print(f"Corpus: {corpus['files']} files, {corpus['words']} words, {corpus['bytes'] / 1e6:.1f} MB")
+
+    with open(os.path.join(bench_utils.REPO_ROOT, 'config.json'), 'r') as f:
+        config = json.load(f)
+    with Stub_OpenAI_Server(latency_ms=args.embedding_latency_ms, per_item_latency_ms=args.per_item_latency_ms,
+                            slots=args.slots, chat_ttft_ms=args.chat_ttft_ms, chat_token_ms=args.chat_token_ms,
+                            chat_tokens=args.chat_tokens) as server:
+        chroma_config = config['chroma_config']
+        chroma_config['CHROMA_DATA_PATH'] = os.path.join(tmp_dir, 'db')
+        chroma_config['OpenAI_embedding_config']['api_base'] = server.api_base
+        config['rag_config']['llm_agent_config']['base_url'] = server.api_base
+
+        # read + split, in memory
+        latencies = timed_calls(read_text_files, [(docs_folder,)] * args.repeat)
+        results.record('read_text_files', latencies, corpus['files'] * args.repeat, 'files', corpus['bytes'] * args.repeat)
+        documents = read_text_files(docs_folder)['documents']
+        splitter = make_text_splitter(chroma_config['add_to_collection_config'])
+        latencies = timed_calls(splitter.split_text, [(document,) for document in documents])
+        results.record('split_text', latencies, corpus['words'], 'words', sum(len(document.encode('utf-8')) for document in documents))
+        del documents
+
+        # ingest
+        cdb = Chroma_Database(chroma_config)
+        cdb.init_collection('bench_pipeline')
+        _, elapsed = bench_utils.timed(cdb.docs_check_sync, docs_folder)
+        results.record('docs_check_sync (new folder)', [elapsed], corpus['files'], 'files', corpus['bytes'])
+        batch_latencies = []
+        last_progress = time.perf_counter()
+
+        def on_progress(stage, value):
+            nonlocal last_progress
+            now = time.perf_counter()
+            batch_latencies.append(now - last_progress)
+            last_progress = now
+
+        last_progress = time.perf_counter()
+        _, elapsed = bench_utils.timed(cdb.add_to_collection, progress=on_progress)
+        results.record('add_to_collection', batch_latencies, cdb.collection.count(), 'chunks', corpus['bytes'], elapsed=elapsed)
+        latencies = timed_calls(cdb.docs_check_sync, [(docs_folder,)] * args.repeat)
+        results.record('docs_check_sync (in sync)', latencies, corpus['files'] * args.repeat, 'files')
+
+        # queries: first time (embedding + search), then the same ones again (query cache)
+        queries = make_queries(args.queries, args.vocabulary, seed=args.seed)
+        latencies = timed_calls(cdb.query_collection, [(query,) for query in queries])
+        results.record('query_collection (cold)', latencies, len(queries), 'queries')
+        latencies = timed_calls(cdb.query_collection, [(query,) for query in queries])
+        results.record('query_collection (cached)', latencies, len(queries), 'queries')
+
+        # ask: rewrite off, retrieval + prompt building + answer, no answer cache
+        runner = Batch_Query_Runner(config, cdb=cdb, optimized_DB_query=False, use_llm_response=True, use_answer_cache=False)
+        ask_queries = make_queries(args.ask_queries, args.vocabulary, seed=args.seed + 100)
+        latencies = timed_calls(runner.query_one, [(query, 'bench_pipeline') for query in ask_queries])
+        results.record('ask', latencies, len(ask_queries), 'queries')
+        runner.close()
+        return corpus, dict(server.stats)
+
+def compare(previous, current):
+    rows = []
+    for name, stage in current['stages'].items():
+        old = previous.get('stages', {}).get(name)
+        if old is None:
+            continue
+        rows.append([name, f"{old['p50_ms']:.2f}", f"{stage['p50_ms']:.2f}", f"{stage['p50_ms'] / old['p50_ms']:.2f}x" if old['p50_ms'] else '-',
+                     f"{old['throughput']:.1f}", f"{stage['throughput']:.1f}",
+                     f"{stage['throughput'] / old['throughput']:.2f}x" if old['throughput'] else '-'])
+    print(f"\nCompared with {previous['meta'].get('commit')} ({previous['meta'].get('timestamp')}):")
+    bench_utils.print_table(['stage', 'old p50 [ms]', 'new p50 [ms]', 'p50 ratio', 'old throughput', 'new throughput', 'throughput ratio'], rows)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--docs', type=int, default=200)
+    parser.add_argument('--mean-words', type=int, default=2000)
+    parser.add_argument('--distribution', choices=SIZE_DISTRIBUTIONS, default='lognormal')
+    parser.add_argument('--sigma', type=float, default=1.0)
+    parser.add_argument('--vocabulary', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--ask-queries', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=3, help="runs of the whole-folder stages")
+    parser.add_argument('--embedding-latency-ms', type=float, default=20.0)
+    parser.add_argument('--per-item-latency-ms', type=float, default=0.5)
+    parser.add_argument('--slots', type=int, default=4)
+    parser.add_argument('--chat-ttft-ms', type=float, default=100.0)
+    parser.add_argument('--chat-token-ms', type=float, default=5.0)
+    parser.add_argument('--chat-tokens', type=int, default=64)
+    parser.add_argument('--output', default='pipeline_benchmark.json')
+    parser.add_argument('--compare', default=None, help="previous JSON output to compare with")
+    parser.add_argument('--keep', action='store_true', help="keep the generated corpus and database")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix='bench_pipeline_')
+    results = Stage_Results()
+    try:
+        corpus, server_stats = run_suite(args, tmp_dir, results)
+    finally:
+        if args.keep:
+            print(f"Corpus and database kept in {tmp_dir}")
+        else:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    output = {'meta': {'commit': git_commit(),
+                       'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'cpu_count': os.cpu_count(),
+                       'args': vars(args),
+                       'corpus': corpus,
+                       'stub_server': server_stats},
+              'stages': results.stages}
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=2)
+    print(f"\nResults written to {args.output}")
+    rows = [[name, stage['operations'], f"{stage['throughput']:.1f} {stage['throughput_unit']}",
+             f"{stage['p50_ms']:.2f}", f"{stage['p95_ms']:.2f}", f"{stage['p99_ms']:.2f}",
+             f"{stage['peak_rss_mb']:.0f}" if stage['peak_rss_mb'] is not None else '-']
+            for name, stage in results.stages.items()]
+    bench_utils.print_table(['stage', 'ops', 'throughput', 'p50 [ms]', 'p95 [ms]', 'p99 [ms]', 'peak RSS [MB]'], rows)
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            compare(json.load(f), output)
+
+if __name__ == "__main__":
+    main()
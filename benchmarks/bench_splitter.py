@@ -0,0 +1,100 @@
+"""
+Benchmark of WordBasedTextSplitter against the previous implementation (word count -> average
+word length -> langchain RecursiveCharacterTextSplitter): throughput and chunk-size accuracy.
+
+Usage:
+    python benchmarks/bench_splitter.py [--mb 4] [--max-words 1000] [--overlap 50]
+
+Two synthetic corpora are used: plain prose, and skewed text mixing prose with long tokens
+(hashes, URLs) and short symbol-heavy lines, where the average word length is misleading.
+Accuracy is measured on all chunks but the last of each document: with an exact splitter
+they hold exactly max_words words.
+"""
+import argparse
+import random
+import statistics
+import bench_utils
+from helpers import WordBasedTextSplitter
+
+WORDS = "the of and to in is was for that on with as by at from this be are it an or which system data file user value".split()
+
+def prose(rnd, nr_words):
+    sentences = []
+    while nr_words > 0:
+        length = rnd.randint(5, 25)
+        sentences.append(' '.join(rnd.choice(WORDS) for _ in range(length)).capitalize() + '.')
+        nr_words -= length
+    return ' '.join(sentences)
+
+def skewed(rnd, nr_words):
+    parts = []
+    while nr_words > 0:
+        kind = rnd.random()
+        if kind < 0.6:
+            parts.append(prose(rnd, 40))
+            nr_words -= 40
+        elif kind < 0.8:
+            parts.append(' '.join(f"{rnd.getrandbits(128):032x}" for _ in range(10)))
+            nr_words -= 10
+        elif kind < 0.9:
+            parts.append(' '.join(f"https://example.com/{rnd.choice(WORDS)}/{rnd.getrandbits(64):x}.html" for _ in range(5)))
+            nr_words -= 25
+        else:
+            parts.append('\n'.join(f"x = {i}; y = x * {i};" for i in range(10)))
+            nr_words -= 60
+    return '\n\n'.join(parts)
+
+def make_corpus(kind, total_mb, doc_words, seed = 0):
+    rnd = random.Random(seed)
+    docs, size = [], 0
+    while size < total_mb * 1_000_000:
+        doc = kind(rnd, rnd.randint(doc_words // 2, doc_words * 2))
+        docs.append(doc)
+        size += len(doc.encode('utf-8'))
+    return docs, size
+
+class Legacy_WordBasedTextSplitter(WordBasedTextSplitter):
+    # the splitter before the single-pass rewrite
+    def words_count(self, text):
+        import re
+        punctuation_pattern = f"[{''.join(re.escape(p) for p in self.punctuations)}]"
+        words_and_punctuations = re.findall(rf'\w+|{punctuation_pattern}', text)
+        return len([token for token in words_and_punctuations if re.match(r'\w+', token)])
+
+    def split_text(self, text):
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+        avg_chars_per_word = len(text) / self.words_count(text=text)
+        splitter = RecursiveCharacterTextSplitter(chunk_size=int(self.max_words_per_chunk * avg_chars_per_word),
+                                                  chunk_overlap=int(self.overlap_words * avg_chars_per_word))
+        return splitter.split_text(text)
+
+def run(splitter, docs, size, max_words):
+    counter = WordBasedTextSplitter(max_words, 0)
+    chunks_per_doc, elapsed = bench_utils.timed(lambda: [splitter.split_text(doc) for doc in docs])
+    sizes = [counter.words_count(chunk) for chunks in chunks_per_doc for chunk in chunks[:-1]]
+    return {'MB/s': size / 1_000_000 / elapsed,
+            'chunks': sum(len(chunks) for chunks in chunks_per_doc),
+            'mean words': statistics.mean(sizes) if sizes else 0,
+            'mean abs error': statistics.mean(abs(s - max_words) for s in sizes) if sizes else 0,
+            'over budget': sum(s > max_words for s in sizes) / len(sizes) if sizes else 0,
+            'max words': max(sizes) if sizes else 0}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mb', type=float, default=4)
+    parser.add_argument('--doc-words', type=int, default=20000)
+    parser.add_argument('--max-words', type=int, default=1000)
+    parser.add_argument('--overlap', type=int, default=50)
+    args = parser.parse_args()
+
+    rows = []
+    for corpus_name, kind in (('prose', prose), ('skewed', skewed)):
+        docs, size = make_corpus(kind, args.mb, args.doc_words)
+        for splitter_name, splitter_class in (('legacy', Legacy_WordBasedTextSplitter), ('native', WordBasedTextSplitter)):
+            result = run(splitter_class(args.max_words, args.overlap), docs, size, args.max_words)
+            rows.append([corpus_name, splitter_name, f"{result['MB/s']:.1f}", result['chunks'], f"{result['mean words']:.0f}",
+                         f"{result['mean abs error']:.1f}", f"{result['over budget']:.1%}", result['max words']])
+    bench_utils.print_table(['corpus', 'splitter', 'MB/s', 'chunks', 'mean words', 'mean |error|', 'over budget', 'max words'], rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Cold start benchmark of AI_RAG_GUI, each run in a fresh interpreter:
+- 'gui imports': importing AI_RAG_GUI, i.e. what runs before the window can show up
+- the steps of load_backend (heavy imports, database, caches and LLM client), run in the background by the GUI
+- 'eager imports': importing everything the GUI imported up front before the lazy imports, for comparison
+Exits with status 1 when the median GUI import time exceeds --max-gui-import-s, so regressions are caught.
+
+Usage:
+    python benchmarks/bench_startup.py [--runs 5] [--max-gui-import-s 0.5]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import bench_utils
+
+GUI_START = """
+import json, sys, time
+start = time.perf_counter()
+import AI_RAG_GUI
+timings = {'gui imports': time.perf_counter() - start}
+with open(sys.argv[1], 'r') as f:
+    config = json.load(f)
+backend, backend_timings = AI_RAG_GUI.load_backend(config)
+timings.update(backend_timings)
+timings['total'] = time.perf_counter() - start
+print(json.dumps(timings))
+"""
+
+EAGER_IMPORTS = """
+import json, time
+start = time.perf_counter()
+import helpers, answer_cache, llm_client, rag_client, autogen
+print(json.dumps({'eager imports': time.perf_counter() - start}))
+"""
+
+def run_snippet(snippet, *args):
+    output = subprocess.run([sys.executable, '-c', snippet, *args], cwd=bench_utils.REPO_ROOT,
+                            capture_output=True, text=True, check=True).stdout
+    # the timings are on the last line, libraries may print before
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-gui-import-s', type=float, default=0.5)
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix='bench_startup_')
+    try:
+        with open(os.path.join(bench_utils.REPO_ROOT, 'config.json'), 'r') as f:
+            config = json.load(f)
+        config['chroma_config']['CHROMA_DATA_PATH'] = os.path.join(tmp_dir, 'db')
+        config_path = os.path.join(tmp_dir, 'config.json')
+        with open(config_path, 'w') as f:
+            json.dump(config, f)
+        runs = []
+        for _ in range(args.runs):
+            timings = run_snippet(GUI_START, config_path)
+            timings.update(run_snippet(EAGER_IMPORTS))
+            runs.append(timings)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    rows = []
+    for step in runs[0]:
+        values = [each_run[step] for each_run in runs]
+        rows.append([step, f"{statistics.median(values):.3f}", f"{min(values):.3f}", f"{max(values):.3f}"])
+    bench_utils.print_table(['step', 'median [s]', 'min [s]', 'max [s]'], rows)
+
+    gui_imports = statistics.median(each_run['gui imports'] for each_run in runs)
+    if gui_imports > args.max_gui_import_s:
+        print(f"\nREGRESSION: importing AI_RAG_GUI takes {gui_imports:.3f}s (limit {args.max_gui_import_s}s)")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
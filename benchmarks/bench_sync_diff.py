@@ -0,0 +1,78 @@
+"""
+Benchmark of the docs_check_sync diff engine against the previous list-based implementation.
+
+Usage:
+    python benchmarks/bench_sync_diff.py [--chunks 10000 100000 1000000] [--legacy-max 20000]
+
+A fake collection serves the chunk metadatas page by page, so only the diff itself is measured
+(no Chroma, no embedding server). The legacy algorithm is quadratic and only run up to --legacy-max chunks.
+"""
+import argparse
+import bench_utils
+from helpers import diff_collection, iter_collection_metadatas
+
+class Fake_Collection:
+    def __init__(self, ids, metadatas):
+        self.ids = ids
+        self.metadatas = metadatas
+
+    def get(self, include=None, limit=None, offset=0):
+        return {'ids': self.ids[offset:offset + limit], 'metadatas': self.metadatas[offset:offset + limit]}
+
+def make_dataset(nr_chunks, chunks_per_doc=10, changed_ratio=0.05):
+    nr_docs = nr_chunks // chunks_per_doc
+    ids, metadatas = [], []
+    for doc_nr in range(nr_docs):
+        for chunk_nr in range(chunks_per_doc):
+            ids.append(f"doc{doc_nr}>{chunk_nr}")
+            metadatas.append({"doc_path": f"/docs/doc{doc_nr}.txt", "doc_chunk": f"{chunk_nr}", "doc_hash": f"hash{doc_nr}"})
+    step = int(1 / changed_ratio)
+    doc_index = {}
+    for doc_nr in range(nr_docs):
+        if doc_nr % step == 1:
+            continue  # removed from disk
+        content_hash = f"hash{doc_nr}-v2" if doc_nr % step == 2 else f"hash{doc_nr}"
+        doc_index[f"doc{doc_nr}"] = {"content_hash": content_hash}
+    for doc_nr in range(nr_docs, nr_docs + nr_docs // step):
+        doc_index[f"doc{doc_nr}"] = {"content_hash": f"hash{doc_nr}"}  # new on disk
+    return Fake_Collection(ids, metadatas), doc_index
+
+def legacy_diff(collection, doc_index):
+    # the previous docs_check_sync algorithm, kept here for comparison
+    content_hashes = [each_file['content_hash'] for each_file in doc_index.values()]
+    doc_ids = list(doc_index)
+    stored_docs = collection.get(limit=len(collection.ids))
+    stored_ids = stored_docs['ids']
+    doc_ids_2del = []
+    for each_stored_idx, stored_id in enumerate(stored_ids):
+        stored_doc_id = stored_id.split('>', 1)[0]
+        if stored_doc_id not in doc_ids:
+            doc_ids_2del.append(stored_id)
+        elif stored_docs['metadatas'][each_stored_idx]['doc_hash'] not in content_hashes:
+            doc_ids_2del.append(stored_id)
+    after_del_stored_doc_ids = [item for item in stored_ids if item not in doc_ids_2del]
+    after_del_stored_doc_ids = [s.split('>', 1)[0] for s in after_del_stored_doc_ids]
+    new_doc_ids = [item for item in doc_ids if item not in after_del_stored_doc_ids]
+    return {'new_doc_ids': new_doc_ids, 'doc_ids_to_delete': doc_ids_2del}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chunks', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--legacy-max', type=int, default=20_000)
+    parser.add_argument('--page-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    rows = []
+    for nr_chunks in args.chunks:
+        collection, doc_index = make_dataset(nr_chunks)
+        result, elapsed = bench_utils.timed(diff_collection, iter_collection_metadatas(collection, args.page_size), doc_index)
+        legacy = '-'
+        if nr_chunks <= args.legacy_max:
+            _, legacy_elapsed = bench_utils.timed(legacy_diff, collection, doc_index)
+            legacy = f"{legacy_elapsed:.3f}"
+        rows.append([nr_chunks, len(doc_index), len(result['new_doc_ids']), len(result['doc_ids_to_delete']),
+                     f"{elapsed:.3f}", legacy])
+    bench_utils.print_table(['chunks', 'docs on disk', 'to add', 'chunks to delete', 'diff [s]', 'legacy [s]'], rows)
+
+if __name__ == "__main__":
+    main()
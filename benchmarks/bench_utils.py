@@ -0,0 +1,40 @@
+"""
+Shared helpers for the benchmark scripts in this folder.
+Importing this module makes the repository root importable (helpers, etc.).
+"""
+import math
+import os
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+# benchmarks run offline: no usage reports from chromadb
+os.environ.setdefault('ANONYMIZED_TELEMETRY', 'False')
+
+def timed(func, *args, **kwargs):
+    # Returns (result, elapsed seconds)
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def print_table(header, rows):
+    widths = [max(len(str(value)) for value in column) for column in zip(header, *rows)]
+    for row in [header] + rows:
+        print("  ".join(str(value).rjust(width) for value, width in zip(row, widths)))
+
+def percentile(values, q):
+    # nearest-rank percentile (q in 0..100) of a non-empty list
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+def peak_rss_mb():
+    # peak resident memory of this process so far, None where the resource module is missing (Windows)
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
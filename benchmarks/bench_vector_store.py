@@ -0,0 +1,151 @@
+"""
+Chroma against the memory-mapped NumPy store (vector_store.py, float16 and int8) on the same collection:
+the same ids, embeddings, texts and metadatas written to each backend. Measures
+- write: time to upsert the collection
+- disk: size of the backend's folder
+- open: time for a fresh process to open the collection and answer a first query
+- query: latency of single-embedding queries (p50 / p95), as Chroma_Database.vector_query sends them
+- recall@k: against the exact top-k computed in float32
+- RSS: peak resident memory of the querying process above the one after the imports (mapped files included)
+Each backend is queried in its own process. Embeddings are clustered random unit vectors, the queries noisy
+copies of stored ones.
+
+Usage:
+    python benchmarks/bench_vector_store.py [--chunks 20000] [--dim 768] [--queries 200] [--k 10]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import bench_utils
+import numpy as np
+
+BACKENDS = ('chroma', 'numpy-float16', 'numpy-int8')
+
+def open_collection(backend, folder):
+    if backend == 'chroma':
+        import chromadb
+        return chromadb.PersistentClient(path=folder).get_collection('bench')
+    from vector_store import Numpy_Vector_Store
+    return Numpy_Vector_Store(folder).get_collection('bench')
+
+def create_collection(backend, folder):
+    if backend == 'chroma':
+        import chromadb
+        client = chromadb.PersistentClient(path=folder)
+    else:
+        from vector_store import Numpy_Vector_Store
+        client = Numpy_Vector_Store(folder, dtype=backend.split('-')[1])
+    return client, client.create_collection('bench', metadata={"hnsw:space": "cosine"})
+
+def folder_size_mb(folder):
+    return sum(os.path.getsize(os.path.join(path, name)) for path, _, names in os.walk(folder) for name in names) / 1e6
+
+def make_collection_data(nr_chunks, dim, chunk_words, seed):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(1, nr_chunks // 100), dim)).astype(np.float32)
+    embeddings = centers[rng.integers(0, len(centers), nr_chunks)] + 0.6 * rng.normal(size=(nr_chunks, dim)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    words = [f"w{i}" for i in range(5000)]
+    text_rng = random.Random(seed)
+    ids, documents, metadatas = [], [], []
+    for i in range(nr_chunks):
+        doc_id, chunk_index = f"{i // 8:064x}", i % 8
+        ids.append(f"{doc_id}>{chunk_index}")
+        documents.append(' '.join(text_rng.choices(words, k=chunk_words)))
+        metadatas.append({'doc_path': f"/docs/folder{i // 800}/doc{i // 8}.txt", 'doc_hash': doc_id,
+                          'doc_chunk': str(chunk_index), 'chunk_hash': f"{i:064x}"})
+    return ids, embeddings, documents, metadatas
+
+def process_peak_rss_mb():
+    # ru_maxrss of a child keeps the peak of the parent it was forked from; VmHWM starts again at exec
+    try:
+        with open('/proc/self/status', 'r') as f:
+            return next(int(line.split()[1]) / 1024 for line in f if line.startswith('VmHWM:'))
+    except (OSError, StopIteration):
+        return bench_utils.peak_rss_mb()
+
+def run_queries(backend, folder, queries_path, k):
+    # in its own process: open, query one embedding at a time, report latencies, results and memory
+    baseline_mb = process_peak_rss_mb()
+    queries = np.load(queries_path)
+    start = time.perf_counter()
+    collection = open_collection(backend, folder)
+    collection.query(query_embeddings=[queries[0].tolist()], n_results=k, include=['documents', 'metadatas', 'distances'])
+    open_s = time.perf_counter() - start
+    latencies = []
+    result_ids = []
+    for query in queries:
+        start = time.perf_counter()
+        results = collection.query(query_embeddings=[query.tolist()], n_results=k, include=['documents', 'metadatas', 'distances'])
+        latencies.append(time.perf_counter() - start)
+        result_ids.append(results['ids'][0])
+    peak_mb = process_peak_rss_mb()
+    return {'open_s': open_s, 'latencies': latencies, 'ids': result_ids,
+            'rss_mb': None if peak_mb is None else peak_mb - baseline_mb}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chunks', type=int, default=20000)
+    parser.add_argument('--dim', type=int, default=768)
+    parser.add_argument('--chunk-words', type=int, default=300)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--query-backend', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--folder', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--queries-file', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.query_backend:
+        print(json.dumps(run_queries(args.query_backend, args.folder, args.queries_file, args.k)))
+        return
+
+    ids, embeddings, documents, metadatas = make_collection_data(args.chunks, args.dim, args.chunk_words, args.seed)
+    rng = np.random.default_rng(args.seed + 1)
+    queries = embeddings[rng.integers(0, len(embeddings), args.queries)] + 0.03 * rng.normal(size=(args.queries, args.dim)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    # exact top-k, float32
+    truth = [set(ids[i] for i in np.argsort(-(embeddings @ query))[:args.k]) for query in queries]
+    print(f"Collection: {args.chunks} chunks, {args.dim} dimensions, {args.chunk_words} words each; "
+          f"{args.queries} queries, k={args.k}")
+
+    tmp_dir = tempfile.mkdtemp(prefix='bench_vector_store_')
+    rows = []
+    try:
+        queries_path = os.path.join(tmp_dir, 'queries.npy')
+        np.save(queries_path, queries)
+        for backend in BACKENDS:
+            folder = os.path.join(tmp_dir, backend)
+            client, collection = create_collection(backend, folder)
+            batch_size = min(5000, client.get_max_batch_size())
+            start = time.perf_counter()
+            for batch_start in range(0, len(ids), batch_size):
+                batch = slice(batch_start, batch_start + batch_size)
+                collection.upsert(ids=ids[batch], embeddings=embeddings[batch].tolist(), documents=documents[batch],
+                                  metadatas=metadatas[batch])
+            write_s = time.perf_counter() - start
+            del collection, client
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), '--query-backend', backend, '--folder', folder,
+                                     '--queries-file', queries_path, '--k', str(args.k)],
+                                    capture_output=True, text=True, check=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            recall = sum(len(truth[i] & set(result_ids)) for i, result_ids in enumerate(result['ids'])) / (args.k * len(queries))
+            rows.append([backend, f"{write_s:.1f}", f"{folder_size_mb(folder):.0f}", f"{result['open_s']:.2f}",
+                         f"{bench_utils.percentile(result['latencies'], 50) * 1000:.1f}",
+                         f"{bench_utils.percentile(result['latencies'], 95) * 1000:.1f}",
+                         f"{recall:.3f}", f"{result['rss_mb']:.0f}" if result['rss_mb'] is not None else '-'])
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    print()
+    bench_utils.print_table(['backend', 'write [s]', 'disk [MB]', 'open [s]', 'p50 [ms]', 'p95 [ms]', f"recall@{args.k}", 'RSS [MB]'], rows)
+    print(f"(vectors alone: {args.chunks * args.dim * 4 / 1e6:.0f} MB in float32)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Local stub of an OpenAI-compatible server (the subset of the LM Studio API used by MySmplRAG),
+so the embedding path can be exercised and benchmarked without a model or network.
+
+Usage:
+    python benchmarks/openai_stub_server.py --port 1234 --latency-ms 50 --slots 4
+
+or from Python:
+    with Stub_OpenAI_Server(latency_ms=50, slots=4) as server:
+        config['api_base'] = server.api_base
+
+Embeddings are deterministic feature-hashed bag-of-words vectors, so texts sharing words are
+close to each other. Chat completions (streamed or not) echo words of the prompt after a
+configurable time-to-first-token and per-token delay. 'slots' limits how many requests are processed at the same time, like the
+parallel slots of a local inference server.
+"""
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORD_PATTERN = re.compile(r'\w+')
+
+def stub_embedding(text, dim):
+    vector = [0.0] * dim
+    for word in WORD_PATTERN.findall(text.lower()):
+        word_hash = zlib.crc32(word.encode('utf-8'))
+        vector[word_hash % dim] += 1.0 if (word_hash >> 16) & 1 else -1.0
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+class Stub_OpenAI_Server:
+    def __init__(self, host = '127.0.0.1', port = 0, latency_ms = 0.0, per_item_latency_ms = 0.0,
+                 slots = 4, fail_rate = 0.0, dim = 256, seed = 0,
+                 chat_ttft_ms = 0.0, chat_token_ms = 0.0, chat_tokens = 32):
+        self.latency_ms = latency_ms
+        self.per_item_latency_ms = per_item_latency_ms
+        self.fail_rate = fail_rate
+        self.dim = dim
+        self.chat_ttft_ms = chat_ttft_ms
+        self.chat_token_ms = chat_token_ms
+        self.chat_tokens = chat_tokens
+        self.slots = threading.Semaphore(slots)
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+        self.stats = {'requests': 0, 'failed_requests': 0, 'embedded_texts': 0, 'chat_completions': 0}
+        self.httpd = ThreadingHTTPServer((host, port), self.make_handler())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def api_base(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def count(self, key, value = 1):
+        with self.stats_lock:
+            self.stats[key] += value
+
+    def should_fail(self):
+        with self.random_lock:
+            return self.random.random() < self.fail_rate
+
+    def chat_tokens_for(self, messages):
+        words = WORD_PATTERN.findall(messages[-1]['content']) if len(messages) else []
+        words = words or ['stub']
+        return [f"{words[i % len(words)]} " for i in range(self.chat_tokens)]
+
+    def make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def send_json(self, status, payload):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def read_json(self):
+                length = int(self.headers.get('Content-Length', 0))
+                return json.loads(self.rfile.read(length) or b'{}')
+
+            def do_GET(self):
+                if self.path.rstrip('/') == '/v1/models':
+                    self.send_json(200, {'object': 'list', 'data': [{'id': 'stub-embedding', 'object': 'model'},
+                                                                     {'id': 'stub-chat', 'object': 'model'}]})
+                else:
+                    self.send_json(404, {'error': 'not found'})
+
+            def send_chat(self, request):
+                tokens = server.chat_tokens_for(request.get('messages', []))
+                server.count('chat_completions')
+                with server.slots:
+                    time.sleep(server.chat_ttft_ms / 1000)
+                    if not request.get('stream'):
+                        time.sleep(server.chat_token_ms * len(tokens) / 1000)
+                        self.send_json(200, {'object': 'chat.completion', 'model': request.get('model', ''),
+                                             'choices': [{'index': 0, 'finish_reason': 'stop',
+                                                          'message': {'role': 'assistant', 'content': ''.join(tokens)}}]})
+                        return
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/event-stream')
+                    self.send_header('Connection', 'close')
+                    self.end_headers()
+                    self.close_connection = True
+                    for idx, token in enumerate(tokens):
+                        if idx:
+                            time.sleep(server.chat_token_ms / 1000)
+                        chunk = {'object': 'chat.completion.chunk', 'choices': [{'index': 0, 'delta': {'content': token}}]}
+                        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+                        self.wfile.flush()
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    self.wfile.flush()
+
+            def do_POST(self):
+                request = self.read_json()
+                server.count('requests')
+                if self.path.rstrip('/') == '/v1/chat/completions':
+                    self.send_chat(request)
+                    return
+                if self.path.rstrip('/') != '/v1/embeddings':
+                    self.send_json(404, {'error': 'not found'})
+                    return
+                if server.should_fail():
+                    server.count('failed_requests')
+                    self.send_json(503, {'error': 'stub failure'})
+                    return
+                texts = request['input']
+                if isinstance(texts, str):
+                    texts = [texts]
+                with server.slots:
+                    time.sleep((server.latency_ms + server.per_item_latency_ms * len(texts)) / 1000)
+                    data = [{'object': 'embedding', 'index': idx, 'embedding': stub_embedding(text, server.dim)}
+                            for idx, text in enumerate(texts)]
+                server.count('embedded_texts', len(texts))
+                self.send_json(200, {'object': 'list', 'data': data, 'model': request.get('model', ''),
+                                     'usage': {'prompt_tokens': 0, 'total_tokens': 0}})
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1234)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--per-item-latency-ms', type=float, default=0.0)
+    parser.add_argument('--slots', type=int, default=4)
+    parser.add_argument('--fail-rate', type=float, default=0.0)
+    parser.add_argument('--dim', type=int, default=256)
+    parser.add_argument('--chat-ttft-ms', type=float, default=0.0)
+    parser.add_argument('--chat-token-ms', type=float, default=0.0)
+    parser.add_argument('--chat-tokens', type=int, default=32)
+    args = parser.parse_args()
+    server = Stub_OpenAI_Server(args.host, args.port, args.latency_ms, args.per_item_latency_ms,
+                                args.slots, args.fail_rate, args.dim,
+                                chat_ttft_ms=args.chat_ttft_ms, chat_token_ms=args.chat_token_ms,
+                                chat_tokens=args.chat_tokens)
+    print(f"Stub OpenAI server listening on {server.api_base}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Generator of synthetic .txt corpora for the benchmarks: reproducible (seeded) documents made of
+Zipf-distributed words, in sentences and paragraphs, with configurable document sizes.
+
+Usage:
+    python benchmarks/synthetic_corpus.py OUTPUT_FOLDER [--docs 200] [--mean-words 2000]
+                                          [--distribution lognormal] [--vocabulary 20000] [--seed 0]
+"""
+import argparse
+import itertools
+import math
+import os
+import random
+
+SIZE_DISTRIBUTIONS = ('fixed', 'uniform', 'lognormal')
+
+def make_vocabulary(size, rng):
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    vocabulary = set()
+    while len(vocabulary) < size:
+        vocabulary.add(''.join(rng.choice(letters) for _ in range(rng.randint(2, 12))))
+    return sorted(vocabulary)
+
+def document_sizes(nr_docs, mean_words, distribution, sigma, rng):
+    # number of words of each document, averaging mean_words
+    if distribution == 'fixed':
+        return [mean_words] * nr_docs
+    if distribution == 'uniform':
+        return [rng.randint(1, 2 * mean_words) for _ in range(nr_docs)]
+    if distribution == 'lognormal':
+        mu = math.log(mean_words) - sigma * sigma / 2
+        return [max(1, int(rng.lognormvariate(mu, sigma))) for _ in range(nr_docs)]
+    raise ValueError(f"Unknown size distribution '{distribution}', expected one of {SIZE_DISTRIBUTIONS}")
+
+def make_document(nr_words, vocabulary, cum_weights, rng):
+    words = rng.choices(vocabulary, cum_weights=cum_weights, k=nr_words)
+    sentences = []
+    position = 0
+    while position < nr_words:
+        length = rng.randint(5, 25)
+        sentence = words[position:position + length]
+        sentence[0] = sentence[0].capitalize()
+        sentences.append(' '.join(sentence) + rng.choice('.....?!'))
+        position += length
+    # paragraphs of a few sentences
+    paragraphs = []
+    position = 0
+    while position < len(sentences):
+        length = rng.randint(3, 8)
+        paragraphs.append(' '.join(sentences[position:position + length]))
+        position += length
+    return '\n\n'.join(paragraphs) + '\n'
+
+def generate_corpus(folder, nr_docs = 200, mean_words = 2000, distribution = 'lognormal', sigma = 1.0,
+                    vocabulary_size = 20000, zipf_s = 1.1, seed = 0):
+    """
+    Writes nr_docs documents doc_<n>.txt into folder. The same arguments always give the same files.
+
+    Returns:
+    dict: 'files', 'words' and 'bytes' written.
+    """
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(vocabulary_size, rng)
+    cum_weights = list(itertools.accumulate(1 / (rank ** zipf_s) for rank in range(1, vocabulary_size + 1)))
+    os.makedirs(folder, exist_ok=True)
+    summary = {'files': 0, 'words': 0, 'bytes': 0}
+    for doc_nr, nr_words in enumerate(document_sizes(nr_docs, mean_words, distribution, sigma, rng)):
+        data = make_document(nr_words, vocabulary, cum_weights, rng).encode('utf-8')
+        with open(os.path.join(folder, f"doc_{doc_nr:05d}.txt"), 'wb') as f:
+            f.write(data)
+        summary['files'] += 1
+        summary['words'] += nr_words
+        summary['bytes'] += len(data)
+    return summary
+
+def make_queries(nr_queries, vocabulary_size = 20000, seed = 0, words_per_query = (3, 8)):
+    # questions drawn from the same vocabulary as generate_corpus with the same seed
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(vocabulary_size, rng)
+    query_rng = random.Random(seed + 1)
+    return [' '.join(query_rng.choice(vocabulary[:2000]) for _ in range(query_rng.randint(*words_per_query)))
+            for _ in range(nr_queries)]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('folder')
+    parser.add_argument('--docs', type=int, default=200)
+    parser.add_argument('--mean-words', type=int, default=2000)
+    parser.add_argument('--distribution', choices=SIZE_DISTRIBUTIONS, default='lognormal')
+    parser.add_argument('--sigma', type=float, default=1.0, help="spread of the lognormal distribution")
+    parser.add_argument('--vocabulary', type=int, default=20000)
+    parser.add_argument('--zipf-s', type=float, default=1.1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    summary = generate_corpus(args.folder, args.docs, args.mean_words, args.distribution, args.sigma,
+                              args.vocabulary, args.zipf_s, args.seed)
+    print(f"{summary['files']} files, {summary['words']} words, {summary['bytes'] / 1e6:.1f} MB written to {args.folder}")
+
+if __name__ == "__main__":
+    main()
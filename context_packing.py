@@ -0,0 +1,168 @@
+import re
+from metrics import metrics
+
+# the words of the text splitters (helpers.WORD_SPAN_PATTERN, not imported: helpers loads chromadb)
+WORD_SPAN_PATTERN = re.compile(r'[^\w\s]*\w+[^\w\s]*')
+# what BPE tokenizers roughly make one token of: a short word, a group of up to 3 digits, a punctuation mark
+TOKEN_PIECE_PATTERN = re.compile(r'[^\W\d_]+|\d{1,3}|_+|[^\w\s]')
+
+def estimate_tokens(text):
+    # local estimate of the LLM tokens of text: long words count one token per 6 characters
+    return sum(1 + (len(piece) - 1) // 6 for piece in TOKEN_PIECE_PATTERN.findall(text))
+
+def truncate_to_tokens(text, max_tokens):
+    # the start of text holding at most max_tokens estimated tokens, cut after a whole piece
+    tokens = 0
+    end = 0
+    for match in TOKEN_PIECE_PATTERN.finditer(text):
+        tokens += 1 + (len(match.group()) - 1) // 6
+        if tokens > max_tokens:
+            break
+        end = match.end()
+    return text[:end]
+
+def chunk_overlap(previous, following, overlap_words):
+    """
+    Number of characters following starts with that previous ends with: neighbouring chunks share their
+    last / first overlap_words words. When they do not (the collection was split with other settings),
+    the longest end of previous starting at a word that following starts with.
+    """
+    def overlaps_from(position):
+        # following starts with previous[position:], ending at the end of a word of following
+        overlap = len(previous) - position
+        return following.startswith(previous[position:]) and (overlap == len(following) or following[overlap].isspace())
+
+    word_starts = [match.start() for match in WORD_SPAN_PATTERN.finditer(previous)]
+    position = word_starts[-overlap_words] if len(word_starts) >= overlap_words else 0
+    if overlaps_from(position):
+        return len(previous) - position
+    first_word = re.match(r'\S+', following)
+    if first_word is None:
+        return 0
+    position = previous.find(first_word.group())
+    while position != -1:
+        if (position == 0 or previous[position - 1].isspace()) and overlaps_from(position):
+            return len(previous) - position
+        position = previous.find(first_word.group(), position + 1)
+    return 0
+
+class Context_Packer:
+    """
+    Builds the CHUNKS part of the answer prompt from the query results within a token budget:
+    1. the same chunk retrieved several times (sub-queries, rewrites) is kept once
+    2. chunks retrieved from neighbouring positions of a document ('doc_chunk' n, n+1...) are merged into one
+       passage, the overlap_words words they share written once
+    3. passages repeating (or contained in) a better one are dropped, e.g. the same file in two collections
+    4. passages are packed by relevance until token_budget (estimated locally) is used; one that does not fit
+       is skipped, a smaller one after it may still fit. If even the best one does not fit, it is cut.
+    Reports the prompt tokens saved against one 'Chunk <n>:' section per result, and the prefill time they
+    would have cost, at prefill_tokens_per_s (updated from the measured time to first token of the answers).
+    """
+    def __init__(self, token_budget = 6000, overlap_words = 0, prefill_tokens_per_s = 1000.0):
+        self.token_budget = token_budget
+        self.overlap_words = overlap_words
+        self.prefill_tokens_per_s = prefill_tokens_per_s
+
+    @classmethod
+    def from_config(cls, config_json):
+        packing_config = config_json['rag_config'].get('context_packing', {})
+        if not packing_config.get('enabled', True):
+            return None
+        return cls(token_budget=packing_config.get('token_budget', 6000),
+                   overlap_words=config_json['chroma_config'].get('add_to_collection_config', {}).get('overlap_words', 0),
+                   prefill_tokens_per_s=packing_config.get('prefill_tokens_per_s', 1000.0))
+
+    def observe_prefill(self, prompt, ttft_s):
+        # the time to first token of a streamed answer is mostly the prefill of its prompt
+        if ttft_s is None or ttft_s <= 0:
+            return
+        self.prefill_tokens_per_s = 0.8 * self.prefill_tokens_per_s + 0.2 * estimate_tokens(prompt) / ttft_s
+
+    def merge_run(self, texts):
+        # texts of consecutive chunks of a document; without overlap, their words are only separated by whitespace
+        passage = texts[0]
+        for previous, text in zip(texts, texts[1:]):
+            overlap = chunk_overlap(previous, text, self.overlap_words) if self.overlap_words > 0 else 0
+            passage += text[overlap:] if overlap else ' ' + text
+        return passage
+
+    def pack(self, query_results):
+        """
+        Returns:
+        tuple: (prompt text with one 'Chunk <n>:' section per passage, dict of stats: 'chunks' retrieved,
+                'duplicates' dropped, 'merged' into a neighbour, 'passages' packed, 'dropped' for the budget,
+                'tokens_before' / 'tokens' of the CHUNKS text, 'tokens_saved', 'prefill_saved_s')
+        """
+        best_hits = {}  # (collection, chunk id) -> (distance, document, metadata)
+        chunks_before = ''
+        nr_chunks = 0
+        for ids, documents, metadatas, distances in zip(query_results['ids'], query_results['documents'],
+                                                        query_results['metadatas'], query_results['distances']):
+            for chunk_id, document, metadata, distance in zip(ids, documents, metadatas, distances):
+                nr_chunks += 1
+                chunks_before += f"Chunk {nr_chunks}:\n{document}\n"
+                key = ((metadata or {}).get('collection'), chunk_id)
+                if key not in best_hits or distance < best_hits[key][0]:
+                    best_hits[key] = (distance, document or '', metadata or {})
+
+        # chunk ids are '<doc_id>><i>': runs of consecutive i of a document become one passage
+        by_document = {}
+        for (collection_name, chunk_id), (distance, document, metadata) in best_hits.items():
+            doc_id, _, chunk_index = chunk_id.partition('>')
+            chunk_index = metadata.get('doc_chunk', chunk_index)
+            chunk_index = int(chunk_index) if str(chunk_index).isdigit() else None
+            by_document.setdefault((collection_name, doc_id if chunk_index is not None else chunk_id), []).append(
+                (chunk_index, distance, document))
+        passages = []  # (best distance, text)
+        for document_chunks in by_document.values():
+            document_chunks.sort(key=lambda chunk: -1 if chunk[0] is None else chunk[0])
+            run = [document_chunks[0]]
+            for chunk in document_chunks[1:] + [None]:
+                if chunk is not None and chunk[0] is not None and run[-1][0] is not None and chunk[0] == run[-1][0] + 1:
+                    run.append(chunk)
+                    continue
+                passages.append((min(distance for _, distance, _ in run), self.merge_run([text for _, _, text in run])))
+                run = [chunk]
+        passages.sort(key=lambda passage: passage[0])
+
+        kept = []
+        for _, text in passages:
+            if not any(text in kept_text for kept_text in kept):
+                kept.append(text)
+        duplicates = len(passages) - len(kept)
+
+        chunks = ''
+        tokens = 0
+        packed = 0
+        for text in kept:
+            section = f"Chunk {packed + 1}:\n{text}\n"
+            section_tokens = estimate_tokens(section)
+            if tokens + section_tokens > self.token_budget:
+                continue
+            chunks += section
+            tokens += section_tokens
+            packed += 1
+        if packed == 0 and len(kept):
+            # not even the smallest passage fits: the start of the best one is used
+            section = truncate_to_tokens(f"Chunk 1:\n{kept[0]}", self.token_budget)
+            chunks, tokens, packed = section + '\n', estimate_tokens(section), 1
+
+        tokens_before = estimate_tokens(chunks_before)
+        stats = {'chunks': nr_chunks,
+                 'duplicates': nr_chunks - len(best_hits) + duplicates,
+                 'merged': len(best_hits) - len(passages),
+                 'passages': packed,
+                 'dropped': len(kept) - packed,
+                 'tokens_before': tokens_before,
+                 'tokens': tokens,
+                 'tokens_saved': tokens_before - tokens,
+                 'prefill_saved_s': (tokens_before - tokens) / self.prefill_tokens_per_s if self.prefill_tokens_per_s > 0 else 0.0}
+        metrics.count('rag_context_tokens_total', tokens)
+        metrics.count('rag_context_tokens_saved_total', stats['tokens_saved'])
+        return chunks, stats
+
+def format_context_stats(stats):
+    return (f"Context: {stats['chunks']} chunks -> {stats['passages']} passages "
+            f"({stats['duplicates']} duplicates, {stats['merged']} merged, {stats['dropped']} over budget), "
+            f"{stats['tokens_before']} -> {stats['tokens']} tokens, saved {stats['tokens_saved']} tokens "
+            f"~{stats['prefill_saved_s']:.2f}s prefill")
@@ -0,0 +1,89 @@
+import sqlite3
+import threading
+
+class Disk_Cache:
+    """
+    Small persistent key -> bytes cache stored in a SQLite table, with a size cap,
+    least-recently-used eviction and hit/miss counters.
+    Several caches can share one database file by using different table names.
+    """
+    # SQLite limits the number of bound variables per statement
+    MAX_KEYS_PER_QUERY = 500
+
+    def __init__(self, db_path, table = 'cache', max_entries = 100000):
+        self.db_path = db_path
+        self.table = table
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    last_used INTEGER NOT NULL
+                )""")
+            self.connection.execute(f"CREATE INDEX IF NOT EXISTS {table}_last_used ON {table} (last_used)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS cache_meta (name TEXT PRIMARY KEY, value TEXT)")
+            self.clock = self.connection.execute(f"SELECT COALESCE(MAX(last_used), 0) FROM {table}").fetchone()[0]
+
+    def get_many(self, keys):
+        # Returns {key: value} for the keys found, marking them as recently used
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        with self.lock, self.connection:
+            for i in range(0, len(keys), self.MAX_KEYS_PER_QUERY):
+                part = keys[i:i + self.MAX_KEYS_PER_QUERY]
+                placeholders = ','.join('?' * len(part))
+                rows = self.connection.execute(f"SELECT key, value FROM {self.table} WHERE key IN ({placeholders})", part)
+                found.update(rows)
+            if len(found):
+                self.clock += 1
+                self.connection.executemany(f"UPDATE {self.table} SET last_used = ? WHERE key = ?",
+                                            [(self.clock, key) for key in found])
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def put_many(self, items):
+        # items: iterable of (key, value); evicts the least recently used entries above max_entries
+        with self.lock, self.connection:
+            self.clock += 1
+            self.connection.executemany(f"INSERT OR REPLACE INTO {self.table} (key, value, last_used) VALUES (?, ?, ?)",
+                                        [(key, value, self.clock) for key, value in items])
+            nr_entries = self.connection.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+            if nr_entries > self.max_entries:
+                self.connection.execute(f"""
+                    DELETE FROM {self.table} WHERE key IN (
+                        SELECT key FROM {self.table} ORDER BY last_used LIMIT ?)""",
+                                        (nr_entries - self.max_entries,))
+
+    def put(self, key, value):
+        self.put_many([(key, value)])
+
+    def clear(self):
+        with self.lock, self.connection:
+            self.connection.execute(f"DELETE FROM {self.table}")
+
+    def get_meta(self, name):
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM cache_meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, name, value):
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO cache_meta (name, value) VALUES (?, ?)", (name, value))
+
+    def stats(self):
+        with self.lock:
+            nr_entries = self.connection.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {'entries': nr_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
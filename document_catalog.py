@@ -0,0 +1,83 @@
+import os
+import sqlite3
+import threading
+
+class Document_Catalog:
+    """
+    One row per document stored in a collection: doc_id, path, content hash and number of chunks.
+    Kept up to date on ingest and delete, so listing a collection reads documents (page by page) instead
+    of the metadata of every chunk. Stored as a SQLite sidecar file inside the Chroma data folder.
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    collection TEXT NOT NULL,
+                    doc_id TEXT NOT NULL,
+                    doc_path TEXT NOT NULL,
+                    folder TEXT NOT NULL,
+                    doc_hash TEXT NOT NULL,
+                    chunk_count INTEGER NOT NULL,
+                    PRIMARY KEY (collection, doc_id)
+                )""")
+            # pages are read in path order
+            self.connection.execute("CREATE INDEX IF NOT EXISTS documents_by_path ON documents (collection, doc_path)")
+
+    def upsert(self, collection_name, documents):
+        # documents: iterable of dicts with 'doc_id', 'doc_path', 'doc_hash' and 'chunk_count'
+        rows = [(collection_name, each_doc['doc_id'], each_doc['doc_path'], os.path.dirname(each_doc['doc_path']),
+                 each_doc['doc_hash'], each_doc['chunk_count']) for each_doc in documents]
+        if not len(rows):
+            return
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO documents (collection, doc_id, doc_path, folder, doc_hash, chunk_count) VALUES (?, ?, ?, ?, ?, ?)",
+                rows)
+
+    def remove_chunks(self, collection_name, chunk_ids):
+        # chunk ids follow the '<doc_id>><i>' scheme; a document left without chunks is removed
+        removed_per_doc = {}
+        for chunk_id in chunk_ids:
+            doc_id = chunk_id.split('>', 1)[0]
+            removed_per_doc[doc_id] = removed_per_doc.get(doc_id, 0) + 1
+        if not len(removed_per_doc):
+            return
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "UPDATE documents SET chunk_count = chunk_count - ? WHERE collection = ? AND doc_id = ?",
+                [(count, collection_name, doc_id) for doc_id, count in removed_per_doc.items()])
+            self.connection.execute("DELETE FROM documents WHERE collection = ? AND chunk_count <= 0", (collection_name,))
+
+    def replace_collection(self, collection_name, documents):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM documents WHERE collection = ?", (collection_name,))
+        self.upsert(collection_name, documents)
+
+    def drop_collection(self, collection_name):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM documents WHERE collection = ?", (collection_name,))
+
+    def count(self, collection_name):
+        # (documents, chunks) of the collection
+        with self.lock:
+            return tuple(self.connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(chunk_count), 0) FROM documents WHERE collection = ?",
+                (collection_name,)).fetchone())
+
+    def page(self, collection_name, offset = 0, limit = None):
+        # documents sorted by path
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT doc_id, doc_path, doc_hash, chunk_count FROM documents WHERE collection = ? ORDER BY doc_path LIMIT ? OFFSET ?",
+                (collection_name, -1 if limit is None else limit, offset)).fetchall()
+        return [{'doc_id': doc_id, 'doc_path': doc_path, 'doc_hash': doc_hash, 'chunk_count': chunk_count}
+                for doc_id, doc_path, doc_hash, chunk_count in rows]
+
+    def folders(self, collection_name):
+        with self.lock:
+            rows = self.connection.execute("SELECT DISTINCT folder FROM documents WHERE collection = ? ORDER BY folder",
+                                           (collection_name,))
+            return [folder for folder, in rows]
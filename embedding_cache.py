@@ -0,0 +1,70 @@
+import hashlib
+from array import array
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+from disk_cache import Disk_Cache
+from metrics import metrics
+
+class Cached_Embedding_Function(EmbeddingFunction[Documents]):
+    """
+    Wraps an embedding function with a persistent, content-addressed cache keyed by
+    (embedding model name, SHA-256 of the text). Only texts never seen with this model
+    reach the wrapped function, so re-ingesting unchanged text costs no embedding calls.
+    The cache is cleared when the configured model name changes.
+    """
+    def __init__(self, embedding_function, model_name, db_path, max_entries = 200000):
+        self.embedding_function = embedding_function
+        self.model_name = model_name
+        self.cache = Disk_Cache(db_path, table='embeddings', max_entries=max_entries)
+        if self.cache.get_meta('embedding_model') != model_name:
+            # vectors from another model are not comparable, drop them
+            self.cache.clear()
+            self.cache.set_meta('embedding_model', model_name)
+
+    def cache_key(self, text):
+        return f"{self.model_name}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+    def __call__(self, input: Documents) -> Embeddings:
+        return self.embed_batches([input])
+
+    def embed_batches(self, batches):
+        batches = [list(batch) for batch in batches]
+        keys = [[self.cache_key(text) for text in batch] for batch in batches]
+        cached = self.cache.get_many(key for batch_keys in keys for key in batch_keys)
+        # embed each missing text once, keeping the request packing of the original batches
+        missing_batches = []
+        missing_keys = []
+        queued = set()
+        for batch, batch_keys in zip(batches, keys):
+            missing_batch = []
+            for text, key in zip(batch, batch_keys):
+                if key not in cached and key not in queued:
+                    queued.add(key)
+                    missing_batch.append(text)
+                    missing_keys.append(key)
+            if len(missing_batch):
+                missing_batches.append(missing_batch)
+        nr_texts = sum(len(batch_keys) for batch_keys in keys)
+        metrics.count('rag_cache_requests_total', nr_texts - len(missing_keys), cache='embeddings', result='hit')
+        metrics.count('rag_cache_requests_total', len(missing_keys), cache='embeddings', result='miss')
+        computed = {}
+        if len(missing_batches):
+            embed_batches = getattr(self.embedding_function, 'embed_batches', None)
+            if embed_batches is not None:
+                new_embeddings = embed_batches(missing_batches)
+            else:
+                new_embeddings = [embedding for batch in missing_batches for embedding in self.embedding_function(batch)]
+            computed = dict(zip(missing_keys, new_embeddings))
+            self.cache.put_many((key, array('f', embedding).tobytes()) for key, embedding in computed.items())
+        embeddings = []
+        for batch_keys in keys:
+            for key in batch_keys:
+                if key in computed:
+                    embeddings.append(list(computed[key]))
+                else:
+                    vector = array('f')
+                    vector.frombytes(cached[key])
+                    embeddings.append(vector.tolist())
+        return embeddings
+
+    def stats(self):
+        return self.cache.stats()
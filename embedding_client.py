@@ -0,0 +1,80 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+
+# HTTP statuses worth retrying: rate limiting and transient server errors
+RETRY_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+class Embedding_Request_Error(Exception):
+    pass
+
+class OpenAI_Embedding_Client(EmbeddingFunction[Documents]):
+    """
+    Embedding function for OpenAI-compatible '/embeddings' endpoints (e.g. LM Studio).
+    Reuses pooled HTTP connections, keeps up to max_concurrent_requests requests in flight,
+    retries transient failures with exponential backoff and always returns the embeddings
+    in the order of the input texts.
+    """
+    def __init__(self, model_name, api_base, api_key, max_concurrent_requests = 4, batch_size = 64,
+                 max_retries = 3, retry_backoff_s = 0.5, timeout_s = 60):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_backoff_s = retry_backoff_s
+        self.http_client = httpx.Client(
+                            base_url=api_base,
+                            headers={"Authorization": f"Bearer {api_key}"},
+                            timeout=timeout_s,
+                            limits=httpx.Limits(max_connections=max_concurrent_requests,
+                                                max_keepalive_connections=max_concurrent_requests)
+                        )
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent_requests, thread_name_prefix="embedding")
+
+    @classmethod
+    def from_config(cls, embedding_config: dict):
+        return cls(model_name = embedding_config['model_name'],
+                   api_base = embedding_config['api_base'],
+                   api_key = embedding_config['api_key'],
+                   max_concurrent_requests = embedding_config.get('max_concurrent_requests', 4),
+                   max_retries = embedding_config.get('max_retries', 3),
+                   retry_backoff_s = embedding_config.get('retry_backoff_s', 0.5),
+                   timeout_s = embedding_config.get('timeout_s', 60))
+
+    def __call__(self, input: Documents) -> Embeddings:
+        batches = [input[i:i + self.batch_size] for i in range(0, len(input), self.batch_size)]
+        return self.embed_batches(batches)
+
+    def embed_batches(self, batches):
+        # One request per batch, run concurrently; executor.map keeps the results in input order
+        batches = list(batches)
+        if len(batches) == 1:
+            return self.embed_batch(batches[0])
+        embeddings = []
+        for each_result in self.executor.map(self.embed_batch, batches):
+            embeddings.extend(each_result)
+        return embeddings
+
+    def embed_batch(self, texts):
+        # replace newlines (same as chromadb's OpenAIEmbeddingFunction, so stored vectors stay comparable)
+        texts = [text.replace("\n", " ") for text in texts]
+        attempt = 0
+        while True:
+            try:
+                response = self.http_client.post("embeddings", json={"model": self.model_name, "input": texts})
+                if response.status_code in RETRY_STATUS_CODES:
+                    raise Embedding_Request_Error(f"Embedding server answered {response.status_code}: {response.text[:200]}")
+                response.raise_for_status()
+                data = response.json()['data']
+                return [each['embedding'] for each in sorted(data, key=lambda each: each['index'])]
+            except (httpx.TransportError, Embedding_Request_Error) as exp:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.retry_backoff_s * (2 ** attempt)
+                print(f"Embedding request failed ({exp}), retrying in {delay:.1f}s...")
+                time.sleep(delay)
+                attempt += 1
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.http_client.close()
@@ -1,48 +1,188 @@
-
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 import re
+import itertools
+import collections
 import os
 import hashlib
-import chromadb
+import io
+import codecs
+import queue
+import threading
+import time
+import copy
+import zlib
+import mmap
+import functools
+import multiprocessing
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from chromadb.utils import embedding_functions
+from sync_manifest import Sync_Manifest
+from document_catalog import Document_Catalog
+from embedding_client import OpenAI_Embedding_Client
+from embedding_cache import Cached_Embedding_Function
+from query_cache import Query_Cache
+from lexical_index import Lexical_Index
+from vector_store import open_backend
+from metrics import metrics
+
+# A word is a run of \w characters; punctuation glued to it (quotes, commas, periods...) travels with it
+WORD_PATTERN = re.compile(r'\w+')
+WORD_SPAN_PATTERN = re.compile(r'[^\w\s]*\w+[^\w\s]*')
 
 class WordBasedTextSplitter:
+    """
+    Splits text into chunks of exactly max_words_per_chunk words (the last one may be shorter),
+    consecutive chunks sharing overlap_words words. The text is tokenised once; chunks are
+    described by (start, end) character offsets and only sliced out of the text at the end.
+    """
     def __init__(self, max_words_per_chunk, overlap_words, punctuations=None):
         self.max_words_per_chunk = max_words_per_chunk
         self.overlap_words = overlap_words
+        # kept for backward compatibility, punctuation never counts as a word
         self.punctuations = punctuations if punctuations else ['.', ',', '!', '?', ';', ' ']
 
     def words_count(self, text):
-        # Create a regex pattern for splitting by words and the specified punctuation marks
-        punctuation_pattern = f"[{''.join(re.escape(p) for p in self.punctuations)}]"
-        pattern = rf'\w+|{punctuation_pattern}'
+        return sum(1 for _ in WORD_PATTERN.finditer(text))
+
+    def chunk_offsets(self, text, primed_words = 0):
+        """
+        Single pass over the words of the text. Only the words starting or ending a chunk are
+        looked at from Python; the words in between are skipped by itertools (C speed).
+        primed_words is only used by content-defined splitting (see stream_chunks).
 
-        # Step 1: Split text into words and punctuation marks using the regex pattern
-        words_and_punctuations = re.findall(pattern, text)
-        # Filter out only words
-        words = [token for token in words_and_punctuations if re.match(r'\w+', token)]
-        return len(words)
+        Returns:
+        tuple: (list of (start, end) character offsets of the chunks, number of words in the text)
+        """
+        max_words = max(1, self.max_words_per_chunk)
+        step = max(1, max_words - self.overlap_words)
+        words = zip(itertools.count(), WORD_SPAN_PATTERN.finditer(text))
+        starts = []   # start offset of chunk j (word j*step)
+        ends = []     # end offset of chunk j, when it got all its words (word j*step + max_words - 1)
+        word_idx = -1
+        last_match = None
+        while True:
+            start_word = len(starts) * step
+            end_word = len(ends) * step + max_words - 1
+            target = min(start_word, end_word)
+            skipped = collections.deque(itertools.islice(words, target - word_idx), maxlen=1)
+            if not len(skipped):
+                break
+            word_idx, last_match = skipped[0]
+            if word_idx < target:
+                break
+            if target == start_word:
+                starts.append(last_match.start())
+            if target == end_word:
+                ends.append(last_match.end())
+        nr_words = word_idx + 1
+        if nr_words == 0:
+            return [], 0
+        # chunk j covers words [j*step, j*step + max_words): the first chunk reaching the last word is the last one
+        nr_chunks = 1 + max(0, -(-(nr_words - max_words) // step))
+        ends = ends[:nr_chunks] + [last_match.end()] * (nr_chunks - len(ends))
+        return list(zip(starts[:nr_chunks], ends)), nr_words
 
     def split_text(self, text):
-        # Get number of words
-        num_words = self.words_count(text=text)
-
-        # Step 2: Get the number of characters in the text
-        num_chars = len(text)
-        
-        # Step 3: Determine the average count of characters in a word
-        avg_chars_per_word = num_chars / num_words
-        
-        # Step 4: Determine the inputs for the RecursiveCharacterTextSplitter
-        chunk_size = int(self.max_words_per_chunk * avg_chars_per_word)
-        overlap_size = int(self.overlap_words * avg_chars_per_word)
-        
-        # Initialize the RecursiveCharacterTextSplitter
-        splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=overlap_size)
-        
-        # Step 5: Split the text and return the resulting chunks
-        chunks = splitter.split_text(text)
-        return chunks
+        offsets, _ = self.chunk_offsets(text)
+        return [text[start:end] for start, end in offsets]
+
+    def carried_words(self, text, offsets):
+        # words at the start of the last chunk that overlap the previous chunk, for stream_chunks
+        return 0
+
+    def stream_chunks(self, text_blocks, max_word_chars = 1 << 20):
+        """
+        Yields the chunks of a text arriving in pieces (text_blocks), the same chunks split_text gives for
+        the whole text. Each block is split with chunk_offsets up to its last whitespace (a word may go on
+        in the next block); every chunk but the last one is final, the split resumes at the start of the last
+        one. Holds only that last chunk and the current block in memory.
+        """
+        buffer = ''
+        primed_words = 0
+        for block in itertools.chain(text_blocks, [None]):
+            if block is not None:
+                buffer += block
+                cut = len(buffer)
+                while cut > 0 and len(buffer) - cut < max_word_chars and not buffer[cut - 1].isspace():
+                    cut -= 1
+                if cut == 0:
+                    continue
+                if len(buffer) - cut >= max_word_chars:
+                    # no whitespace for max_word_chars characters: cut there anyway, the memory stays bounded
+                    cut = len(buffer)
+            else:
+                cut = len(buffer)
+            offsets, _ = self.chunk_offsets(buffer[:cut], primed_words)
+            if block is None:
+                for start, end in offsets:
+                    yield buffer[start:end]
+                return
+            if len(offsets) < 2:
+                continue
+            for start, end in offsets[:-1]:
+                yield buffer[start:end]
+            primed_words = self.carried_words(buffer, offsets)
+            buffer = buffer[offsets[-1][0]:]
+
+class ContentDefinedTextSplitter(WordBasedTextSplitter):
+    """
+    Same budget as WordBasedTextSplitter (at most max_words_per_chunk words, overlap_words words
+    shared with the previous chunk), but a chunk ends where the content says so: after a word pair
+    whose hash hits a fixed pattern, once the chunk holds at least half its budget of new words.
+    An edit only moves the boundaries next to it, so the other chunks of an edited document keep
+    their exact text (and chunk_hash) instead of all shifting by the inserted words.
+    """
+    def chunk_offsets(self, text, primed_words = 0):
+        # primed_words: the text starts with that many words of overlap, already counted in a previous chunk
+        max_words = max(1, self.max_words_per_chunk)
+        overlap_words = min(max(0, self.overlap_words), max_words - 1)
+        max_new_words = max_words - overlap_words
+        min_new_words = max(1, max_new_words // 2)
+        divisor = max(1, max_new_words - min_new_words)
+        words = WORD_SPAN_PATTERN.finditer(text)
+        recent = collections.deque(maxlen=overlap_words + 1)  # last words seen, the next chunk starts at the oldest
+        recent.extend(itertools.islice(words, primed_words))
+        offsets = []
+        nr_words = 0
+        end_of_text = False
+        while not end_of_text:
+            first_word = next(words, None)
+            if first_word is None:
+                break
+            recent.append(first_word)
+            chunk_start = recent[0].start()
+            # no boundary before min_new_words words: skip them at C speed
+            skipped = list(itertools.islice(words, min_new_words - 1))
+            recent.extend(skipped)
+            new_words = 1 + len(skipped)
+            end_of_text = new_words < min_new_words
+            previous_word = recent[-2].group() if len(recent) > 1 else ''
+            last_word = recent[-1].group()
+            while not end_of_text and new_words < max_new_words and \
+                    zlib.crc32(f"{previous_word} {last_word}".encode('utf-8')) % divisor:
+                match = next(words, None)
+                if match is None:
+                    end_of_text = True
+                    break
+                recent.append(match)
+                new_words += 1
+                previous_word, last_word = last_word, match.group()
+            offsets.append((chunk_start, recent[-1].end()))
+            nr_words += new_words
+        return offsets, nr_words
+
+    def carried_words(self, text, offsets):
+        # the last chunk starts with the words of the previous chunk it overlaps
+        return len(WORD_SPAN_PATTERN.findall(text, offsets[-1][0], offsets[-2][1]))
+
+def make_text_splitter(add_config):
+    # 'chunk_boundaries': 'fixed' (a chunk every max_words_per_chunk - overlap_words words) or 'content' (stable under edits)
+    if add_config.get('chunk_boundaries', 'fixed') == 'content':
+        splitter_class = ContentDefinedTextSplitter
+    else:
+        splitter_class = WordBasedTextSplitter
+    return splitter_class(max_words_per_chunk=add_config['max_words_per_chunk'],
+                          overlap_words=add_config['overlap_words'])
 
 def get_file_hash(file_path):
     hash_func = hashlib.sha256()
@@ -51,23 +191,82 @@ def get_file_hash(file_path):
             hash_func.update(chunk)
     return hash_func.hexdigest()
 
+def read_file_hashed(file_path, block_size=1 << 20):
+    # Single pass over the file: hash the raw bytes and decode them (same newline handling as text mode)
+    hash_func = hashlib.sha256()
+    decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder('utf-8')(), translate=True)
+    parts = []
+    with open(file_path, 'rb') as f:
+        while block := f.read(block_size):
+            hash_func.update(block)
+            parts.append(decoder.decode(block))
+    parts.append(decoder.decode(b'', final=True))
+    return ''.join(parts), hash_func.hexdigest()
+
+# files bigger than 'stream_threshold_mb' are never held whole: they are read through a memory map, a block at a time
+MAPPED_BLOCK_SIZE = 16 << 20
+
+def iter_mapped_blocks(file_path, block_size = MAPPED_BLOCK_SIZE):
+    # Yields the bytes of the file block by block from a memory map, releasing the pages already read
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            dont_need = getattr(mmap, 'MADV_DONTNEED', None)
+            for start in range(0, len(mapped), block_size):
+                yield mapped[start:start + block_size]
+                if dont_need is not None:
+                    mapped.madvise(dont_need, start, min(block_size, len(mapped) - start))
+
+def check_mapped_file(file_path):
+    # Content hash of a large file, hashed from its memory map, after checking it decodes as UTF-8 (the text is not kept)
+    hash_func = hashlib.sha256()
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    for block in iter_mapped_blocks(file_path):
+        hash_func.update(block)
+        decoder.decode(block)
+    decoder.decode(b'', final=True)
+    return hash_func.hexdigest()
+
+def iter_mapped_text(file_path):
+    # The decoded text of a large file block by block, with the same newline handling as read_file_hashed
+    decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder('utf-8')(), translate=True)
+    for block in iter_mapped_blocks(file_path):
+        text = decoder.decode(block)
+        if len(text):
+            yield text
+    text = decoder.decode(b'', final=True)
+    if len(text):
+        yield text
+
+class Streamed_Chunks:
+    """
+    Chunks of a large file, split while streaming it from its memory map (see stream_chunks).
+    Each iteration streams the file again, nothing is kept in between.
+    """
+    def __init__(self, file_path, splitter):
+        self.file_path = file_path
+        self.splitter = splitter
+
+    def __iter__(self):
+        return self.splitter.stream_chunks(iter_mapped_text(self.file_path))
+
 def get_unique_id_from_path(relative_path):
     path_bytes = relative_path.encode('utf-8')
     hash_func = hashlib.sha256()
     hash_func.update(path_bytes)
     return hash_func.hexdigest()
 
-def read_text_files(init_folder_path):
+def discover_text_files(init_folder_path):
     """
-    Reads all .txt files in the specified folder, accepting both relative and absolute paths, 
-    and returns a dictionary with the contents of the files and their absolute paths.
+    Lazily yields the .txt files found in the specified folder, without reading them.
 
     Args:
     init_folder_path (str): The path to the folder containing .txt files.
 
-    Returns:
-    dict: A dictionary with two keys: 'documents' containing a list of the contents of each .txt file,
-          and 'paths' containing a list of absolute paths to each .txt file.
+    Yields:
+    dict: 'path' (absolute path to the file), 'doc_id' (id derived from the relative path),
+          'size' and 'mtime_ns' (taken from the directory scan).
     """
     # Convert relative path to absolute path
     folder_path = os.path.abspath(init_folder_path)
@@ -75,37 +274,332 @@ def read_text_files(init_folder_path):
     # Check if the directory exists
     if not os.path.exists(folder_path):
         print(f"The directory {folder_path} does not exist.")
-        return {'documents': [], 'paths': [], "content_hashes":[], "doc_ids":[]}
+        return
 
     # Check if the path is indeed a directory
     if not os.path.isdir(folder_path):
         print(f"The path {folder_path} is not a directory.")
-        return {'documents': [], 'paths': [], "content_hashes":[], "doc_ids":[]}
+        return
 
-    # Dictionary to store results
-    result = {"documents": [], "paths": [], "content_hashes":[], "doc_ids":[]}
+    with os.scandir(folder_path) as entries:
+        for entry in entries:
+            # Check if the file is a .txt file
+            if entry.name.endswith(".txt"):
+                try:
+                    stat = entry.stat()
+                except OSError as e:
+                    print(f"Could not stat file {entry.path}: {e}")
+                    continue
+                relative_file_path = os.path.join(os.path.normpath(init_folder_path), entry.name)
+                yield {"path": os.path.join(folder_path, entry.name),
+                       "doc_id": get_unique_id_from_path(relative_file_path),
+                       "size": stat.st_size,
+                       "mtime_ns": stat.st_mtime_ns}
+
+# files sent to a pool process at once: up to this many files / bytes
+FILE_BATCH_ITEMS = 64
+FILE_BATCH_BYTES = 8 << 20
+
+def hash_file_batch(batch):
+    # [(file, hash known from the manifest or None)] -> [(content hash, error)]; known files are not opened
+    hashes = []
+    for each_file, known_hash in batch:
+        if known_hash is not None:
+            hashes.append((known_hash, None))
+            continue
+        try:
+            hashes.append((get_file_hash(each_file['path']), None))
+        except IOError as e:
+            hashes.append((None, str(e)))
+    return hashes
+
+def hash_text_files(files, known_files=None, executor=None, max_in_flight=8):
+    """
+    Hash stage: adds 'content_hash' to each discovered file.
+    known_files maps path -> (size, mtime_ns, content_hash) from a previous sync; files whose
+    size and mtime are unchanged reuse that hash without being opened. Re-hashed files are
+    flagged with 'rehashed' so the caller can update its manifest.
+    With an executor (process pool) the files are hashed there in batches, yielded in the same order.
+    """
+    if known_files is None:
+        known_files = {}
+
+    def known_hash(each_file):
+        known = known_files.get(each_file['path'])
+        if known is not None and known[0] == each_file['size'] and known[1] == each_file['mtime_ns']:
+            return known[2]
+        return None
 
-    # Iterate through all files in the specified directory
-    for filename in os.listdir(folder_path):
-        # Check if the file is a .txt file
-        if filename.endswith(".txt"):
-            # Construct absolute path to the text file
-            file_path = os.path.join(folder_path, filename)
-            # Add the file path to the list
-            result['paths'].append(file_path)
-            result['content_hashes'].append(get_file_hash(file_path))
-            relative_file_path = os.path.join(os.path.normpath(init_folder_path), filename)
-            result['doc_ids'].append(get_unique_id_from_path(relative_file_path))
-
-            # Read the content of the file
+    checked_files = ((each_file, known_hash(each_file)) for each_file in files)
+    if executor is None:
+        hashed_batches = (([item], hash_file_batch([item])) for item in checked_files)
+    else:
+        batches = batched(checked_files, max_items=FILE_BATCH_ITEMS, max_chars=FILE_BATCH_BYTES,
+                          size_of=lambda item: 0 if item[1] is not None else item[0]['size'])
+        hashed_batches = ordered_map(executor, hash_file_batch, batches, max_in_flight)
+    for batch, hashes in hashed_batches:
+        for (each_file, stored_hash), (content_hash, error) in zip(batch, hashes):
+            if error is not None:
+                print(f"Could not read file {each_file['path']}: {error}")
+                continue
+            if stored_hash is not None:
+                metrics.count('rag_files_checked_total', hash='reused')
+                yield dict(each_file, content_hash=content_hash, rehashed=False)
+                continue
+            metrics.count('rag_files_checked_total', hash='computed')
+            metrics.count('rag_bytes_hashed_total', each_file['size'])
+            yield dict(each_file, content_hash=content_hash, rehashed=True)
+
+def read_documents(files, stream_threshold = None):
+    """
+    Read stage: adds 'document' (the file content) to each file, one file at a time.
+    Files bigger than stream_threshold bytes are only hashed and checked, and flagged 'streamed'.
+    """
+    for each_file in files:
+        start_time = time.perf_counter()
+        if stream_threshold is not None and each_file['size'] > stream_threshold:
             try:
-                with open(file_path, 'r', encoding='utf-8') as file:
-                    content = file.read()
-                    # Add the content to the list
-                    result['documents'].append(content)
-            except IOError as e:
-                print(f"Could not read file {file_path}: {e}")
+                content_hash = check_mapped_file(each_file['path'])
+            except (IOError, ValueError) as e:
+                print(f"Could not read file {each_file['path']}: {e}")
+                continue
+            metrics.observe('rag_document_read_seconds', time.perf_counter() - start_time)
+            metrics.count('rag_documents_read_total')
+            metrics.count('rag_bytes_read_total', each_file['size'])
+            yield dict(each_file, content_hash=content_hash, streamed=True)
+            continue
+        try:
+            content, content_hash = read_file_hashed(each_file['path'])
+        except (IOError, UnicodeDecodeError) as e:
+            print(f"Could not read file {each_file['path']}: {e}")
+            continue
+        # runs on the prefetch thread: histogram and counters only, no span
+        metrics.observe('rag_document_read_seconds', time.perf_counter() - start_time)
+        metrics.count('rag_documents_read_total')
+        metrics.count('rag_bytes_read_total', each_file['size'])
+        # keep the hash of the bytes actually read, in case the file changed since it was indexed
+        yield dict(each_file, document=content, content_hash=content_hash)
+
+def get_chunk_hash(chunk):
+    return hashlib.sha256(chunk.encode('utf-8')).hexdigest()
+
+def streamed_document(each_file, splitter):
+    # chunks split when they are written, their hashes computed then too; the number of words is not known up front
+    return dict(each_file, streamed=True, chunks=Streamed_Chunks(each_file['path'], splitter), chunk_hashes=None, words_count=None)
+
+def split_documents(documents, splitter):
+    # Split stage: replaces 'document' with its 'chunks' (and their hashes) so the full text is not kept around
+    for each_doc in documents:
+        if each_doc.get('streamed'):
+            yield streamed_document(each_doc, splitter)
+            continue
+        document = each_doc.pop('document')
+        offsets, each_doc['words_count'] = splitter.chunk_offsets(document)
+        each_doc['chunks'] = [document[start:end] for start, end in offsets]
+        each_doc['chunk_hashes'] = [get_chunk_hash(chunk) for chunk in each_doc['chunks']]
+        yield each_doc
+
+def read_and_split_batch(files, add_config):
+    """
+    Process pool worker: reads, hashes and splits a batch of files. The chunks go back in compact form,
+    the text once with the chunks' (start, end) offsets and their sha256 digests, not one string per chunk.
+
+    Returns:
+    list: per file, (error, content, content hash, words count, flat array of offsets, digests, read seconds).
+    """
+    splitter = make_text_splitter(add_config)
+    stream_threshold = add_config.get('stream_threshold_mb', 64) << 20
+    results = []
+    for each_file in files:
+        start_time = time.perf_counter()
+        if each_file['size'] > stream_threshold:
+            # streamed by the parent, only hashed and checked here: content None
+            try:
+                content_hash = check_mapped_file(each_file['path'])
+            except (IOError, ValueError) as e:
+                results.append((str(e), None, None, 0, None, None, 0.0))
+                continue
+            results.append((None, None, content_hash, None, None, None, time.perf_counter() - start_time))
+            continue
+        try:
+            content, content_hash = read_file_hashed(each_file['path'])
+        except (IOError, UnicodeDecodeError) as e:
+            results.append((str(e), None, None, 0, None, None, 0.0))
+            continue
+        read_s = time.perf_counter() - start_time
+        offsets, words_count = splitter.chunk_offsets(content)
+        digests = b''.join(hashlib.sha256(content[start:end].encode('utf-8')).digest() for start, end in offsets)
+        results.append((None, content, content_hash, words_count, array('q', itertools.chain.from_iterable(offsets)), digests, read_s))
+    return results
+
+def read_split_documents_parallel(files, add_config, executor, max_in_flight):
+    # Read and split stages on a process pool: same documents as split_documents(read_documents(files)), same order
+    batches = batched(files, max_items=FILE_BATCH_ITEMS, max_chars=FILE_BATCH_BYTES, size_of=lambda each_file: each_file['size'])
+    worker = functools.partial(read_and_split_batch, add_config=add_config)
+    splitter = make_text_splitter(add_config)
+    for batch, results in ordered_map(executor, worker, batches, max_in_flight):
+        for each_file, (error, content, content_hash, words_count, offsets, digests, read_s) in zip(batch, results):
+            if error is not None:
+                print(f"Could not read file {each_file['path']}: {error}")
+                continue
+            metrics.observe('rag_document_read_seconds', read_s)
+            metrics.count('rag_documents_read_total')
+            metrics.count('rag_bytes_read_total', each_file['size'])
+            if content is None:
+                yield streamed_document(dict(each_file, content_hash=content_hash), splitter)
+                continue
+            yield dict(each_file, content_hash=content_hash, words_count=words_count,
+                       chunks=[content[offsets[i]:offsets[i + 1]] for i in range(0, len(offsets), 2)],
+                       chunk_hashes=[digests[i:i + 32].hex() for i in range(0, len(digests), 32)])
+
+def ordered_map(executor, func, items, max_in_flight):
+    """
+    executor.map for long item streams: at most max_in_flight items are submitted ahead of the one
+    being consumed. Yields (item, func(item)) in the order of items.
+    """
+    pending = collections.deque()
+    try:
+        for item in items:
+            pending.append((item, executor.submit(func, item)))
+            if len(pending) >= max(1, max_in_flight):
+                item, future = pending.popleft()
+                yield item, future.result()
+        while len(pending):
+            item, future = pending.popleft()
+            yield item, future.result()
+    finally:
+        # the consumer stopped early
+        for _, future in pending:
+            future.cancel()
+
+class CPU_Pool:
+    """
+    Processes for the CPU-bound ingest stages (hashing, decoding, splitting), started on first use and shared
+    by all sessions. workers: 1 keeps the stages in the calling process, 0 starts one process per core.
+    """
+    def __init__(self, workers = 1):
+        self.workers = workers if workers is not None and workers > 0 else (os.cpu_count() or 1)
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def get_executor(self):
+        if self.workers <= 1:
+            return None
+        with self.lock:
+            if self.executor is None:
+                # spawned, not forked: the parent runs threads (GUI, Chroma, prefetch) a fork could catch holding a lock
+                self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+            return self.executor
+
+    def close(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = None
+
+def prefetch(iterable, max_in_flight):
+    """
+    Runs the iterable on a worker thread and yields its items, keeping at most
+    max_in_flight items buffered between the producer and the consumer.
+    """
+    buffer = queue.Queue(maxsize=max(1, max_in_flight))
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def producer():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except Exception as exp:
+            put((done, exp))
+            return
+        put((done, None))
+
+    threading.Thread(target=producer, daemon=True).start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if item is done:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        # Unblock the producer if the consumer stops early
+        stop.set()
+
+def iter_chunk_records(documents):
+    # Flattens split documents into (chunk_id, chunk, metadata, is_last_chunk) records using the '<doc_id>><i>' id scheme
+    for each_doc in documents:
+        if each_doc.get('streamed'):
+            print(f"Adding/updating document of {each_doc['size'] / 1e6:.0f} MB, streamed")
+        else:
+            print(f"Adding/updating document with lenght= {each_doc['words_count']}")
+        # one chunk of look-ahead: the number of chunks of a streamed document is only known at its end
+        chunks = iter(each_doc['chunks'])
+        chunk = next(chunks, None)
+        i = 0
+        while chunk is not None:
+            next_chunk = next(chunks, None)
+            yield (f"{each_doc['doc_id']}>{i}",
+                   chunk,
+                   {"doc_path": f"{each_doc['path']}",
+                    "doc_chunk": f"{i}",
+                    "doc_hash": f"{each_doc['content_hash']}",
+                    "chunk_hash": get_chunk_hash(chunk) if each_doc['chunk_hashes'] is None else each_doc['chunk_hashes'][i]},
+                   next_chunk is None)
+            chunk = next_chunk
+            i += 1
+
+def batched(items, max_items, max_chars = None, size_of = len):
+    """
+    Groups items into lists of at most max_items items and, when max_chars is given,
+    at most max_chars total size (measured with size_of). A single item bigger than max_chars
+    still gets its own batch.
+    """
+    batch = []
+    batch_chars = 0
+    for item in items:
+        item_chars = size_of(item) if max_chars is not None else 0
+        if len(batch) and (len(batch) >= max_items or (max_chars is not None and batch_chars + item_chars > max_chars)):
+            yield batch
+            batch = []
+            batch_chars = 0
+        batch.append(item)
+        batch_chars += item_chars
+    if len(batch):
+        yield batch
+
+def read_text_files(init_folder_path):
+    """
+    Reads all .txt files in the specified folder, accepting both relative and absolute paths, 
+    and returns a dictionary with the contents of the files and their absolute paths.
+    Holds the whole folder in memory; prefer the discover/hash/read generators for large folders.
 
+    Args:
+    init_folder_path (str): The path to the folder containing .txt files.
+
+    Returns:
+    dict: A dictionary with two keys: 'documents' containing a list of the contents of each .txt file,
+          and 'paths' containing a list of absolute paths to each .txt file.
+    """
+    # Dictionary to store results
+    result = {"documents": [], "paths": [], "content_hashes":[], "doc_ids":[]}
+    for each_doc in read_documents(discover_text_files(init_folder_path)):
+        result['paths'].append(each_doc['path'])
+        result['content_hashes'].append(each_doc['content_hash'])
+        result['doc_ids'].append(each_doc['doc_id'])
+        result['documents'].append(each_doc['document'])
     return result
 
 def merge_dictionaries(dict1, dict2):
@@ -116,15 +610,196 @@ def merge_dictionaries(dict1, dict2):
             dict1[key] = dict2[key]
     return dict1
 
+def format_query_results(query_results):
+    """
+    Turns query results into the CHUNKS part of the answer prompt.
+
+    Returns:
+    tuple: (prompt text with one 'Chunk <n>:' section per retrieved chunk,
+            list of the chunks' metadatas, each with its 'relevance' added)
+    """
+    chunks = ""
+    chunk_count = 0
+    chunks_info = []
+    for query_count in range(len(query_results['documents'])):
+        for query_result_count in range(len(query_results['documents'][query_count])):
+            chunk_data = query_results['metadatas'][query_count][query_result_count]
+            chunk_data['relevance'] = 1 - query_results['distances'][query_count][query_result_count]
+            chunks_info.append(chunk_data)
+            chunk_count += 1
+            chunks += f"Chunk {chunk_count}:\n{query_results['documents'][query_count][query_result_count]}\n"
+    return chunks, chunks_info
+
+def reciprocal_rank_fusion(rankings, k = 60):
+    """
+    Fuses rankings (lists of ids, best first) into one: each id scores the sum of 1 / (k + its rank) in every ranking.
+
+    Returns:
+    list: (id, score), best first.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking, start=1):
+            scores[item_id] = scores.get(item_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+def merge_query_results(results_by_collection, n_results):
+    """
+    Merges the query results of several collections and sub-queries into one ranking: the n_results closest
+    chunks overall, each chunk once (same text or same chunk id, e.g. found by two sub-queries or a file
+    indexed in two collections) with its smallest distance. Metadatas get the 'collection' they come from
+    (left as they are under a None key).
+
+    Returns:
+    dict: results shaped like query_collection's for a single query text.
+    """
+    best_hits = {}  # chunk hash (or chunk id) -> (distance, chunk id, document, metadata)
+    for collection_name, query_results in results_by_collection.items():
+        for ids, documents, metadatas, distances in zip(query_results['ids'], query_results['documents'],
+                                                        query_results['metadatas'], query_results['distances']):
+            for chunk_id, document, metadata, distance in zip(ids, documents, metadatas, distances):
+                metadata = dict(metadata or {}) if collection_name is None else dict(metadata or {}, collection=collection_name)
+                key = metadata.get('chunk_hash') or chunk_id
+                if key not in best_hits or distance < best_hits[key][0]:
+                    best_hits[key] = (distance, chunk_id, document, metadata)
+    ranked = sorted(best_hits.values(), key=lambda hit: hit[0])[:n_results]
+    return {'ids': [[chunk_id for _, chunk_id, _, _ in ranked]],
+            'documents': [[document for _, _, document, _ in ranked]],
+            'metadatas': [[metadata for _, _, _, metadata in ranked]],
+            'distances': [[distance for distance, _, _, _ in ranked]]}
+
+def pipelined_retrieve(user_query, rewrite, retrieve, executor, timeout_s, n_results):
+    """
+    Retrieval overlapped with the query rewrite: rewrite(user_query) runs on the executor while
+    retrieve(user_query) runs on the calling thread. A rewrite arriving within timeout_s (counted from the
+    start) is retrieved too and both rankings are merged, each chunk once; otherwise the user query's
+    results are used and the rewrite is left to finish in the background (it still fills the caches).
+
+    Returns:
+    tuple: (query results, the rewritten query or None when it timed out or failed)
+    """
+    deadline = time.perf_counter() + timeout_s
+    rewrite_future = executor.submit(rewrite, user_query)
+    query_results = retrieve(user_query)
+    try:
+        optimized_query = rewrite_future.result(timeout=max(0.0, deadline - time.perf_counter()))
+    except FutureTimeoutError:
+        print(f"Query rewrite slower than {timeout_s}s, using the results of the query as typed")
+        metrics.count('rag_query_rewrites_total', outcome='timeout')
+        return query_results, None
+    except Exception as exp:
+        print(f"Query rewrite failed, using the results of the query as typed: {exp}")
+        metrics.count('rag_query_rewrites_total', outcome='failed')
+        return query_results, None
+    if optimized_query.strip() == user_query.strip():
+        metrics.count('rag_query_rewrites_total', outcome='unchanged')
+        return query_results, optimized_query
+    metrics.count('rag_query_rewrites_total', outcome='merged')
+    rewritten_results = retrieve(optimized_query)
+    # the two rankings merged as if they were two sub-queries
+    both_results = {key: query_results[key] + rewritten_results[key] for key in ('ids', 'documents', 'metadatas', 'distances')}
+    return merge_query_results({None: both_results}, n_results), optimized_query
+
+def iter_collection_metadatas(collection, page_size = 5000):
+    # Yields (chunk_id, metadata) for every chunk of the collection, without the documents or embeddings
+    offset = 0
+    while True:
+        page = collection.get(include=['metadatas'], limit=page_size, offset=offset)
+        yield from zip(page['ids'], page['metadatas'])
+        if len(page['ids']) < page_size:
+            return
+        offset += len(page['ids'])
+
+def diff_collection(stored_chunks, doc_index):
+    """
+    Compares the chunks stored in a collection with the files currently on disk, in linear time.
+
+    Args:
+    stored_chunks (iterable): (chunk_id, metadata) pairs, chunk ids following the '<doc_id>><i>' scheme.
+    doc_index (dict): doc_id -> file info with at least 'content_hash'.
+
+    Returns:
+    dict: 'new_doc_ids' (docs to add, including changed ones), 'doc_ids_to_delete' (chunk ids of removed docs),
+          'changed_chunks' (changed doc_id -> {chunk_id: chunk_hash} of its stored chunks, diffed chunk by chunk
+          when the doc is added again), plus 'added_doc_ids', 'changed_doc_ids' and 'removed_doc_ids'.
+    """
+    # index the stored chunks by doc_id
+    stored_chunk_hashes = {}
+    stored_hashes = {}
+    for chunk_id, metadata in stored_chunks:
+        doc_id = chunk_id.split('>', 1)[0]
+        metadata = metadata or {}
+        stored_chunk_hashes.setdefault(doc_id, {})[chunk_id] = metadata.get('chunk_hash')
+        stored_hashes.setdefault(doc_id, set()).add(metadata.get('doc_hash'))
+
+    added_doc_ids = []
+    changed_doc_ids = []
+    for doc_id, each_file in doc_index.items():
+        doc_hashes = stored_hashes.get(doc_id)
+        if doc_hashes is None:
+            added_doc_ids.append(doc_id)
+        # compare against this document's own hash; mixed hashes mean a partially stale document
+        elif doc_hashes != {each_file['content_hash']}:
+            changed_doc_ids.append(doc_id)
+    removed_doc_ids = [doc_id for doc_id in stored_chunk_hashes if doc_id not in doc_index]
+
+    doc_ids_to_delete = [chunk_id for doc_id in removed_doc_ids for chunk_id in stored_chunk_hashes[doc_id]]
+    changed_chunks = {doc_id: stored_chunk_hashes[doc_id] for doc_id in changed_doc_ids}
+    new_doc_ids = [doc_id for doc_id in doc_index if doc_id in changed_chunks or doc_id not in stored_hashes]
+    return {'new_doc_ids': new_doc_ids,
+            'doc_ids_to_delete': doc_ids_to_delete,
+            'changed_chunks': changed_chunks,
+            'added_doc_ids': added_doc_ids,
+            'changed_doc_ids': changed_doc_ids,
+            'removed_doc_ids': removed_doc_ids}
+
 class Chroma_Database:
-    def __init__(self, config_json: dict):
+    # 'vector': embedding similarity, 'keyword': BM25 on the lexical index (no model call), 'hybrid': both, fused
+    QUERY_MODES = ('vector', 'keyword', 'hybrid')
+
+    def __init__(self, config_json: dict, embedding_function = None):
         self.config_json = config_json
-        self.client = chromadb.PersistentClient(path=config_json['CHROMA_DATA_PATH'])
-        self.openai_ef = embedding_functions.OpenAIEmbeddingFunction(
-                model_name = config_json['OpenAI_embedding_config']['model_name'],
-                api_base = config_json['OpenAI_embedding_config']['api_base'],
-                api_key = config_json['OpenAI_embedding_config']['api_key']
-            )
+        # the collections live in Chroma, or in the compact memory-mapped store of vector_store.py
+        backend = config_json.get('vector_store', {}).get('backend', 'chroma')
+        self.client = open_backend(backend, config_json)
+        if (backend == 'numpy' and not len(self.client.list_collections())
+                and os.path.exists(os.path.join(config_json['CHROMA_DATA_PATH'], 'chroma.sqlite3'))):
+            print("The numpy vector store is empty: collections stored in Chroma are not moved over by themselves, "
+                  "copy them with 'python vector_store.py copy --to numpy'")
+        embedding_config = config_json['OpenAI_embedding_config']
+        if embedding_function is not None:
+            self.openai_ef = embedding_function
+        elif embedding_config.get('client', 'pooled') == 'chroma':
+            # chromadb's own (serial) client
+            self.openai_ef = embedding_functions.OpenAIEmbeddingFunction(
+                    model_name = embedding_config['model_name'],
+                    api_base = embedding_config['api_base'],
+                    api_key = embedding_config['api_key']
+                )
+        else:
+            self.openai_ef = OpenAI_Embedding_Client.from_config(embedding_config)
+        # the persistent cache is for document chunks only: query texts stay off the disk (they have the in-memory
+        # query cache) and do not push chunk embeddings out of it
+        self.ingest_ef = self.openai_ef
+        cache_config = config_json.get('embedding_cache', {})
+        if cache_config.get('enabled', True):
+            self.ingest_ef = Cached_Embedding_Function(self.openai_ef,
+                                model_name = embedding_config['model_name'],
+                                db_path = os.path.join(config_json['CHROMA_DATA_PATH'], 'embedding_cache.sqlite3'),
+                                max_entries = cache_config.get('max_entries', 200000))
+        self.query_cache = Query_Cache.from_config(config_json.get('query_cache', {}))
+        self.manifest = Sync_Manifest(os.path.join(config_json['CHROMA_DATA_PATH'], 'sync_manifest.sqlite3'))
+        self.catalog = Document_Catalog(os.path.join(config_json['CHROMA_DATA_PATH'], 'document_catalog.sqlite3'))
+        self.catalog_checked = set()  # collections whose catalog was compared with the collection by this process
+        self.catalog_guard = threading.Lock()
+        self.write_locks = {}
+        self.write_locks_guard = threading.Lock()
+        self.lexical_indexes = {}  # collection name -> Lexical_Index, shared by all sessions
+        self.lexical_indexes_guard = threading.Lock()
+        self.cpu_pool = CPU_Pool(config_json['add_to_collection_config'].get('cpu_workers', 1))
+        # threads are only started when a search covers several collections
+        self.federated_executor = ThreadPoolExecutor(max_workers=config_json.get('federated_search_workers', 4),
+                                                     thread_name_prefix="federated_search")
 
     def init_collection(self, collection_name = None):
         self.clean_collection_info()
@@ -144,115 +819,510 @@ class Chroma_Database:
                             metadata={"hnsw:space": "cosine"},
                         )
 
+    def open_session(self, collection_name = None):
+        """
+        Returns a Chroma_Database bound to its own collection and sync state, sharing this one's
+        client, embedding function, caches and write locks. Lets background tasks work on a
+        collection while the GUI switches to another one.
+        """
+        session = copy.copy(self)
+        session.init_collection(collection_name)
+        return session
+
+    def list_collection_names(self):
+        return [collection.name for collection in self.client.list_collections()]
+
+    def list_documents(self, collection_name = None, offset = 0, limit = None):
+        """
+        Documents stored in a collection (the loaded one by default), read from the document catalog.
+
+        Returns:
+        list: one dict per document, sorted by path, from offset and at most limit of them:
+              'doc_id', 'doc_path', 'doc_hash', 'chunk_count' and 'chunk_ids'.
+        """
+        collection_name = self.document_catalog(collection_name)
+        documents = self.catalog.page(collection_name, offset, limit)
+        for each_doc in documents:
+            each_doc['chunk_ids'] = [f"{each_doc['doc_id']}>{i}" for i in range(each_doc['chunk_count'])]
+        return documents
+
+    def count_documents(self, collection_name = None):
+        return self.catalog.count(self.document_catalog(collection_name))[0]
+
+    def list_document_folders(self, collection_name = None):
+        # folders holding the collection's documents, e.g. to check them again
+        return self.catalog.folders(self.document_catalog(collection_name))
+
+    def document_catalog(self, collection_name = None):
+        """
+        Makes sure the catalog of the collection (the loaded one by default) matches it, rebuilding it from the
+        chunks' metadatas once when it does not hold as many chunks (collection created before the catalog,
+        interrupted write). Returns the collection name.
+        """
+        collection = self.collection if collection_name is None else self.client.get_collection(name=collection_name)
+        with self.catalog_guard:
+            if collection.name not in self.catalog_checked:
+                if self.catalog.count(collection.name)[1] != collection.count():
+                    self.rebuild_document_catalog(collection)
+                self.catalog_checked.add(collection.name)
+        return collection.name
+
+    def rebuild_document_catalog(self, collection):
+        print(f"Building the document catalog of collection '{collection.name}'")
+        documents = {}
+        for chunk_id, metadata in iter_collection_metadatas(collection, self.config_json.get('sync_page_size', 5000)):
+            doc_id = chunk_id.split('>', 1)[0]
+            metadata = metadata or {}
+            each_doc = documents.get(doc_id)
+            if each_doc is None:
+                each_doc = documents[doc_id] = {'doc_id': doc_id, 'doc_path': metadata.get('doc_path', ''),
+                                                'doc_hash': metadata.get('doc_hash', ''), 'chunk_count': 0}
+            elif each_doc['doc_hash'] != metadata.get('doc_hash', ''):
+                # partially stale document
+                each_doc['doc_hash'] = ''
+            each_doc['chunk_count'] += 1
+        self.catalog.replace_collection(collection.name, documents.values())
+
+    def write_lock(self, collection_name):
+        # One lock per collection name, shared by all sessions: serialises writes to the same collection
+        with self.write_locks_guard:
+            return self.write_locks.setdefault(collection_name, threading.Lock())
+
+    def lexical_index_path(self, collection_name):
+        return os.path.join(self.config_json['CHROMA_DATA_PATH'], 'lexical_index', f"{collection_name}.sqlite3")
+
+    def lexical_index(self):
+        """
+        Keyword index of the loaded collection, None when disabled in the config. Rebuilt from the stored chunks
+        when it does not hold as many chunks as the collection (collection created before the index, interrupted write).
+        """
+        lexical_config = self.config_json.get('lexical_index', {})
+        if not lexical_config.get('enabled', True):
+            return None
+        collection_name = self.collection.name
+        with self.lexical_indexes_guard:
+            index = self.lexical_indexes.get(collection_name)
+            if index is None:
+                os.makedirs(os.path.dirname(self.lexical_index_path(collection_name)), exist_ok=True)
+                index = Lexical_Index(self.lexical_index_path(collection_name),
+                                      tokenizer = lexical_config.get('tokenizer', 'unicode61 remove_diacritics 2'))
+                if index.count() != self.collection.count():
+                    self.rebuild_lexical_index(index)
+                self.lexical_indexes[collection_name] = index
+        return index
+
+    def rebuild_lexical_index(self, index):
+        print(f"Building the keyword index of collection '{self.collection.name}'")
+        index.clear()
+        page_size = self.config_json.get('sync_page_size', 5000)
+        offset = 0
+        while True:
+            page = self.collection.get(include=['documents'], limit=page_size, offset=offset)
+            if not len(page['ids']):
+                break
+            index.upsert(page['ids'], page['documents'])
+            offset += len(page['ids'])
+        index.optimize()
+
     def clean_collection_info(self):
-        self.doc_output = None
+        self.doc_index = None
         self.doc_ids_to_delete = None
         self.new_doc_ids = None
+        self.changed_chunks = None
 
-    def docs_check_sync_bk(self, doc_file_path = None):
+    def index_folders(self, doc_file_path = None, progress = None):
+        # discover and hash the files, keeping only their path and hash in memory (not their content).
+        # Files whose size and mtime match the sync manifest are not opened at all.
         if doc_file_path is None:
-            self.doc_output = read_text_files(self.config_json['default_doc_files_path'])
-        else:
-            self.doc_output = read_text_files(doc_file_path)
-
-        content_hashes = self.doc_output['content_hashes']
-        doc_ids = self.doc_output['doc_ids']
-        # determine what to add, update or delete in DB
-        stored_docs = self.collection.get()
-        stored_ids = stored_docs['ids']
-        # what to delete
-        stored_doc_ids = []
-        doc_ids_2del = []
-        for each_stored_idx, stored_id in enumerate(stored_ids):
-            stored_doc_id = stored_id.split('>', 1)[0]
-            stored_doc_ids.append(stored_doc_id)
-            if stored_doc_id not in doc_ids:
-                doc_ids_2del.append(stored_id)
-            else:
-                # what has changed
-                stored_doc_hash = stored_docs['metadatas'][each_stored_idx]['doc_hash']
-                if stored_doc_hash not in content_hashes:
-                    doc_ids_2del.append(stored_id)
-        # what to add
-        after_del_stored_doc_ids =  [item for item in stored_ids if item not in doc_ids_2del]
-        after_del_stored_doc_ids = [s.split('>', 1)[0] for s in after_del_stored_doc_ids]
-        new_doc_ids = [item for item in doc_ids if item not in after_del_stored_doc_ids]
-        self.doc_ids_to_delete = doc_ids_2del
-        self.new_doc_ids = new_doc_ids
-        return {'new_doc_ids': new_doc_ids, 'doc_ids_to_delete': doc_ids_2del}
-
-    def docs_check_sync(self, doc_file_path = None):
-        if doc_file_path is None:
-            self.doc_output = read_text_files(self.config_json['default_doc_files_path'])
-        else:
-            if isinstance(doc_file_path, list):
-                self.doc_output = {}
-                for each_path in doc_file_path:
-                    doc_output = read_text_files(each_path)
-                    self.doc_output = merge_dictionaries(self.doc_output, doc_output)
-            else:
-                self.doc_output = read_text_files(doc_file_path)
-
-        content_hashes = self.doc_output['content_hashes']
-        doc_ids = self.doc_output['doc_ids']
-        # determine what to add, update or delete in DB
-        stored_docs = self.collection.get()
-        stored_ids = stored_docs['ids']
-        # what to delete
-        stored_doc_ids = []
-        doc_ids_2del = []
-        for each_stored_idx, stored_id in enumerate(stored_ids):
-            stored_doc_id = stored_id.split('>', 1)[0]
-            stored_doc_ids.append(stored_doc_id)
-            if stored_doc_id not in doc_ids:
-                doc_ids_2del.append(stored_id)
-            else:
-                # what has changed
-                stored_doc_hash = stored_docs['metadatas'][each_stored_idx]['doc_hash']
-                if stored_doc_hash not in content_hashes:
-                    doc_ids_2del.append(stored_id)
-        # what to add
-        after_del_stored_doc_ids =  [item for item in stored_ids if item not in doc_ids_2del]
-        after_del_stored_doc_ids = [s.split('>', 1)[0] for s in after_del_stored_doc_ids]
-        new_doc_ids = [item for item in doc_ids if item not in after_del_stored_doc_ids]
-        self.doc_ids_to_delete = doc_ids_2del
-        self.new_doc_ids = new_doc_ids
-        return {'new_doc_ids': new_doc_ids, 'doc_ids_to_delete': doc_ids_2del}
+            doc_file_path = self.config_json['default_doc_files_path']
+        folder_paths = doc_file_path if isinstance(doc_file_path, list) else [doc_file_path]
+        known_files = self.manifest.load(self.collection.name)
+        self.doc_index = {}
+        rehashed_files = []
+        for each_path in folder_paths:
+            for each_file in hash_text_files(discover_text_files(each_path), known_files,
+                                             self.cpu_pool.get_executor(), 2 * self.cpu_pool.workers):
+                self.doc_index[each_file['doc_id']] = each_file
+                if each_file['rehashed']:
+                    rehashed_files.append(each_file)
+                if progress is not None and len(self.doc_index) % 100 == 0:
+                    progress('files hashed', len(self.doc_index))
+        # forget files that disappeared from the scanned folders
+        scanned_folders = {os.path.abspath(each_path) for each_path in folder_paths}
+        seen_paths = {each_file['path'] for each_file in self.doc_index.values()}
+        vanished_paths = [path for path in known_files
+                          if os.path.dirname(path) in scanned_folders and path not in seen_paths]
+        self.manifest.update(self.collection.name, rehashed_files)
+        self.manifest.forget(self.collection.name, vanished_paths)
+        if progress is not None:
+            progress('files hashed', len(self.doc_index))
+        return self.doc_index
+
+    def docs_check_sync_bk(self, doc_file_path = None):
+        # kept for backward compatibility, served by the same diff engine
+        return self.docs_check_sync(doc_file_path)
+
+    def docs_check_sync(self, doc_file_path = None, progress = None):
+        with metrics.span('sync', collection=self.collection.name) as sync_span:
+            with metrics.span('sync.index_folders'):
+                self.index_folders(doc_file_path, progress)
+            # determine what to add, update or delete in DB, fetching only ids and metadatas page by page
+            page_size = self.config_json.get('sync_page_size', 5000)
+            with metrics.span('sync.diff'):
+                sync_result = diff_collection(iter_collection_metadatas(self.collection, page_size), self.doc_index)
+            sync_span['attributes'].update(files=len(self.doc_index), new_docs=len(sync_result['new_doc_ids']),
+                                           chunks_to_delete=len(sync_result['doc_ids_to_delete']))
+        self.doc_ids_to_delete = sync_result['doc_ids_to_delete']
+        self.new_doc_ids = sync_result['new_doc_ids']
+        self.changed_chunks = sync_result['changed_chunks']
+        return sync_result
+
+    def delete_collection(self, collection_name):
+        self.client.delete_collection(collection_name)
+        self.manifest.drop_collection(collection_name)
+        self.catalog.drop_collection(collection_name)
+        with self.catalog_guard:
+            self.catalog_checked.discard(collection_name)
+        self.query_cache.invalidate(collection_name)
+        with self.lexical_indexes_guard:
+            index = self.lexical_indexes.pop(collection_name, None)
+            if index is not None:
+                index.close()
+            if os.path.exists(self.lexical_index_path(collection_name)):
+                os.remove(self.lexical_index_path(collection_name))
 
     def delete_from_collection(self, ids_list = None):
         if ids_list is None:
             ids_list = self.doc_ids_to_delete
         if len(ids_list):
             # Delete from collection DB
-            self.collection.delete(ids_list)
+            with metrics.span('delete', collection=self.collection.name, chunks=len(ids_list)):
+                lexical_index = self.lexical_index()
+                self.collection.delete(ids_list)
+                if lexical_index is not None:
+                    lexical_index.delete(ids_list)
+                self.catalog.remove_chunks(self.collection.name, ids_list)
+            metrics.count('rag_chunks_total', len(ids_list), action='deleted')
+            self.query_cache.invalidate(self.collection.name)
     
-    def add_to_collection(self, ids_list = None):
+    def add_to_collection(self, ids_list = None, progress = None):
         if ids_list is None:
             ids_list = self.new_doc_ids
-        doc_ids = self.doc_output['doc_ids']
-        content_hashes = self.doc_output['content_hashes']
-        documents = self.doc_output['documents']
-        doc_paths = self.doc_output['paths']
-        # Initialize the WordBasedTextSplitter and add to DB
-        splitter = WordBasedTextSplitter(max_words_per_chunk=self.config_json['add_to_collection_config']['max_words_per_chunk'],
-                                         overlap_words=self.config_json['add_to_collection_config']['overlap_words'])
-        for each_doc_id in ids_list:
-            each_doc_idx = doc_ids.index(each_doc_id)
-            print(f"Adding/updating document with lenght= {splitter.words_count(documents[each_doc_idx])}")
-            # Split the sample text into smaller chunks
-            chunks = splitter.split_text(documents[each_doc_idx])
-            ids=[f"{doc_ids[each_doc_idx]}>{i}" for i in range(len(chunks))]
-            metadatas=[{"doc_path": f"{doc_paths[each_doc_idx]}",
-                        "doc_chunk": f"{i}",
-                        "doc_hash": f"{content_hashes[each_doc_idx]}"} for i in range(len(chunks))]
-            # Add to collection DB
-            self.collection.add(documents=chunks, ids=ids, metadatas=metadatas)
-
-    def query_collection(self, query_texts:str = '', texts_delimiter = '|'):
-        query_texts = query_texts.split(texts_delimiter)
-        query_results = self.collection.query(
-                            query_texts=query_texts,
-                            include=["documents", "metadatas", "distances"],
-                            n_results=self.config_json['query_nr_results'] # for each query
-                        )
+        add_config = self.config_json['add_to_collection_config']
+        # Initialize the text splitter and add to DB
+        splitter = make_text_splitter(add_config)
+        cpu_executor = self.cpu_pool.get_executor()
+        with metrics.span('ingest', collection=self.collection.name, documents=len(ids_list)) as ingest_span:
+            # opened (and brought in sync with the collection if needed) before anything is written
+            lexical_index = self.lexical_index()
+            self.document_catalog()
+            files = (self.doc_index[each_doc_id] for each_doc_id in ids_list)
+            if cpu_executor is None:
+                # read -> split run ahead on a worker thread, bounded to max_docs_in_flight documents
+                documents = read_documents(files, stream_threshold=add_config.get('stream_threshold_mb', 64) << 20)
+                documents = prefetch(split_documents(documents, splitter), add_config.get('max_docs_in_flight', 8))
+            else:
+                # read -> split on the process pool, two batches per process ahead of the embed / write stage
+                documents = prefetch(read_split_documents_parallel(files, add_config, cpu_executor, 2 * self.cpu_pool.workers),
+                                     add_config.get('max_docs_in_flight', 8))
+            # changed documents are diffed chunk by chunk against what is stored
+            unchanged_chunk_ids = set()
+            reused_embeddings = {}
+            self.last_add_stats = {'embedded': 0, 'reused': 0, 'unchanged': 0, 'deleted': 0}
+            documents = self.diff_stored_chunks(documents, self.changed_chunks or {}, unchanged_chunk_ids, reused_embeddings)
+            # chunks from many documents are packed together: embed -> write in large batches
+            write_batch_size = min(add_config.get('write_batch_size', 1024), self.client.get_max_batch_size())
+            nr_chunks_written = 0
+            partially_written = {}  # doc_id -> number of its chunks already written, until the document's last chunk is written
+            try:
+                for batch in batched(iter_chunk_records(documents), max_items=write_batch_size):
+                    ids, chunks, metadatas, last_chunk_flags = (list(column) for column in zip(*batch))
+                    unchanged = [i for i, chunk_id in enumerate(ids) if chunk_id in unchanged_chunk_ids]
+                    to_write = [i for i, chunk_id in enumerate(ids) if chunk_id not in unchanged_chunk_ids]
+                    to_embed = [i for i in to_write if ids[i] not in reused_embeddings]
+                    with metrics.span('ingest.embed', chunks=len(to_embed)):
+                        embeddings = dict(zip(to_embed, self.embed_texts([chunks[i] for i in to_embed])))
+                    with metrics.span('ingest.write', chunks=len(ids)):
+                        # Add to collection DB
+                        if len(to_write):
+                            self.collection.upsert(ids=[ids[i] for i in to_write],
+                                                   embeddings=[embeddings[i] if i in embeddings else reused_embeddings.pop(ids[i]) for i in to_write],
+                                                   documents=[chunks[i] for i in to_write],
+                                                   metadatas=[metadatas[i] for i in to_write])
+                            if lexical_index is not None:
+                                lexical_index.upsert([ids[i] for i in to_write], [chunks[i] for i in to_write])
+                        # same text under the same id: only the document hash in the metadata changes
+                        if len(unchanged):
+                            self.collection.update(ids=[ids[i] for i in unchanged], metadatas=[metadatas[i] for i in unchanged])
+                            unchanged_chunk_ids.difference_update(ids[i] for i in unchanged)
+                    metrics.count('rag_chunks_total', len(to_embed), action='embedded')
+                    metrics.count('rag_chunks_total', len(to_write) - len(to_embed), action='reused')
+                    metrics.count('rag_chunks_total', len(unchanged), action='unchanged')
+                    self.last_add_stats['embedded'] += len(to_embed)
+                    self.last_add_stats['reused'] += len(to_write) - len(to_embed)
+                    self.last_add_stats['unchanged'] += len(unchanged)
+                    written_docs = []
+                    for chunk_id, metadata, is_last_chunk in zip(ids, metadatas, last_chunk_flags):
+                        doc_id = chunk_id.split('>', 1)[0]
+                        if is_last_chunk:
+                            partially_written.pop(doc_id, None)
+                            written_docs.append({'doc_id': doc_id, 'doc_path': metadata['doc_path'], 'doc_hash': metadata['doc_hash'],
+                                                 'chunk_count': int(metadata['doc_chunk']) + 1})
+                        else:
+                            partially_written[doc_id] = partially_written.get(doc_id, 0) + 1
+                    # documents enter the catalog once all their chunks are written
+                    self.catalog.upsert(self.collection.name, written_docs)
+                    nr_chunks_written += len(ids)
+                    if progress is not None:
+                        progress('chunks embedded', nr_chunks_written)
+            except BaseException:
+                # on failure or cancel, half-written documents would look in sync on the next recheck:
+                # blank their document hash so they are seen as changed, keeping the chunks (and embeddings) written so far
+                # (a document's chunks are written in order: its first ones)
+                partial_chunk_ids = (f"{doc_id}>{i}" for doc_id, nr_written in partially_written.items() for i in range(nr_written))
+                for ids in batched(partial_chunk_ids, max_items=write_batch_size):
+                    stored = self.collection.get(ids=ids, include=['metadatas'])
+                    self.collection.update(ids=stored['ids'], metadatas=[dict(metadata, doc_hash='') for metadata in stored['metadatas']])
+                if len(partially_written):
+                    # their chunks are not in the catalog yet: compared with the collection again on next use
+                    with self.catalog_guard:
+                        self.catalog_checked.discard(self.collection.name)
+                raise
+            finally:
+                # even a partial ingest changes the collection
+                self.query_cache.invalidate(self.collection.name)
+            ingest_span['attributes'].update(self.last_add_stats)
+            print(f"Chunks: {self.last_add_stats}")
+            if isinstance(self.ingest_ef, Cached_Embedding_Function):
+                print(f"Embedding cache: {self.ingest_ef.stats()}")
+
+    def diff_stored_chunks(self, documents, changed_chunks, unchanged_chunk_ids, reused_embeddings):
+        """
+        Chunk-level diff of each changed document against its stored chunks ({chunk_id: chunk_hash}),
+        run when the document is about to be written so its stored embeddings are still the old ones:
+        - a chunk stored under the same id with the same chunk_hash goes to unchanged_chunk_ids (metadata update only)
+        - a chunk whose text is stored under another id gets that embedding in reused_embeddings
+        - stored chunk ids the new version does not use are deleted
+        Every other chunk is embedded.
+        """
+        for each_doc in documents:
+            stored_chunks = changed_chunks.get(each_doc['doc_id'])
+            if stored_chunks:
+                chunk_hashes = each_doc['chunk_hashes']
+                if chunk_hashes is None:
+                    # streamed document: one pass over the file to hash its chunks, they are streamed again when written
+                    chunk_hashes = [get_chunk_hash(chunk) for chunk in each_doc['chunks']]
+                chunk_ids = [f"{each_doc['doc_id']}>{i}" for i in range(len(chunk_hashes))]
+                stored_ids_by_hash = {chunk_hash: chunk_id for chunk_id, chunk_hash in stored_chunks.items() if chunk_hash}
+                moved_chunks = {}  # chunk id -> stored chunk id holding the same text
+                for chunk_id, chunk_hash in zip(chunk_ids, chunk_hashes):
+                    if stored_chunks.get(chunk_id) == chunk_hash:
+                        unchanged_chunk_ids.add(chunk_id)
+                    elif chunk_hash in stored_ids_by_hash:
+                        moved_chunks[chunk_id] = stored_ids_by_hash[chunk_hash]
+                if len(moved_chunks):
+                    stored = self.collection.get(ids=list(set(moved_chunks.values())), include=['embeddings'])
+                    stored_embeddings = dict(zip(stored['ids'], stored['embeddings']))
+                    for chunk_id, stored_id in moved_chunks.items():
+                        if stored_id in stored_embeddings:
+                            reused_embeddings[chunk_id] = stored_embeddings[stored_id]
+                # until all new chunks are written, the remaining old chunks keep the old document hash,
+                # so the document still shows as changed if the ingest stops half way
+                new_chunk_ids = set(chunk_ids)
+                stale_chunk_ids = [chunk_id for chunk_id in stored_chunks if chunk_id not in new_chunk_ids]
+                if len(stale_chunk_ids):
+                    self.collection.delete(stale_chunk_ids)
+                    lexical_index = self.lexical_index()
+                    if lexical_index is not None:
+                        lexical_index.delete(stale_chunk_ids)
+                    self.catalog.remove_chunks(self.collection.name, stale_chunk_ids)
+                    self.last_add_stats['deleted'] += len(stale_chunk_ids)
+                    metrics.count('rag_chunks_total', len(stale_chunk_ids), action='deleted')
+            yield each_doc
+
+    def embed_texts(self, texts):
+        # Embeds the texts in requests of at most embedding_batch_size chunks / embedding_batch_chars characters
+        add_config = self.config_json['add_to_collection_config']
+        batches = batched(texts, max_items=add_config.get('embedding_batch_size', 64),
+                          max_chars=add_config.get('embedding_batch_chars', 64000))
+        # embedding functions that can run several requests concurrently get all of them at once
+        embed_batches = getattr(self.ingest_ef, 'embed_batches', None)
+        if embed_batches is not None:
+            return embed_batches(batches)
+        embeddings = []
+        for batch in batches:
+            embeddings.extend(self.ingest_ef(batch))
+        return embeddings
+
+    def embed_queries(self, query_texts):
+        # query text -> embedding, served from the in-process query cache when possible
+        model_name = self.config_json['OpenAI_embedding_config']['model_name']
+        embeddings = [self.query_cache.embeddings.get((model_name, text)) for text in query_texts]
+        missing_texts = [text for text, embedding in zip(query_texts, embeddings) if embedding is None]
+        metrics.count('rag_cache_requests_total', len(query_texts) - len(missing_texts), cache='query_embeddings', result='hit')
+        metrics.count('rag_cache_requests_total', len(missing_texts), cache='query_embeddings', result='miss')
+        if len(missing_texts):
+            start_time = time.perf_counter()
+            with metrics.span('query.embed', texts=len(missing_texts)):
+                new_embeddings = dict(zip(missing_texts, self.openai_ef(missing_texts)))
+            cost_s = (time.perf_counter() - start_time) / len(missing_texts)
+            for text, embedding in new_embeddings.items():
+                self.query_cache.embeddings.put((model_name, text), embedding, cost_s=cost_s)
+            embeddings = [new_embeddings[text] if embedding is None else embedding
+                          for text, embedding in zip(query_texts, embeddings)]
+        return embeddings
+
+    def vector_query(self, query_texts, n_results, query_embeddings = None):
+        if query_embeddings is None:
+            query_embeddings = self.embed_queries(query_texts)
+        with metrics.span('query.search'):
+            return self.collection.query(
+                        query_embeddings=query_embeddings,
+                        include=["documents", "metadatas", "distances"],
+                        n_results=n_results
+                    )
+
+    def lexical_query(self, query_texts, n_results, mode, query_embeddings = None):
+        """
+        'keyword' (BM25 ranking, no model call) or 'hybrid' (BM25 and vector rankings fused by reciprocal rank)
+        results, shaped like collection.query's. Distances are 1 - score / best score, the best chunk having relevance 1.
+        """
+        lexical_index = self.lexical_index()
+        if lexical_index is None:
+            raise ValueError(f"'{mode}' queries need the lexical index, enabled in 'lexical_index' of the config")
+        lexical_config = self.config_json.get('lexical_index', {})
+        n_candidates = n_results * lexical_config.get('hybrid_candidates', 4) if mode == 'hybrid' else n_results
+        with metrics.span('query.keyword'):
+            ranked = [lexical_index.search(text, n_candidates) for text in query_texts]
+        if mode == 'hybrid':
+            vector_results = self.vector_query(query_texts, n_candidates, query_embeddings)
+            with metrics.span('query.fuse'):
+                ranked = [reciprocal_rank_fusion([[chunk_id for chunk_id, _ in keyword_hits], vector_ids],
+                                                 lexical_config.get('rrf_k', 60))[:n_results]
+                          for keyword_hits, vector_ids in zip(ranked, vector_results['ids'])]
+        # texts and metadatas of the ranked chunks, from the collection
+        needed_ids = list({chunk_id for each_ranked in ranked for chunk_id, _ in each_ranked})
+        stored_chunks = {}
+        if len(needed_ids):
+            stored = self.collection.get(ids=needed_ids, include=['documents', 'metadatas'])
+            stored_chunks = {chunk_id: (document, metadata)
+                             for chunk_id, document, metadata in zip(stored['ids'], stored['documents'], stored['metadatas'])}
+        query_results = {'ids': [], 'documents': [], 'metadatas': [], 'distances': []}
+        for each_ranked in ranked:
+            each_ranked = [(chunk_id, score) for chunk_id, score in each_ranked if chunk_id in stored_chunks]
+            best_score = each_ranked[0][1] if len(each_ranked) and each_ranked[0][1] > 0 else 1.0
+            query_results['ids'].append([chunk_id for chunk_id, _ in each_ranked])
+            query_results['documents'].append([stored_chunks[chunk_id][0] for chunk_id, _ in each_ranked])
+            query_results['metadatas'].append([stored_chunks[chunk_id][1] for chunk_id, _ in each_ranked])
+            query_results['distances'].append([1 - score / best_score for _, score in each_ranked])
+        return query_results
+
+    def search(self, query_texts, n_results, mode, query_embeddings = None):
+        if mode == 'vector':
+            return self.vector_query(query_texts, n_results, query_embeddings)
+        if mode in self.QUERY_MODES:
+            return self.lexical_query(query_texts, n_results, mode, query_embeddings)
+        raise ValueError(f"Unknown query mode '{mode}', expected one of {self.QUERY_MODES}")
+
+    def query_collection(self, query_texts:str = '', texts_delimiter = '|', mode = None, n_results = None, query_embeddings = None):
+        if isinstance(query_texts, str):
+            query_texts = query_texts.split(texts_delimiter)
+        if n_results is None:
+            n_results = self.config_json['query_nr_results'] # for each query
+        if mode is None:
+            mode = self.config_json.get('query_mode', 'vector')
+        results_key = (self.collection.name, self.query_cache.generation(self.collection.name), tuple(query_texts), n_results, mode)
+        with metrics.span('query', collection=self.collection.name, texts=len(query_texts), mode=mode) as query_span:
+            query_results = self.query_cache.results.get(results_key)
+            query_span['attributes']['cached'] = query_results is not None
+            metrics.count('rag_cache_requests_total', cache='query_results', result='miss' if query_results is None else 'hit')
+            if query_results is not None:
+                # callers annotate the results, never hand out the cached object itself
+                return copy.deepcopy(query_results)
+            start_time = time.perf_counter()
+            query_results = self.search(query_texts, n_results, mode, query_embeddings)
+        self.query_cache.results.put(results_key, copy.deepcopy(query_results), cost_s=time.perf_counter() - start_time)
+        return query_results
+
+    def query_collections(self, collection_names, query_texts, texts_delimiter = '|', mode = None, n_results = None):
+        """
+        Federated search: every collection is queried concurrently (with all the sub-queries of the text)
+        and the results are merged by merge_query_results into the global n_results closest chunks.
+        The query embeddings are computed once for all the collections.
+
+        Returns:
+        tuple: (merged query results, {collection name: {'latency_s', 'chunks'} or {'latency_s', 'error'}})
+        """
+        if isinstance(query_texts, str):
+            query_texts = query_texts.split(texts_delimiter)
+        if n_results is None:
+            n_results = self.config_json['query_nr_results']
+        if mode is None:
+            mode = self.config_json.get('query_mode', 'vector')
+        collection_names = list(dict.fromkeys(collection_names))
+        # opening a session on an unknown name would create the collection
+        existing_names = set(self.list_collection_names())
+        with metrics.span('query.federated', collections=len(collection_names), texts=len(query_texts)) as federated_span:
+            query_embeddings = self.embed_queries(query_texts) if mode != 'keyword' else None
+
+            def query_one_collection(collection_name):
+                start_time = time.perf_counter()
+                if collection_name not in existing_names:
+                    return None, {'latency_s': 0.0, 'error': f"Collection '{collection_name}' does not exist"}
+                try:
+                    query_results = self.open_session(collection_name).query_collection(
+                                        query_texts, mode=mode, n_results=n_results, query_embeddings=query_embeddings)
+                except Exception as exp:
+                    return None, {'latency_s': time.perf_counter() - start_time, 'error': str(exp)}
+                return query_results, {'latency_s': time.perf_counter() - start_time,
+                                       'chunks': sum(len(ids) for ids in query_results['ids'])}
+
+            if len(collection_names) == 1:
+                outcomes = [query_one_collection(collection_names[0])]
+            else:
+                outcomes = list(self.federated_executor.map(query_one_collection, collection_names))
+            collection_stats = dict(zip(collection_names, (stats for _, stats in outcomes)))
+            results_by_collection = {collection_name: query_results
+                                     for collection_name, (query_results, _) in zip(collection_names, outcomes)
+                                     if query_results is not None}
+            failed = {collection_name: stats['error'] for collection_name, stats in collection_stats.items() if 'error' in stats}
+            if len(failed) and not len(results_by_collection):
+                raise RuntimeError(f"Search failed in every collection: {failed}")
+            for collection_name, error in failed.items():
+                print(f"Search in collection '{collection_name}' failed: {error}")
+            for collection_name, stats in collection_stats.items():
+                metrics.observe('rag_collection_search_seconds', stats['latency_s'], collection=collection_name)
+            federated_span['attributes']['latencies_s'] = {collection_name: stats['latency_s']
+                                                           for collection_name, stats in collection_stats.items()}
+            return merge_query_results(results_by_collection, n_results), collection_stats
+
+    def query_collection_batch(self, query_texts, n_results = None, mode = None):
+        """
+        Retrieval for many independent queries at once: the query embeddings missing from the query
+        cache are computed in one batched embedding call, and the collection is queried once for all of them.
+
+        Returns:
+        list: one results dict per query text ('ids', 'documents', 'metadatas', 'distances', each holding
+              a single list), shaped like query_collection's results for that text alone.
+        """
+        if n_results is None:
+            n_results = self.config_json['query_nr_results']
+        if mode is None:
+            mode = self.config_json.get('query_mode', 'vector')
+        generation = self.query_cache.generation(self.collection.name)
+        results_keys = [(self.collection.name, generation, (text,), n_results, mode) for text in query_texts]
+        query_results = [self.query_cache.results.get(results_key) for results_key in results_keys]
+        # callers annotate the results, never hand out the cached objects themselves
+        query_results = [copy.deepcopy(each_result) if each_result is not None else None for each_result in query_results]
+        missing = [i for i, each_result in enumerate(query_results) if each_result is None]
+        metrics.count('rag_cache_requests_total', len(query_texts) - len(missing), cache='query_results', result='hit')
+        metrics.count('rag_cache_requests_total', len(missing), cache='query_results', result='miss')
+        if len(missing):
+            start_time = time.perf_counter()
+            with metrics.span('query.batch', collection=self.collection.name, texts=len(missing), mode=mode):
+                batch_results = self.search([query_texts[i] for i in missing], n_results, mode)
+            cost_s = (time.perf_counter() - start_time) / len(missing)
+            for j, i in enumerate(missing):
+                query_results[i] = {key: [batch_results[key][j]] for key in ('ids', 'documents', 'metadatas', 'distances')}
+                self.query_cache.results.put(results_keys[i], copy.deepcopy(query_results[i]), cost_s=cost_s)
         return query_results
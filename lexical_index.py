@@ -0,0 +1,102 @@
+import re
+import sqlite3
+import threading
+
+# words, keeping codes like E-1234, v2.0.1 or AB_12/3 together (searched as phrases)
+TERM_PATTERN = re.compile(r"\w+(?:[-./:]\w+)*")
+
+def make_match_query(query_text):
+    # FTS5 query matching any term of the text, each one quoted so no FTS5 syntax is interpreted
+    terms = list(dict.fromkeys(TERM_PATTERN.findall(query_text)))
+    if not len(terms):
+        return None
+    return ' OR '.join('"' + term.replace('"', '""') + '"' for term in terms)
+
+class Lexical_Index:
+    """
+    On-disk BM25 keyword index of the chunks of one collection (SQLite FTS5), stored next to the Chroma data.
+    Answers keyword queries without any model call. Chunk ids map to FTS5 rowids through the chunk_ids table.
+    """
+    # SQLite limits the number of bound variables per statement
+    MAX_KEYS_PER_QUERY = 500
+
+    def __init__(self, db_path, tokenizer = 'unicode61 remove_diacritics 2'):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS chunk_ids (rowid INTEGER PRIMARY KEY, chunk_id TEXT UNIQUE NOT NULL)")
+            self.connection.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5(text, tokenize='{tokenizer}')")
+
+    def delete_rows(self, chunk_ids):
+        # to be called with the lock held, inside a transaction
+        for i in range(0, len(chunk_ids), self.MAX_KEYS_PER_QUERY):
+            part = chunk_ids[i:i + self.MAX_KEYS_PER_QUERY]
+            placeholders = ','.join('?' * len(part))
+            rowids = [row[0] for row in self.connection.execute(f"SELECT rowid FROM chunk_ids WHERE chunk_id IN ({placeholders})", part)]
+            if len(rowids):
+                placeholders = ','.join('?' * len(rowids))
+                self.connection.execute(f"DELETE FROM chunks WHERE rowid IN ({placeholders})", rowids)
+                self.connection.execute(f"DELETE FROM chunk_ids WHERE rowid IN ({placeholders})", rowids)
+
+    def upsert(self, chunk_ids, texts):
+        chunk_ids = list(chunk_ids)
+        if not len(chunk_ids):
+            return
+        with self.lock, self.connection:
+            self.delete_rows(chunk_ids)
+            first_rowid = self.connection.execute("SELECT COALESCE(MAX(rowid), 0) + 1 FROM chunk_ids").fetchone()[0]
+            rowids = range(first_rowid, first_rowid + len(chunk_ids))
+            self.connection.executemany("INSERT INTO chunk_ids (rowid, chunk_id) VALUES (?, ?)", zip(rowids, chunk_ids))
+            self.connection.executemany("INSERT INTO chunks (rowid, text) VALUES (?, ?)", zip(rowids, texts))
+
+    def delete(self, chunk_ids):
+        chunk_ids = list(chunk_ids)
+        if not len(chunk_ids):
+            return
+        with self.lock, self.connection:
+            self.delete_rows(chunk_ids)
+
+    def search(self, query_text, n_results):
+        """
+        Returns:
+        list: (chunk_id, score) of the n_results best chunks by BM25, best first (higher score is better).
+        """
+        match_query = make_match_query(query_text)
+        if match_query is None:
+            return []
+        with self.lock:
+            # FTS5 only sorts by rank efficiently in the inner query, the join maps its few rowids to chunk ids
+            rows = self.connection.execute("""
+                SELECT chunk_ids.chunk_id, hits.rank
+                FROM (SELECT rowid, rank FROM chunks WHERE chunks MATCH ? ORDER BY rank LIMIT ?) AS hits
+                JOIN chunk_ids ON chunk_ids.rowid = hits.rowid
+                ORDER BY hits.rank""", (match_query, n_results)).fetchall()
+        # bm25() is negative, the lower the better
+        return [(chunk_id, -rank) for chunk_id, rank in rows]
+
+    def count(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM chunk_ids").fetchone()[0]
+
+    def clear(self):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM chunk_ids")
+            self.connection.execute("DELETE FROM chunks")
+
+    def optimize(self):
+        # merges the FTS5 b-trees written by many small updates into one, for faster queries
+        with self.lock, self.connection:
+            self.connection.execute("INSERT INTO chunks (chunks) VALUES ('optimize')")
+
+    def size_bytes(self):
+        # pages in use, not counting the free pages left in the file by deletes and merges
+        with self.lock:
+            page_count = self.connection.execute("PRAGMA page_count").fetchone()[0]
+            freelist_count = self.connection.execute("PRAGMA freelist_count").fetchone()[0]
+            page_size = self.connection.execute("PRAGMA page_size").fetchone()[0]
+        return (page_count - freelist_count) * page_size
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,86 @@
+import json
+import time
+import httpx
+from metrics import metrics
+
+class OpenAI_Chat_Client:
+    """
+    Minimal client for OpenAI-compatible '/chat/completions' endpoints (e.g. LM Studio),
+    with a streaming mode that hands each generated token to a callback and records
+    time-to-first-token and tokens/sec for every answer.
+    """
+    def __init__(self, model, base_url, api_key, system_message = "You are a smart AI", timeout_s = 600, max_connections = 4):
+        self.model = model
+        self.system_message = system_message
+        self.http_client = httpx.Client(
+                            base_url=base_url,
+                            headers={"Authorization": f"Bearer {api_key}"},
+                            timeout=timeout_s,
+                            limits=httpx.Limits(max_connections=max_connections,
+                                                max_keepalive_connections=max_connections)
+                        )
+
+    @classmethod
+    def from_config(cls, llm_agent_config: dict, **kwargs):
+        return cls(model = llm_agent_config['model'],
+                   base_url = llm_agent_config['base_url'],
+                   api_key = llm_agent_config['api_key'],
+                   **kwargs)
+
+    def messages(self, prompt):
+        return [{"role": "system", "content": self.system_message},
+                {"role": "user", "content": prompt}]
+
+    def complete(self, prompt):
+        response = self.http_client.post("chat/completions", json={"model": self.model, "messages": self.messages(prompt)})
+        response.raise_for_status()
+        answer = response.json()['choices'][0]['message']['content']
+        metrics.count('rag_llm_requests_total', mode='complete')
+        return answer
+
+    def stream(self, prompt, on_token = None):
+        """
+        Streams the answer, calling on_token(token_text) for every content delta.
+        An exception raised by on_token (e.g. a cancel) stops the generation and closes the connection.
+        Returns:
+        tuple: (full answer, dict of this answer's 'ttft_s', 'total_s', 'tokens', 'tokens_per_s').
+        The stats are returned rather than kept on the client, which other threads use at the same time
+        (e.g. a query rewrite still running after its timeout).
+        """
+        start_time = time.perf_counter()
+        first_token_time = None
+        nr_tokens = 0
+        parts = []
+        request = {"model": self.model, "messages": self.messages(prompt), "stream": True}
+        with self.http_client.stream("POST", "chat/completions", json=request) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                delta = json.loads(data)['choices'][0].get('delta', {})
+                token = delta.get('content')
+                if not token:
+                    continue
+                if first_token_time is None:
+                    first_token_time = time.perf_counter()
+                nr_tokens += 1
+                parts.append(token)
+                if on_token is not None:
+                    on_token(token)
+        end_time = time.perf_counter()
+        generation_s = end_time - first_token_time if first_token_time is not None else 0.0
+        stats = {'ttft_s': first_token_time - start_time if first_token_time is not None else None,
+                 'total_s': end_time - start_time,
+                 'tokens': nr_tokens,
+                 'tokens_per_s': (nr_tokens - 1) / generation_s if nr_tokens > 1 and generation_s > 0 else None}
+        metrics.count('rag_llm_requests_total', mode='stream')
+        metrics.count('rag_llm_tokens_total', nr_tokens)
+        if stats['ttft_s'] is not None:
+            metrics.observe('rag_llm_ttft_seconds', stats['ttft_s'])
+        return ''.join(parts), stats
+
+    def close(self):
+        self.http_client.close()
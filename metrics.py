@@ -0,0 +1,201 @@
+import bisect
+import cProfile
+import io
+import itertools
+import json
+import os
+import pstats
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# seconds, from 1ms to 5min
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+class Histogram:
+    def __init__(self, buckets = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        # first bucket with value <= upper bound
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        return list(itertools.accumulate(self.counts))
+
+def format_labels(labels, extra = ()):
+    pairs = list(labels) + list(extra)
+    if not len(pairs):
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+class Pipeline_Metrics:
+    """
+    In-process instrumentation of the RAG pipeline (thread-safe):
+    - counters (chunks embedded, bytes read, cache hits...) and histograms
+    - spans: timed, nested blocks (ask -> ask.retrieve -> query.embed...), each one also feeding the
+      rag_stage_seconds histogram; the last max_spans are kept and can be appended to a JSON lines trace file
+    Exported as Prometheus text (to_prometheus) or JSON lines (to_json_lines, spans_json_lines).
+    profile() captures a cProfile of one block, e.g. a single request.
+    """
+    def __init__(self, max_spans = 10000):
+        self.enabled = True
+        self.lock = threading.Lock()
+        self.counters = {}    # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.spans = deque(maxlen=max_spans)
+        self.span_ids = itertools.count(1)
+        self.local = threading.local()
+        self.trace_file = None
+
+    def configure(self, metrics_config: dict):
+        self.enabled = metrics_config.get('enabled', True)
+        with self.lock:
+            self.spans = deque(self.spans, maxlen=metrics_config.get('max_spans', 10000))
+            if self.trace_file is not None:
+                self.trace_file.close()
+                self.trace_file = None
+            trace_path = metrics_config.get('trace_file')
+            if trace_path:
+                self.trace_file = open(trace_path, 'a', encoding='utf-8', buffering=1)
+
+    def count(self, name, value = 1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets = LATENCY_BUCKETS, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """
+        Times the block as a span named name. Yields the span record, whose 'attributes' dict can be
+        completed inside the block (counts, sizes...). Spans opened inside the block on the same thread
+        become its children.
+        """
+        if not self.enabled:
+            yield {'attributes': attributes}
+            return
+        stack = self.local.__dict__.setdefault('stack', [])
+        span_id = next(self.span_ids)
+        record = {'name': name,
+                  'span_id': span_id,
+                  'parent_id': stack[-1]['span_id'] if len(stack) else None,
+                  'trace_id': stack[0]['span_id'] if len(stack) else span_id,
+                  'thread': threading.current_thread().name,
+                  'start': time.time(),
+                  'attributes': attributes}
+        stack.append(record)
+        start_time = time.perf_counter()
+        try:
+            yield record
+        except BaseException as exp:
+            record['error'] = type(exp).__name__
+            raise
+        finally:
+            record['duration_s'] = time.perf_counter() - start_time
+            stack.pop()
+            self.observe('rag_stage_seconds', record['duration_s'], stage=name)
+            with self.lock:
+                self.spans.append(record)
+                if self.trace_file is not None:
+                    self.trace_file.write(json.dumps(record, default=str) + '\n')
+
+    @contextmanager
+    def profile(self, name, profile_dir = None, top = 30):
+        """
+        cProfile capture of the block (calling thread only). The yielded dict gets 'report', the top
+        functions by cumulative time, and 'path' of the saved .prof file when profile_dir is given.
+        """
+        profiler = cProfile.Profile()
+        result = {}
+        profiler.enable()
+        try:
+            yield result
+        finally:
+            profiler.disable()
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(top)
+            result['report'] = stream.getvalue()
+            if profile_dir:
+                os.makedirs(profile_dir, exist_ok=True)
+                result['path'] = os.path.join(profile_dir, f"{name}_{time.strftime('%Y%m%d_%H%M%S')}.prof")
+                profiler.dump_stats(result['path'])
+
+    def to_prometheus(self):
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+            last_name = None
+            for (name, labels), value in counters:
+                if name != last_name:
+                    lines.append(f"# TYPE {name} counter")
+                    last_name = name
+                lines.append(f"{name}{format_labels(labels)} {value}")
+            for (name, labels), histogram in histograms:
+                if name != last_name:
+                    lines.append(f"# TYPE {name} histogram")
+                    last_name = name
+                upper_bounds = [str(bound) for bound in histogram.buckets] + ['+Inf']
+                for upper_bound, cumulative_count in zip(upper_bounds, histogram.cumulative_counts()):
+                    lines.append(f"{name}_bucket{format_labels(labels, [('le', upper_bound)])} {cumulative_count}")
+                lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+    def to_json_lines(self):
+        # one line per counter / histogram
+        timestamp = time.time()
+        lines = []
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(json.dumps({'type': 'counter', 'name': name, 'labels': dict(labels), 'value': value, 'time': timestamp}))
+            for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                lines.append(json.dumps({'type': 'histogram', 'name': name, 'labels': dict(labels),
+                                         'count': histogram.count, 'sum': histogram.sum,
+                                         'buckets': dict(zip([str(bound) for bound in histogram.buckets] + ['+Inf'],
+                                                             histogram.cumulative_counts())),
+                                         'time': timestamp}))
+        return '\n'.join(lines) + '\n'
+
+    def spans_json_lines(self, limit = None):
+        with self.lock:
+            spans = list(self.spans)
+        if limit is not None:
+            spans = spans[-limit:]
+        return ''.join(json.dumps(record, default=str) + '\n' for record in spans)
+
+    def export(self, path):
+        # Prometheus text for .prom files (e.g. node_exporter's textfile collector), JSON lines otherwise
+        data = self.to_prometheus() if path.endswith('.prom') else self.to_json_lines()
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.spans.clear()
+
+# shared by every module of the process
+metrics = Pipeline_Metrics()
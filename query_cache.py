@@ -0,0 +1,84 @@
+import threading
+import time
+from collections import OrderedDict
+
+class LRU_TTL_Cache:
+    """
+    Thread-safe in-process cache with a size cap (least recently used entries are evicted first)
+    and an optional time-to-live. Each entry remembers how long it took to compute, so the
+    latency saved by hits can be reported.
+    """
+    def __init__(self, max_entries = 1000, ttl_s = None):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_s = 0.0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl_s is not None and time.monotonic() - entry[2] > self.ttl_s:
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            self.saved_s += entry[1]
+            return entry[0]
+
+    def put(self, key, value, cost_s = 0.0):
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (value, cost_s, time.monotonic())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self.entries),
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups else 0.0,
+                    'saved_s': self.saved_s}
+
+class Query_Cache:
+    """
+    Query-side caches of Chroma_Database: query text -> query embedding, and
+    (collection, query texts, n_results) -> query results.
+    Every write to a collection bumps its generation counter, which is part of the results key,
+    so results cached before the write are never served again.
+    """
+    def __init__(self, max_entries = 1000, ttl_s = None):
+        self.embeddings = LRU_TTL_Cache(max_entries, ttl_s)
+        self.results = LRU_TTL_Cache(max_entries, ttl_s)
+        self.generations = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, cache_config: dict):
+        if not cache_config.get('enabled', True):
+            return cls(max_entries=0)
+        return cls(max_entries=cache_config.get('max_entries', 1000), ttl_s=cache_config.get('ttl_s'))
+
+    def generation(self, collection_name):
+        with self.lock:
+            return self.generations.get(collection_name, 0)
+
+    def invalidate(self, collection_name):
+        with self.lock:
+            self.generations[collection_name] = self.generations.get(collection_name, 0) + 1
+
+    def stats(self):
+        return {'embeddings': self.embeddings.stats(), 'results': self.results.stats()}
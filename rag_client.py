@@ -0,0 +1,112 @@
+import threading
+import httpx
+
+class RAG_Service_Error(Exception):
+    pass
+
+class RAG_Service_Client:
+    """
+    Thin client of rag_service.py. Offers the Chroma_Database methods the GUI uses (collections,
+    sessions, sync, ingest, deletes) plus ask(), so the GUI can work against a shared service instead
+    of opening the Chroma data folder itself.
+    """
+    def __init__(self, service_url, config_json: dict, timeout_s = 3600, max_connections = 4):
+        self.config_json = config_json
+        self.http_client = httpx.Client(base_url=service_url.rstrip('/') + '/',
+                                        timeout=timeout_s,
+                                        limits=httpx.Limits(max_connections=max_connections,
+                                                            max_keepalive_connections=max_connections))
+        self.collection_name = None
+        self.write_locks = {}
+        self.write_locks_guard = threading.Lock()
+
+    def request(self, method, path, **kwargs):
+        response = self.http_client.request(method, path, **kwargs)
+        if response.is_error:
+            try:
+                detail = response.json().get('detail', response.text)
+            except ValueError:
+                detail = response.text
+            raise RAG_Service_Error(f"{method} {path}: {response.status_code} {detail}")
+        return response.json()
+
+    def list_collection_names(self):
+        return [collection['name'] for collection in self.request('GET', 'collections')]
+
+    def init_collection(self, collection_name = None):
+        if collection_name is None:
+            collection_name = self.config_json['default_COLLECTION_NAME']
+        self.request('POST', 'collections', json={'name': collection_name})
+        self.collection_name = collection_name
+
+    def open_session(self, collection_name = None):
+        return RAG_Service_Session(self, collection_name or self.config_json['default_COLLECTION_NAME'])
+
+    def write_lock(self, collection_name):
+        # the service serialises the writes itself, this only keeps the GUI's own tasks in order
+        with self.write_locks_guard:
+            return self.write_locks.setdefault(collection_name, threading.Lock())
+
+    def list_documents(self, collection_name = None, offset = 0, limit = None):
+        params = {'offset': offset} if limit is None else {'offset': offset, 'limit': limit}
+        return self.request('GET', f"collections/{collection_name or self.collection_name}/documents", params=params)
+
+    def count_documents(self, collection_name = None):
+        return self.request('GET', f"collections/{collection_name or self.collection_name}/documents/count")['documents']
+
+    def list_document_folders(self, collection_name = None):
+        return self.request('GET', f"collections/{collection_name or self.collection_name}/folders")
+
+    def delete_collection(self, collection_name):
+        self.request('DELETE', f"collections/{collection_name}")
+
+    def ask(self, collection_name, user_query, optimized_DB_query, use_llm_response, n_results = None, mode = None):
+        # the whole ask (query rewrite, retrieval, answer) runs on the service; collection_name can be a list
+        collection_names = collection_name if isinstance(collection_name, list) else [collection_name]
+        result = self.request('POST', 'query', json={'query': user_query,
+                                                     'collection': collection_names[0],
+                                                     'collections': collection_names if len(collection_names) > 1 else None,
+                                                     'optimize_query': optimized_DB_query,
+                                                     'use_llm': use_llm_response,
+                                                     'n_results': n_results,
+                                                     'mode': mode})
+        chunks_info = [{'doc_path': doc_path, 'relevance': relevance}
+                       for doc_path, relevance in zip(result.get('doc_paths', []), result.get('relevances', []))]
+        answer = result['answer'] if use_llm_response else 'Info found in the below documents.\n\nLLM not selected to interpret it.'
+        return {'answer': answer, 'chunks_info': chunks_info}
+
+    def stats(self):
+        return self.request('GET', 'stats')
+
+    def close(self):
+        self.http_client.close()
+
+class RAG_Service_Session:
+    # Remote counterpart of a Chroma_Database session: one collection, remembers the last checked folders
+    def __init__(self, service_client, collection_name):
+        self.service_client = service_client
+        self.collection_name = collection_name
+        self.folders = None
+
+    def docs_check_sync(self, doc_file_path = None, progress = None):
+        if doc_file_path is None:
+            doc_file_path = self.service_client.config_json['default_doc_files_path']
+        self.folders = doc_file_path if isinstance(doc_file_path, list) else [doc_file_path]
+        if progress is not None:
+            progress('checking folders on the service')
+        return self.service_client.request('POST', f"collections/{self.collection_name}/sync", json={'folders': self.folders})
+
+    def add_to_collection(self, ids_list = None, progress = None):
+        # the service checks the folders again and applies every change found
+        if progress is not None:
+            progress('ingesting on the service')
+        result = self.service_client.request('POST', f"collections/{self.collection_name}/ingest", json={'folders': self.folders})
+        print(f"Chunks: {result.get('chunks')}")
+        return result
+
+    def delete_from_collection(self, ids_list = None):
+        if ids_list is not None and len(ids_list):
+            self.service_client.request('POST', f"collections/{self.collection_name}/delete", json={'ids': list(ids_list)})
+
+    def delete_collection(self, collection_name):
+        self.service_client.delete_collection(collection_name)
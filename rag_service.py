@@ -0,0 +1,248 @@
+"""
+HTTP service mode: one process owns the Chroma client (and so the HNSW indexes), the pooled connections to
+the embedding and LLM servers and all the caches, and serves any number of clients (the GUI in thin-client
+mode, batch jobs, scripts).
+- queries run concurrently on a thread pool; identical queries already in flight are computed only once
+- writes (ingest, sync, deletes) hold a single-writer lock per collection, other collections stay writable
+- GET /metrics serves the stage latencies and counters as Prometheus text, GET /metrics/spans the last spans
+  as JSON lines; a query sent with "profile": true runs under cProfile and returns the report
+Folder paths sent to the sync/ingest endpoints are paths on the machine running the service.
+
+Usage:
+    python rag_service.py [--config config.json] [--host 127.0.0.1] [--port 8765]
+"""
+import argparse
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import List, Optional
+import uvicorn
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel
+from helpers import Chroma_Database
+from batch_query import Batch_Query_Runner, load_config
+from metrics import metrics
+
+class Query_Request(BaseModel):
+    query: str
+    collection: Optional[str] = None
+    collections: Optional[List[str]] = None  # searched together, instead of collection
+    optimize_query: Optional[bool] = None
+    use_llm: Optional[bool] = None
+    n_results: Optional[int] = None
+    mode: Optional[str] = None
+    profile: bool = False
+
+class Collection_Request(BaseModel):
+    name: str
+
+class Folders_Request(BaseModel):
+    folders: List[str]
+
+class Chunk_Ids_Request(BaseModel):
+    ids: List[str]
+
+class Request_Coalescer:
+    """
+    Shares one computation between identical requests: while a request with a given key is in flight,
+    the next ones with the same key wait for its result instead of starting their own.
+    Only used from the event loop thread.
+    """
+    def __init__(self):
+        self.in_flight = {}
+        self.started = 0
+        self.coalesced = 0
+
+    async def run(self, key, start):
+        future = self.in_flight.get(key)
+        metrics.count('rag_service_queries_total', outcome='started' if future is None else 'coalesced')
+        if future is None:
+            self.started += 1
+            future = asyncio.ensure_future(start())
+            self.in_flight[key] = future
+            future.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        else:
+            self.coalesced += 1
+        # a client going away must not cancel the computation the other clients wait for
+        return await asyncio.shield(future)
+
+    def stats(self):
+        return {'in_flight': len(self.in_flight), 'started': self.started, 'coalesced': self.coalesced}
+
+class RAG_Service:
+    def __init__(self, config_json: dict):
+        service_config = config_json.get('service_config', {})
+        self.profile_dir = config_json.get('metrics_config', {}).get('profile_dir')
+        self.cdb = Chroma_Database(config_json=config_json['chroma_config'])
+        self.runner = Batch_Query_Runner(config_json, cdb=self.cdb, llm_concurrency=service_config.get('max_llm_requests', 4))
+        self.query_executor = ThreadPoolExecutor(max_workers=service_config.get('max_query_workers', 8), thread_name_prefix="query")
+        self.write_executor = ThreadPoolExecutor(max_workers=service_config.get('max_write_workers', 2), thread_name_prefix="write")
+        self.write_locks = {}  # collection name -> asyncio.Lock
+        self.coalescer = Request_Coalescer()
+
+    async def run_read(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.query_executor, functools.partial(func, *args))
+
+    async def run_write(self, collection_name, func, *args):
+        async with self.write_locks.setdefault(collection_name, asyncio.Lock()):
+            return await asyncio.get_running_loop().run_in_executor(self.write_executor, functools.partial(func, *args))
+
+    async def query(self, request: Query_Request):
+        collection_name = request.collections or request.collection or self.runner.default_collection
+        if request.profile:
+            # profiled queries are never shared with others, the report is for this one only
+            return await self.run_read(self.profiled_query, request.query, collection_name,
+                                       request.optimize_query, request.use_llm, request.n_results, request.mode)
+        # a write to the collection bumps its generation: requests after it do not join an older computation
+        collection_names = collection_name if isinstance(collection_name, list) else [collection_name]
+        key = (tuple(collection_names), tuple(self.cdb.query_cache.generation(name) for name in collection_names), request.query,
+               request.optimize_query, request.use_llm, request.n_results, request.mode)
+        return await self.coalescer.run(key, lambda: self.run_read(self.runner.query_one, request.query, collection_name,
+                                                                   request.optimize_query, request.use_llm, request.n_results,
+                                                                   request.mode))
+
+    def profiled_query(self, *args):
+        with metrics.profile('query', self.profile_dir) as profile_result:
+            result = self.runner.query_one(*args)
+        result['profile'] = profile_result['report']
+        return result
+
+    def list_collections(self):
+        return [{'name': collection.name, 'count': collection.count()} for collection in self.cdb.client.list_collections()]
+
+    def create_collection(self, collection_name):
+        session = self.cdb.open_session(collection_name)
+        return {'name': collection_name, 'count': session.collection.count()}
+
+    def delete_collection(self, collection_name):
+        self.cdb.delete_collection(collection_name)
+        self.runner.forget_session(collection_name)
+        return {'deleted': collection_name}
+
+    def sync_collection(self, collection_name, folders, apply_changes):
+        # compares the folders with the collection and, when apply_changes, brings the collection in sync
+        session = self.cdb.open_session(collection_name)
+        sync_result = session.docs_check_sync(folders)
+        summary = {key: sync_result[key] for key in ('new_doc_ids', 'doc_ids_to_delete', 'added_doc_ids',
+                                                     'changed_doc_ids', 'removed_doc_ids')}
+        if apply_changes:
+            session.delete_from_collection(sync_result['doc_ids_to_delete'])
+            if len(sync_result['new_doc_ids']):
+                session.add_to_collection()
+                summary['chunks'] = session.last_add_stats
+        return summary
+
+    def delete_chunks(self, collection_name, ids):
+        self.cdb.open_session(collection_name).delete_from_collection(ids)
+        return {'deleted': len(ids)}
+
+    def stats(self):
+        stats = {'coalescer': self.coalescer.stats(), 'query_cache': self.cdb.query_cache.stats()}
+        if self.runner.answer_cache is not None:
+            stats['answer_cache'] = self.runner.answer_cache.stats()
+        return stats
+
+    def close(self):
+        self.query_executor.shutdown(wait=False)
+        self.write_executor.shutdown(wait=True)
+        self.runner.close()
+
+def create_app(config_json: dict):
+    service = RAG_Service(config_json)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        yield
+        service.close()
+
+    app = FastAPI(title="MySmplRAG service", lifespan=lifespan)
+    app.state.service = service
+
+    def existing_collection(collection_name):
+        if collection_name not in service.cdb.list_collection_names():
+            raise HTTPException(status_code=404, detail=f"Collection '{collection_name}' does not exist")
+
+    @app.get("/collections")
+    async def list_collections():
+        return await service.run_read(service.list_collections)
+
+    @app.post("/collections")
+    async def create_collection(request: Collection_Request):
+        return await service.run_write(request.name, service.create_collection, request.name)
+
+    @app.delete("/collections/{collection_name}")
+    async def delete_collection(collection_name: str):
+        existing_collection(collection_name)
+        return await service.run_write(collection_name, service.delete_collection, collection_name)
+
+    @app.get("/collections/{collection_name}/documents")
+    async def list_documents(collection_name: str, offset: int = 0, limit: Optional[int] = None):
+        existing_collection(collection_name)
+        return await service.run_read(service.cdb.list_documents, collection_name, offset, limit)
+
+    @app.get("/collections/{collection_name}/documents/count")
+    async def count_documents(collection_name: str):
+        existing_collection(collection_name)
+        return {'documents': await service.run_read(service.cdb.count_documents, collection_name)}
+
+    @app.get("/collections/{collection_name}/folders")
+    async def list_document_folders(collection_name: str):
+        existing_collection(collection_name)
+        return await service.run_read(service.cdb.list_document_folders, collection_name)
+
+    @app.post("/collections/{collection_name}/sync")
+    async def check_sync(collection_name: str, request: Folders_Request):
+        return await service.run_write(collection_name, service.sync_collection, collection_name, request.folders, False)
+
+    @app.post("/collections/{collection_name}/ingest")
+    async def ingest(collection_name: str, request: Folders_Request):
+        return await service.run_write(collection_name, service.sync_collection, collection_name, request.folders, True)
+
+    @app.post("/collections/{collection_name}/delete")
+    async def delete_chunks(collection_name: str, request: Chunk_Ids_Request):
+        existing_collection(collection_name)
+        return await service.run_write(collection_name, service.delete_chunks, collection_name, request.ids)
+
+    @app.post("/query")
+    async def query(request: Query_Request):
+        # a search over several collections reports the missing ones itself, in its collection stats
+        collection_names = request.collections or [request.collection or service.runner.default_collection]
+        if len(collection_names) == 1:
+            existing_collection(collection_names[0])
+        try:
+            return await service.query(request)
+        except Exception as exp:
+            raise HTTPException(status_code=500, detail=f"Query failed: {exp}")
+
+    @app.get("/stats")
+    async def stats():
+        return service.stats()
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    async def prometheus_metrics():
+        return PlainTextResponse(metrics.to_prometheus(), media_type="text/plain; version=0.0.4")
+
+    @app.get("/metrics/spans", response_class=PlainTextResponse)
+    async def spans(limit: int = 1000):
+        return PlainTextResponse(metrics.spans_json_lines(limit), media_type="application/x-ndjson")
+
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve queries and ingests of the RAG collections over HTTP.")
+    parser.add_argument('--config', default=None, help="config file (default: config.json next to this script)")
+    parser.add_argument('--host', default=None)
+    parser.add_argument('--port', type=int, default=None)
+    args = parser.parse_args()
+
+    config_json = load_config(args.config)
+    metrics.configure(config_json.get('metrics_config', {}))
+    service_config = config_json.get('service_config', {})
+    uvicorn.run(create_app(config_json),
+                host=args.host or service_config.get('host', '127.0.0.1'),
+                port=args.port or service_config.get('port', 8765))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import sqlite3
+import threading
+
+class Sync_Manifest:
+    """
+    Persistent record of the size, mtime_ns and content hash of every file synced into a collection.
+    Lets a recheck skip opening files whose stat did not change since the last sync.
+    Stored as a SQLite sidecar file inside the Chroma data folder.
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS synced_files (
+                    collection TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    PRIMARY KEY (collection, path)
+                )""")
+
+    def load(self, collection_name):
+        # path -> (size, mtime_ns, content_hash) for every file known in the collection
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT path, size, mtime_ns, content_hash FROM synced_files WHERE collection = ?",
+                (collection_name,))
+            return {path: (size, mtime_ns, content_hash) for path, size, mtime_ns, content_hash in rows}
+
+    def update(self, collection_name, files):
+        # files: iterable of dicts with 'path', 'size', 'mtime_ns' and 'content_hash'
+        rows = [(collection_name, each_file['path'], each_file['size'], each_file['mtime_ns'], each_file['content_hash'])
+                for each_file in files]
+        if not len(rows):
+            return
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO synced_files (collection, path, size, mtime_ns, content_hash) VALUES (?, ?, ?, ?, ?)",
+                rows)
+
+    def forget(self, collection_name, paths):
+        rows = [(collection_name, path) for path in paths]
+        if not len(rows):
+            return
+        with self.lock, self.connection:
+            self.connection.executemany("DELETE FROM synced_files WHERE collection = ? AND path = ?", rows)
+
+    def drop_collection(self, collection_name):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM synced_files WHERE collection = ?", (collection_name,))
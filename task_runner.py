@@ -0,0 +1,137 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+class Task_Cancelled(Exception):
+    pass
+
+def collection_task_name(action, collection_name):
+    # name of a write task on a collection, e.g. "ingest 'Default_collection'"
+    return f"{action} '{collection_name}'"
+
+class Task:
+    """
+    Handle given to a background function: reports progress and carries the cancel request.
+    progress() raises Task_Cancelled once the task was cancelled, so long loops that report
+    progress stop at their next step.
+    """
+    def __init__(self, name, post_event, group = None):
+        self.name = name
+        self.group = group
+        self.cancel_event = threading.Event()
+        self.post_event = post_event
+        self.stages = {}
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise Task_Cancelled(self.name)
+
+    def progress(self, stage, value = None):
+        # value is a counter (files hashed, chunks embedded, tokens generated...) or None for a plain stage
+        self.check_cancelled()
+        self.stages[stage] = value
+        self.post_event(('progress', self, (stage, value)))
+
+    def stream(self, text):
+        # partial output (e.g. answer tokens) for the UI
+        self.check_cancelled()
+        self.post_event(('stream', self, text))
+
+    def describe(self):
+        return ', '.join(stage if value is None else f"{stage}: {value}" for stage, value in self.stages.items())
+
+class Background_Tasks:
+    """
+    Runs long operations (ask, ingest, recheck...) on worker threads so the Tk main loop stays responsive.
+    Callbacks (on_done, on_error, on_progress, on_stream...) are always called on the Tk thread: worker threads
+    only put events in a queue that is drained with root.after.
+    """
+    def __init__(self, root, max_workers = 4, poll_ms = 50):
+        self.root = root
+        self.poll_ms = poll_ms
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="task")
+        self.events = queue.Queue()
+        self.running = {}
+        self.callbacks = {}
+        self.root.after(self.poll_ms, self.poll)
+
+    def submit(self, name, func, on_done = None, on_error = None, on_progress = None, on_cancelled = None, on_stream = None,
+               group = None):
+        """
+        Runs func(task) on a worker thread. Only one task with a given name runs at a time;
+        returns None if one is already running. group (e.g. 'collection') lets cancel_all stop related tasks.
+        """
+        if name in self.running:
+            return None
+        task = Task(name, self.events.put, group)
+        self.running[name] = task
+        self.callbacks[task] = (on_done, on_error, on_progress, on_cancelled, on_stream)
+
+        def run():
+            try:
+                result = func(task)
+            except Task_Cancelled:
+                self.events.put(('cancelled', task, None))
+            except Exception as exp:
+                self.events.put(('error', task, exp))
+            else:
+                self.events.put(('done', task, result))
+
+        self.executor.submit(run)
+        self.events.put(('progress', task, ('started', None)))
+        return task
+
+    def is_running(self, name):
+        return name in self.running
+
+    def cancel(self, name):
+        # only the task with exactly this name
+        task = self.running.get(name)
+        if task is not None:
+            task.cancel()
+
+    def cancel_all(self, group = None):
+        # every running task, or every one of group
+        for task in list(self.running.values()):
+            if group is None or task.group == group:
+                task.cancel()
+
+    def describe(self):
+        return ' | '.join(f"{name}: {task.describe()}" for name, task in self.running.items())
+
+    def poll(self):
+        try:
+            while True:
+                kind, task, payload = self.events.get_nowait()
+                on_done, on_error, on_progress, on_cancelled, on_stream = self.callbacks.get(task, (None,) * 5)
+                if kind == 'progress':
+                    if on_progress is not None:
+                        on_progress(task, *payload)
+                    continue
+                if kind == 'stream':
+                    if on_stream is not None:
+                        on_stream(payload)
+                    continue
+                # task finished
+                self.running.pop(task.name, None)
+                self.callbacks.pop(task, None)
+                if kind == 'done' and on_done is not None:
+                    on_done(payload)
+                elif kind == 'error' and on_error is not None:
+                    on_error(payload)
+                elif kind == 'cancelled' and on_cancelled is not None:
+                    on_cancelled()
+        except queue.Empty:
+            pass
+        self.root.after(self.poll_ms, self.poll)
+
+    def shutdown(self):
+        self.cancel_all()
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,40 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from helpers import diff_collection
+
+def stored(doc_id, doc_hash, nr_chunks):
+    # the (chunk_id, metadata) pairs of a document as add_to_collection writes them
+    return [(f"{doc_id}>{i}", {'doc_hash': doc_hash, 'chunk_hash': f"{doc_hash}-{i}", 'doc_chunk': str(i)})
+            for i in range(nr_chunks)]
+
+def test_added_changed_removed_and_unchanged_docs():
+    stored_chunks = stored('same', 'h1', 2) + stored('edited', 'h2', 3) + stored('gone', 'h3', 2)
+    doc_index = {'same': {'content_hash': 'h1'}, 'edited': {'content_hash': 'h2b'}, 'new': {'content_hash': 'h4'}}
+    diff = diff_collection(stored_chunks, doc_index)
+    assert diff['added_doc_ids'] == ['new']
+    assert diff['changed_doc_ids'] == ['edited']
+    assert diff['removed_doc_ids'] == ['gone']
+    # changed documents are added again, in the order of doc_index
+    assert diff['new_doc_ids'] == ['edited', 'new']
+    assert diff['doc_ids_to_delete'] == ['gone>0', 'gone>1']
+    # the stored chunks of a changed document are kept for the chunk-level diff
+    assert diff['changed_chunks'] == {'edited': {'edited>0': 'h2-0', 'edited>1': 'h2-1', 'edited>2': 'h2-2'}}
+
+def test_nothing_to_do_when_in_sync():
+    stored_chunks = stored('a', 'ha', 3) + stored('b', 'hb', 1)
+    diff = diff_collection(iter(stored_chunks), {'a': {'content_hash': 'ha'}, 'b': {'content_hash': 'hb'}})
+    assert diff['new_doc_ids'] == [] and diff['doc_ids_to_delete'] == [] and diff['changed_chunks'] == {}
+
+def test_partially_written_document_is_changed():
+    # an ingest stopped half way: the document's chunks hold the old and the new hash
+    stored_chunks = stored('a', 'new', 2) + [('a>2', {'doc_hash': 'old', 'chunk_hash': 'x'})]
+    diff = diff_collection(stored_chunks, {'a': {'content_hash': 'new'}})
+    assert diff['changed_doc_ids'] == ['a']
+    assert diff['new_doc_ids'] == ['a']
+
+def test_empty_collection_and_missing_metadata():
+    diff = diff_collection([], {'a': {'content_hash': 'ha'}})
+    assert diff['added_doc_ids'] == ['a'] and diff['new_doc_ids'] == ['a']
+    diff = diff_collection([('a>0', None)], {})
+    assert diff['removed_doc_ids'] == ['a'] and diff['doc_ids_to_delete'] == ['a>0']
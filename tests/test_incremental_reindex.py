@@ -0,0 +1,109 @@
+import hashlib
+import json
+import os
+import random
+import sys
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+os.environ.setdefault('ANONYMIZED_TELEMETRY', 'False')
+import pytest
+from chromadb import EmbeddingFunction
+from helpers import Chroma_Database, ContentDefinedTextSplitter, WORD_SPAN_PATTERN, WordBasedTextSplitter
+
+class Counting_Embedding_Function(EmbeddingFunction):
+    # deterministic embeddings without a model, counting the texts embedded
+    def __init__(self):
+        self.texts = 0
+
+    def __call__(self, input):
+        self.texts += len(input)
+        return [[byte / 255 for byte in hashlib.sha256(text.encode('utf-8')).digest()[:8]] for text in input]
+
+def make_paragraphs(nr_paragraphs, seed = 0):
+    rng = random.Random(seed)
+    return [' '.join(f"w{rng.randrange(3000)}" for _ in range(rng.randint(20, 60))) + '.' for _ in range(nr_paragraphs)]
+
+def words(text):
+    return WORD_SPAN_PATTERN.findall(text)
+
+@pytest.mark.parametrize('max_words, overlap_words', [(100, 0), (100, 20), (10, 9)])
+def test_content_defined_chunks_keep_the_budget(max_words, overlap_words):
+    text = '\n\n'.join(make_paragraphs(200))
+    splitter = ContentDefinedTextSplitter(max_words, overlap_words)
+    chunks = splitter.split_text(text)
+    assert all(len(words(chunk)) <= max_words for chunk in chunks)
+    # without their overlap, the chunks hold every word of the text once, in order
+    new_words = words(chunks[0]) + [word for previous, chunk in zip(chunks, chunks[1:])
+                                    for word in words(chunk)[min(overlap_words, len(words(previous))):]]
+    assert new_words == words(text)
+    for previous, following in zip(chunks, chunks[1:]):
+        # the first chunks can be shorter than the overlap
+        shared = min(overlap_words, len(words(previous)))
+        assert words(following)[:shared] == (words(previous)[-shared:] if shared else [])
+
+@pytest.mark.parametrize('block_size', [1, 50, 4096])
+def test_content_defined_stream_chunks_equals_split_text(block_size):
+    text = '\n\n'.join(make_paragraphs(150, seed=1))
+    splitter = ContentDefinedTextSplitter(80, 15)
+    blocks = [text[start:start + block_size] for start in range(0, len(text), block_size)]
+    assert list(splitter.stream_chunks(blocks)) == splitter.split_text(text)
+
+def test_content_defined_edit_only_changes_nearby_chunks():
+    paragraphs = make_paragraphs(300, seed=2)
+    splitter = ContentDefinedTextSplitter(100, 10)
+    before = splitter.split_text('\n\n'.join(paragraphs))
+    after = splitter.split_text('\n\n'.join(paragraphs[:30] + ['a brand new paragraph inserted here.'] + paragraphs[30:]))
+    assert len(set(after) - set(before)) <= 3
+    # fixed boundaries shift every chunk after the insert
+    fixed = WordBasedTextSplitter(100, 10)
+    fixed_before = set(fixed.split_text('\n\n'.join(paragraphs)))
+    fixed_after = fixed.split_text('\n\n'.join(paragraphs[:30] + ['a brand new paragraph inserted here.'] + paragraphs[30:]))
+    assert len(set(fixed_after) - fixed_before) > len(fixed_after) // 2
+
+@pytest.fixture
+def database(tmp_path):
+    with open(os.path.join(REPO_ROOT, 'config.json'), 'r') as f:
+        chroma_config = json.load(f)['chroma_config']
+    chroma_config['CHROMA_DATA_PATH'] = str(tmp_path / 'db')
+    chroma_config['embedding_cache'] = {'enabled': False}
+    chroma_config['vector_store'] = {'backend': 'chroma'}
+    chroma_config['add_to_collection_config'].update({'max_words_per_chunk': 100, 'overlap_words': 10,
+                                                      'chunk_boundaries': 'content', 'cpu_workers': 1})
+    embedding_function = Counting_Embedding_Function()
+    cdb = Chroma_Database(chroma_config, embedding_function=embedding_function)
+    cdb.init_collection('reindex_test')
+    return cdb, embedding_function
+
+def stored_documents(cdb):
+    stored = cdb.collection.get(include=['documents', 'metadatas'])
+    return sorted((int(metadata['doc_chunk']), document) for metadata, document in zip(stored['metadatas'], stored['documents']))
+
+def test_edited_paragraph_reuses_the_other_chunks(database, tmp_path):
+    cdb, embedding_function = database
+    folder = tmp_path / 'docs'
+    folder.mkdir()
+    paragraphs = make_paragraphs(300, seed=3)
+    (folder / 'doc.txt').write_text('\n\n'.join(paragraphs), encoding='utf-8')
+    cdb.docs_check_sync(str(folder))
+    cdb.add_to_collection()
+    nr_chunks = cdb.collection.count()
+    assert embedding_function.texts == nr_chunks
+
+    # one paragraph rewritten near the start: the chunks after it move to other ids
+    paragraphs[20] = 'this paragraph was rewritten with other words entirely, and it is longer than before now.'
+    new_text = '\n\n'.join(paragraphs)
+    (folder / 'doc.txt').write_text(new_text, encoding='utf-8')
+    embedding_function.texts = 0
+    sync_result = cdb.docs_check_sync(str(folder))
+    assert len(sync_result['changed_doc_ids']) == 1
+    cdb.add_to_collection()
+    stats = cdb.last_add_stats
+    assert embedding_function.texts == stats['embedded'] <= 3
+    assert stats['embedded'] + stats['reused'] + stats['unchanged'] == cdb.collection.count()
+    assert stats['unchanged'] + stats['reused'] >= cdb.collection.count() - 3
+    # the collection holds exactly the chunks of the new text
+    splitter = ContentDefinedTextSplitter(100, 10)
+    assert [document for _, document in stored_documents(cdb)] == splitter.split_text(new_text)
+    # nothing left to do
+    sync_result = cdb.docs_check_sync(str(folder))
+    assert sync_result['new_doc_ids'] == [] and sync_result['doc_ids_to_delete'] == []
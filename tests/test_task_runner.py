@@ -0,0 +1,52 @@
+import os
+import sys
+import threading
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from task_runner import Background_Tasks, collection_task_name
+
+class Fake_Root:
+    # Background_Tasks only needs root.after; events are polled by hand
+    def after(self, ms, func):
+        pass
+
+def wait_for_cancel(started):
+    def run(task):
+        started.set()
+        while not task.cancel_event.wait(0.01):
+            pass
+        task.check_cancelled()
+    return run
+
+def test_cancel_leaves_tasks_of_other_collections_running():
+    tasks = Background_Tasks(Fake_Root())
+    names = [collection_task_name('ingest', 'foo'), collection_task_name('ingest', 'foo_bar'),
+             collection_task_name('recheck', 'foo2')]
+    handles = {}
+    for name in names:
+        started = threading.Event()
+        handles[name] = tasks.submit(name, wait_for_cancel(started), group='collection')
+        assert started.wait(5)
+    try:
+        tasks.cancel(collection_task_name('ingest', 'foo'))
+        assert handles[names[0]].cancelled
+        assert not handles[names[1]].cancelled
+        assert not handles[names[2]].cancelled
+        tasks.cancel_all('collection')
+        assert all(task.cancelled for task in handles.values())
+    finally:
+        tasks.shutdown()
+
+def test_cancel_all_of_a_group():
+    tasks = Background_Tasks(Fake_Root())
+    started = threading.Event()
+    ask = tasks.submit('ask', wait_for_cancel(started))
+    assert started.wait(5)
+    started = threading.Event()
+    ingest = tasks.submit(collection_task_name('ingest', 'foo'), wait_for_cancel(started), group='collection')
+    assert started.wait(5)
+    try:
+        tasks.cancel_all('collection')
+        assert ingest.cancelled and not ask.cancelled
+    finally:
+        tasks.shutdown()
+    assert ask.cancelled
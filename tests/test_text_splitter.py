@@ -0,0 +1,52 @@
+import os
+import random
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pytest
+from helpers import WORD_SPAN_PATTERN, WordBasedTextSplitter
+
+def make_text(nr_words, seed = 0):
+    # words with punctuation, several spaces and line breaks between them
+    rng = random.Random(seed)
+    separators = [' ', ' ', ' ', '  ', '\n', '\n\n', ', ', '. ']
+    return ''.join(f"word{rng.randrange(500)}{rng.choice(separators)}" for _ in range(nr_words))
+
+def words(text):
+    return WORD_SPAN_PATTERN.findall(text)
+
+def blocks_of(text, size):
+    return [text[start:start + size] for start in range(0, len(text), size)]
+
+@pytest.mark.parametrize('nr_words', [0, 1, 99, 100, 101, 950, 1000, 1001])
+@pytest.mark.parametrize('max_words, overlap_words', [(100, 0), (100, 10), (100, 99), (7, 3)])
+def test_chunks_have_exact_budget_and_overlap(nr_words, max_words, overlap_words):
+    text = make_text(nr_words)
+    chunks = WordBasedTextSplitter(max_words, overlap_words).split_text(text)
+    text_words = words(text)
+    step = max_words - overlap_words
+    if not nr_words:
+        assert chunks == []
+        return
+    # chunk j holds words [j*step, j*step + max_words), the last one reaches the end of the text
+    assert len(chunks) == 1 + max(0, -(-(nr_words - max_words) // step))
+    for j, chunk in enumerate(chunks):
+        assert words(chunk) == text_words[j * step:j * step + max_words]
+    if overlap_words:
+        for previous, following in zip(chunks, chunks[1:]):
+            assert words(previous)[-overlap_words:] == words(following)[:overlap_words]
+    assert words(chunks[-1])[-1] == text_words[-1]
+
+def test_chunks_are_slices_of_the_text():
+    text = make_text(500, seed=1)
+    offsets, nr_words = WordBasedTextSplitter(60, 15).chunk_offsets(text)
+    assert nr_words == len(words(text))
+    for (start, end), chunk in zip(offsets, WordBasedTextSplitter(60, 15).split_text(text)):
+        assert text[start:end] == chunk
+        assert chunk == chunk.strip()
+
+@pytest.mark.parametrize('block_size', [1, 7, 64, 1000, 100000])
+@pytest.mark.parametrize('max_words, overlap_words', [(50, 0), (50, 10), (5, 4)])
+def test_stream_chunks_equals_split_text(block_size, max_words, overlap_words):
+    text = make_text(1200, seed=2)
+    splitter = WordBasedTextSplitter(max_words, overlap_words)
+    assert list(splitter.stream_chunks(blocks_of(text, block_size))) == splitter.split_text(text)
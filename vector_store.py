@@ -0,0 +1,565 @@
+"""
+Vector store backends of Chroma_Database. A backend is a client offering the part of chromadb's client and
+collection API that Chroma_Database uses, so chromadb.PersistentClient is one as is:
+- client: get_collection(name), create_collection(name, metadata=None), list_collections(), delete_collection(name),
+  get_max_batch_size()
+- collection: name, count(), upsert(ids, embeddings, documents, metadatas), update(ids, metadatas), delete(ids),
+  get(ids=None, include=..., limit=None, offset=0), query(query_embeddings, n_results, include)
+Chosen with 'vector_store': {'backend': 'chroma' | 'numpy'} in chroma_config.
+
+Numpy_Vector_Store keeps each collection in a folder of plain files:
+- vectors.bin: the unit-normalised embeddings, float16 or int8 (one float32 scale per row), memory-mapped
+- documents.bin: the chunk texts, appended, read back only for the results
+- rows.json + rows.log: ids, document offsets and metadatas as columns (each metadata key dictionary-encoded),
+  a snapshot and the journal of the writes since, compacted once the journal outgrows the collection
+Queries are exact: cosine similarity of every stored vector by blocks of matrix products, then top-k.
+
+Switching backends does not move the collections: each backend keeps its own. Copy them over first with
+    python vector_store.py copy --to numpy [--collection NAME ...] [--config config.json]
+(--to chroma copies them back). The document catalog, sync manifest and keyword indexes are shared by both.
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import threading
+from array import array
+import numpy as np
+
+def open_backend(backend, chroma_config):
+    # the client Chroma_Database opens for backend ('chroma' or 'numpy') with this chroma_config
+    if backend == 'numpy':
+        return Numpy_Vector_Store(os.path.join(chroma_config['CHROMA_DATA_PATH'], 'numpy_store'),
+                                  dtype=chroma_config.get('vector_store', {}).get('dtype', 'float16'))
+    import chromadb
+    return chromadb.PersistentClient(path=chroma_config['CHROMA_DATA_PATH'])
+
+def copy_collection(source, target, page_size = 5000):
+    # copies every chunk (embedding, text, metadata) of a collection into another one, e.g. of another backend
+    offset = 0
+    while True:
+        page = source.get(include=['embeddings', 'documents', 'metadatas'], limit=page_size, offset=offset)
+        if not len(page['ids']):
+            return
+        target.upsert(ids=page['ids'], embeddings=page['embeddings'], documents=page['documents'], metadatas=page['metadatas'])
+        offset += len(page['ids'])
+
+class Numpy_Collection:
+    # rows converted to float32 and scored per matrix product, in one buffer reused for the whole scan: small enough to
+    # stay in the CPU cache (numpy has no float16 BLAS, scoring the stored dtype directly is about twice as slow)
+    QUERY_BLOCK_ROWS = 2048
+
+    def __init__(self, folder, name, dtype = 'float16'):
+        self.folder = folder
+        self.name = name
+        self.lock = threading.RLock()
+        # queries scan the mapped vectors outside the lock: the maps are only closed once no scan uses them,
+        # and a pending remap holds back new scans
+        self.scans_done = threading.Condition(self.lock)
+        self.active_scans = 0
+        self.remaps_waiting = 0
+        self.generation = 0  # bumped by every write, tells a scan whether the rows changed meanwhile
+        meta_path = os.path.join(folder, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r') as f:
+                self.meta = json.load(f)
+        else:
+            os.makedirs(folder, exist_ok=True)
+            self.meta = {'dtype': dtype, 'dim': None, 'metadata': None}
+            self.save_meta()
+        if self.meta['dtype'] not in ('float16', 'int8'):
+            raise ValueError(f"Unsupported vector dtype '{self.meta['dtype']}', expected 'float16' or 'int8'")
+        self.dtype = np.dtype(self.meta['dtype'])
+        self.vectors = None
+        self.scales = None
+        self.capacity = 0
+        # columns, one entry per slot (a slot is a row of vectors.bin); a free slot has id None
+        self.ids = []
+        self.slot_of = {}
+        self.free_slots = set()
+        self.doc_offsets = array('q')
+        self.doc_lengths = array('q')
+        self.metadata_codes = {}   # key -> array('i') of codes into metadata_values[key], -1 when missing
+        self.metadata_values = {}  # key -> list of distinct values
+        self.metadata_lookup = {}  # key -> {(type name, value): code}
+        self.journal_rows = 0
+        self.garbage_bytes = 0
+        self.load_rows()
+        self.documents_file = open(os.path.join(folder, 'documents.bin'), 'a+b')
+        self.journal_file = open(os.path.join(folder, 'rows.log'), 'a', encoding='utf-8')
+        if self.meta['dim'] is not None:
+            self.map_vectors(self.capacity)
+
+    def save_meta(self):
+        with open(os.path.join(self.folder, 'meta.json'), 'w') as f:
+            json.dump(self.meta, f)
+
+    @property
+    def metadata(self):
+        return self.meta['metadata']
+
+    # vectors
+
+    def map_vectors(self, capacity):
+        # (re)maps vectors.bin (and scales.bin) holding capacity rows, growing the files if needed
+        self.unmap_vectors()
+        for file_name, row_bytes in (('vectors.bin', self.meta['dim'] * self.dtype.itemsize), ('scales.bin', 4)):
+            if file_name == 'scales.bin' and self.dtype != np.int8:
+                continue
+            path = os.path.join(self.folder, file_name)
+            with open(path, 'ab') as f:
+                if f.tell() < capacity * row_bytes:
+                    f.truncate(capacity * row_bytes)
+        self.capacity = capacity
+        if capacity:
+            self.vectors = np.memmap(os.path.join(self.folder, 'vectors.bin'), dtype=self.dtype, mode='r+',
+                                     shape=(capacity, self.meta['dim']))
+            if self.dtype == np.int8:
+                self.scales = np.memmap(os.path.join(self.folder, 'scales.bin'), dtype=np.float32, mode='r+', shape=(capacity,))
+
+    def unmap_vectors(self):
+        # a mapped file cannot be resized (Windows) or deleted cleanly: drop the maps first, once no scan reads them
+        if self.active_scans:
+            self.wait_for_scans()
+        for mapped in (self.vectors, self.scales):
+            if mapped is not None:
+                mapped.flush()
+                mapped._mmap.close()
+        self.vectors = None
+        self.scales = None
+
+    def wait_for_scans(self):
+        # with the lock held; releases it while waiting
+        self.remaps_waiting += 1
+        try:
+            self.scans_done.wait_for(lambda: self.active_scans == 0)
+        finally:
+            self.remaps_waiting -= 1
+            self.scans_done.notify_all()
+
+    def scan_vectors(self, vectors, scales, nr_slots, queries):
+        # scores of the first nr_slots rows, without the lock: vectors and scales are the maps taken under it
+        scores = np.empty((len(queries), nr_slots), dtype=np.float32)
+        buffer = np.empty((min(nr_slots, self.QUERY_BLOCK_ROWS), queries.shape[1]), dtype=np.float32)
+        for start in range(0, nr_slots, self.QUERY_BLOCK_ROWS):
+            end = min(nr_slots, start + self.QUERY_BLOCK_ROWS)
+            block = buffer[:end - start]
+            np.copyto(block, vectors[start:end])
+            block_scores = block @ queries.T
+            if scales is not None:
+                block_scores *= scales[start:end, None]
+            scores[:, start:end] = block_scores.T
+        return scores
+
+    def write_vectors(self, slots, embeddings):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if embeddings.ndim != 2 or embeddings.shape[1] != self.meta['dim']:
+            raise ValueError(f"Embeddings of dimension {embeddings.shape[-1]}, the collection holds {self.meta['dim']}")
+        # vectors already of unit norm to float16 precision are left as they are, so an embedding read back
+        # (e.g. reused for a moved chunk) is stored again unchanged
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings = embeddings / np.where((norms > 0) & (np.abs(norms - 1.0) > 1e-3), norms, 1.0)
+        slots = np.asarray(slots)
+        if self.dtype == np.int8:
+            # symmetric per-row quantisation: the largest component maps to +-127
+            scales = np.abs(embeddings).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            self.vectors[slots] = np.rint(embeddings / scales[:, None]).astype(np.int8)
+            self.scales[slots] = scales
+        else:
+            self.vectors[slots] = embeddings.astype(np.float16)
+
+    def read_vectors(self, slots):
+        vectors = np.asarray(self.vectors[slots], dtype=np.float32)
+        if self.dtype == np.int8:
+            vectors *= self.scales[slots][:, None]
+        return vectors
+
+    # rows
+
+    def encode_metadata(self, slot, metadata):
+        metadata = metadata or {}
+        for key in list(self.metadata_codes):
+            if key not in metadata:
+                self.metadata_codes[key][slot] = -1
+        for key, value in metadata.items():
+            codes = self.metadata_codes.get(key)
+            if codes is None:
+                codes = self.metadata_codes[key] = array('i', [-1]) * len(self.ids)
+                self.metadata_values[key] = []
+                self.metadata_lookup[key] = {}
+            lookup = self.metadata_lookup[key]
+            value_key = (type(value).__name__, value)
+            code = lookup.get(value_key)
+            if code is None:
+                code = lookup[value_key] = len(self.metadata_values[key])
+                self.metadata_values[key].append(value)
+            codes[slot] = code
+
+    def decode_metadata(self, slot):
+        metadata = {}
+        for key, codes in self.metadata_codes.items():
+            if codes[slot] >= 0:
+                metadata[key] = self.metadata_values[key][codes[slot]]
+        return metadata or None
+
+    def set_row(self, chunk_id, slot, doc_offset, doc_length, metadata):
+        while slot >= len(self.ids):
+            self.ids.append(None)
+            self.doc_offsets.append(0)
+            self.doc_lengths.append(0)
+            for codes in self.metadata_codes.values():
+                codes.append(-1)
+            self.free_slots.add(len(self.ids) - 1)
+        previous_slot = self.slot_of.get(chunk_id)
+        if previous_slot is not None and previous_slot != slot:
+            self.clear_row(previous_slot)
+        if self.ids[slot] is not None and self.ids[slot] != chunk_id:
+            self.clear_row(slot)
+        # the text of the chunk written over
+        self.garbage_bytes += self.doc_lengths[slot]
+        self.free_slots.discard(slot)
+        self.ids[slot] = chunk_id
+        self.slot_of[chunk_id] = slot
+        self.doc_offsets[slot] = doc_offset
+        self.doc_lengths[slot] = doc_length
+        self.encode_metadata(slot, metadata)
+
+    def clear_row(self, slot):
+        chunk_id = self.ids[slot]
+        if chunk_id is None:
+            return
+        self.slot_of.pop(chunk_id, None)
+        self.ids[slot] = None
+        self.garbage_bytes += self.doc_lengths[slot]
+        self.doc_lengths[slot] = 0
+        for codes in self.metadata_codes.values():
+            codes[slot] = -1
+        self.free_slots.add(slot)
+
+    def apply(self, record):
+        # one journal record: {'upsert': [[id, slot, doc offset, doc length, metadata], ...]}, {'update': [[id, metadata], ...]}
+        # or {'delete': [ids]}
+        for chunk_id, slot, doc_offset, doc_length, metadata in record.get('upsert', []):
+            self.set_row(chunk_id, slot, doc_offset, doc_length, metadata)
+        for chunk_id, metadata in record.get('update', []):
+            if chunk_id in self.slot_of:
+                self.encode_metadata(self.slot_of[chunk_id], metadata)
+        for chunk_id in record.get('delete', []):
+            if chunk_id in self.slot_of:
+                self.clear_row(self.slot_of[chunk_id])
+
+    def load_rows(self):
+        snapshot_path = os.path.join(self.folder, 'rows.json')
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+            self.ids = snapshot['ids']
+            self.doc_offsets = array('q', snapshot['doc_offsets'])
+            self.doc_lengths = array('q', snapshot['doc_lengths'])
+            for key, column in snapshot['metadata'].items():
+                self.metadata_values[key] = column['values']
+                self.metadata_lookup[key] = {(type(value).__name__, value): code for code, value in enumerate(column['values'])}
+                self.metadata_codes[key] = array('i', column['codes'])
+            self.garbage_bytes = snapshot['garbage_bytes']
+            for slot, chunk_id in enumerate(self.ids):
+                if chunk_id is None:
+                    self.free_slots.add(slot)
+                else:
+                    self.slot_of[chunk_id] = slot
+        journal_path = os.path.join(self.folder, 'rows.log')
+        if os.path.exists(journal_path):
+            with open(journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # the last record of an interrupted write
+                        break
+                    self.apply(record)
+                    self.journal_rows += sum(len(rows) for rows in record.values())
+        vectors_path = os.path.join(self.folder, 'vectors.bin')
+        if self.meta['dim'] is not None:
+            row_bytes = self.meta['dim'] * self.dtype.itemsize
+            self.capacity = max(len(self.ids), os.path.getsize(vectors_path) // row_bytes if os.path.exists(vectors_path) else 0)
+
+    def write_journal(self, record):
+        # the vectors and texts a record points to are written before it
+        self.documents_file.flush()
+        if self.vectors is not None:
+            self.vectors.flush()
+            if self.scales is not None:
+                self.scales.flush()
+        self.journal_file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.journal_file.flush()
+        self.apply(record)
+        self.generation += 1
+        self.journal_rows += sum(len(rows) for rows in record.values())
+        if self.journal_rows > max(10000, 2 * len(self.slot_of)):
+            self.compact()
+
+    def compact(self):
+        # rewrites the texts without the deleted ones when they take more room than the live ones, then snapshots the rows
+        live_bytes = sum(self.doc_lengths[slot] for slot in self.slot_of.values())
+        if self.garbage_bytes > max(16 << 20, live_bytes):
+            documents_path = os.path.join(self.folder, 'documents.bin')
+            with open(documents_path + '.tmp', 'wb') as new_file:
+                for slot in self.slot_of.values():
+                    self.documents_file.seek(self.doc_offsets[slot])
+                    text = self.documents_file.read(self.doc_lengths[slot])
+                    self.doc_offsets[slot] = new_file.tell()
+                    new_file.write(text)
+            self.documents_file.close()
+            os.replace(documents_path + '.tmp', documents_path)
+            self.documents_file = open(documents_path, 'a+b')
+            self.garbage_bytes = 0
+        snapshot = {'ids': self.ids,
+                    'doc_offsets': self.doc_offsets.tolist(),
+                    'doc_lengths': self.doc_lengths.tolist(),
+                    'metadata': {key: {'values': self.metadata_values[key], 'codes': codes.tolist()}
+                                 for key, codes in self.metadata_codes.items()},
+                    'garbage_bytes': self.garbage_bytes}
+        snapshot_path = os.path.join(self.folder, 'rows.json')
+        with open(snapshot_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(snapshot_path + '.tmp', snapshot_path)
+        self.journal_file.close()
+        self.journal_file = open(os.path.join(self.folder, 'rows.log'), 'w', encoding='utf-8')
+        self.journal_rows = 0
+
+    def read_documents(self, slots):
+        documents = []
+        for slot in slots:
+            self.documents_file.seek(self.doc_offsets[slot])
+            documents.append(self.documents_file.read(self.doc_lengths[slot]).decode('utf-8'))
+        return documents
+
+    def rows_result(self, slots, include):
+        return {'ids': [self.ids[slot] for slot in slots],
+                'embeddings': [vector.tolist() for vector in self.read_vectors(slots)] if 'embeddings' in include and len(slots) else
+                              ([] if 'embeddings' in include else None),
+                'documents': self.read_documents(slots) if 'documents' in include else None,
+                'metadatas': [self.decode_metadata(slot) for slot in slots] if 'metadatas' in include else None}
+
+    # collection API
+
+    def count(self):
+        return len(self.slot_of)
+
+    def upsert(self, ids, embeddings, documents = None, metadatas = None):
+        if len(ids) != len(embeddings):
+            raise ValueError(f"{len(ids)} ids for {len(embeddings)} embeddings")
+        with self.lock:
+            if self.meta['dim'] is None:
+                self.meta['dim'] = len(embeddings[0])
+                self.save_meta()
+            slots, next_slot = self.assign_slots(ids)
+            if next_slot > self.capacity:
+                # other writes may get in while the running scans finish: assign the slots again after them
+                self.wait_for_scans()
+                slots, next_slot = self.assign_slots(ids)
+                if next_slot > self.capacity:
+                    self.map_vectors(max(next_slot, 2 * self.capacity, 1024))
+            self.write_vectors(slots, embeddings)
+            rows = []
+            self.documents_file.seek(0, os.SEEK_END)
+            for i, (chunk_id, slot) in enumerate(zip(ids, slots)):
+                text = (documents[i] if documents is not None else '').encode('utf-8')
+                doc_offset = self.documents_file.tell()
+                self.documents_file.write(text)
+                rows.append([chunk_id, slot, doc_offset, len(text), metadatas[i] if metadatas is not None else None])
+            self.write_journal({'upsert': rows})
+
+    add = upsert
+
+    def assign_slots(self, ids):
+        # new chunks take the slots of deleted ones first; returns the slots and the first slot left unused
+        slots = [self.slot_of.get(chunk_id) for chunk_id in ids]
+        free_slots = iter(sorted(self.free_slots))
+        next_slot = len(self.ids)
+        for i, slot in enumerate(slots):
+            if slot is None:
+                slots[i] = next(free_slots, None)
+                if slots[i] is None:
+                    slots[i] = next_slot
+                    next_slot += 1
+        return slots, next_slot
+
+    def update(self, ids, metadatas = None, embeddings = None, documents = None):
+        if embeddings is not None or documents is not None:
+            # the whole row is written again
+            stored = self.get(ids=ids, include=['embeddings', 'documents', 'metadatas'])
+            by_id = {chunk_id: i for i, chunk_id in enumerate(ids)}
+            positions = [by_id[chunk_id] for chunk_id in stored['ids']]
+            self.upsert(ids=stored['ids'],
+                        embeddings=[embeddings[i] for i in positions] if embeddings is not None else stored['embeddings'],
+                        documents=[documents[i] for i in positions] if documents is not None else stored['documents'],
+                        metadatas=[metadatas[i] for i in positions] if metadatas is not None else stored['metadatas'])
+            return
+        with self.lock:
+            self.write_journal({'update': [[chunk_id, metadata] for chunk_id, metadata in zip(ids, metadatas)
+                                           if chunk_id in self.slot_of]})
+
+    def delete(self, ids = None):
+        with self.lock:
+            self.write_journal({'delete': [chunk_id for chunk_id in ids if chunk_id in self.slot_of]})
+
+    def get(self, ids = None, include = ('metadatas', 'documents'), limit = None, offset = 0):
+        # ids found, in the order asked; without ids, every chunk in storage order, from offset and at most limit of them
+        with self.lock:
+            if ids is not None:
+                slots = [self.slot_of[chunk_id] for chunk_id in ids if chunk_id in self.slot_of]
+            else:
+                slots = sorted(self.slot_of.values())
+                slots = slots[offset:] if limit is None else slots[offset:offset + limit]
+            return self.rows_result(slots, include)
+
+    def query(self, query_embeddings, n_results = 10, include = ('metadatas', 'documents', 'distances')):
+        """
+        Exact nearest chunks by cosine distance, for each query embedding.
+
+        Returns:
+        dict: 'ids', 'distances', 'documents', 'metadatas' (and 'embeddings' when included), one list per query, closest first.
+        """
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms > 0, norms, 1.0)
+        results = {'ids': [], 'distances': [], 'documents': [] if 'documents' in include else None,
+                   'metadatas': [] if 'metadatas' in include else None, 'embeddings': [] if 'embeddings' in include else None}
+        with self.lock:
+            self.scans_done.wait_for(lambda: self.remaps_waiting == 0)
+            k = min(n_results, len(self.slot_of))
+            if k == 0:
+                for key in ('ids', 'distances', 'documents', 'metadatas', 'embeddings'):
+                    if results[key] is not None:
+                        results[key] = [[] for _ in range(len(queries))]
+                return results
+            if queries.shape[1] != self.meta['dim']:
+                raise ValueError(f"Query embeddings of dimension {queries.shape[1]}, the collection holds {self.meta['dim']}")
+            nr_slots = len(self.ids)
+            vectors, scales = self.vectors, self.scales
+            free_slots = np.fromiter(self.free_slots, dtype=np.int64, count=len(self.free_slots))
+            generation = self.generation
+            self.active_scans += 1
+        try:
+            scores = self.scan_vectors(vectors, scales, nr_slots, queries)
+        finally:
+            with self.lock:
+                self.active_scans -= 1
+                self.scans_done.notify_all()
+        scores[:, free_slots] = -np.inf
+        with self.lock:
+            changed = generation != self.generation
+            # rows written meanwhile: the best candidates are scored again on the rows as they are now
+            nr_candidates = min(2 * k, nr_slots) if changed else k
+            top = np.argpartition(-scores, nr_candidates - 1, axis=1)[:, :nr_candidates]
+            for query, query_scores, query_top in zip(queries, scores, top):
+                if changed:
+                    query_top = np.array([slot for slot in query_top.tolist() if self.ids[slot] is not None], dtype=np.int64)
+                    query_scores = np.full(nr_slots, -np.inf, dtype=np.float32)
+                    if len(query_top):
+                        query_scores[query_top] = self.read_vectors(query_top) @ query
+                slots = query_top[np.argsort(-query_scores[query_top], kind='stable')][:k].tolist()
+                rows = self.rows_result(slots, include)
+                results['ids'].append(rows['ids'])
+                results['distances'].append((1.0 - query_scores[slots]).tolist())
+                for key in ('documents', 'metadatas', 'embeddings'):
+                    if results[key] is not None:
+                        results[key].append(rows[key])
+        return results
+
+    def close(self):
+        with self.lock:
+            self.unmap_vectors()
+            self.documents_file.close()
+            self.journal_file.close()
+
+class Numpy_Vector_Store:
+    """
+    Client of the Numpy_Collection collections stored in folder, one subfolder each.
+    dtype ('float16' or 'int8') applies to the collections it creates; an existing one keeps its own.
+    """
+    NAME_PATTERN = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._-]{1,61}[A-Za-z0-9]$')
+
+    def __init__(self, folder, dtype = 'float16'):
+        self.folder = folder
+        self.dtype = dtype
+        self.collections = {}
+        self.lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def collection_folder(self, name):
+        if not self.NAME_PATTERN.match(name):
+            raise ValueError(f"Invalid collection name '{name}': 3 to 63 letters, digits, '.', '_' or '-'")
+        return os.path.join(self.folder, name)
+
+    def get_collection(self, name, embedding_function = None):
+        # embeddings are always computed by Chroma_Database, embedding_function is only accepted for compatibility
+        with self.lock:
+            if name not in self.collections:
+                if not os.path.exists(os.path.join(self.collection_folder(name), 'meta.json')):
+                    raise ValueError(f"Collection {name} does not exist.")
+                self.collections[name] = Numpy_Collection(self.collection_folder(name), name, self.dtype)
+            return self.collections[name]
+
+    def create_collection(self, name, embedding_function = None, metadata = None):
+        with self.lock:
+            if os.path.exists(os.path.join(self.collection_folder(name), 'meta.json')):
+                raise ValueError(f"Collection {name} already exists.")
+            collection = Numpy_Collection(self.collection_folder(name), name, self.dtype)
+            collection.meta['metadata'] = metadata
+            collection.save_meta()
+            self.collections[name] = collection
+            return collection
+
+    def get_or_create_collection(self, name, embedding_function = None, metadata = None):
+        try:
+            return self.get_collection(name)
+        except ValueError:
+            return self.create_collection(name, metadata=metadata)
+
+    def list_collections(self):
+        names = sorted(name for name in os.listdir(self.folder) if os.path.exists(os.path.join(self.folder, name, 'meta.json')))
+        return [self.get_collection(name) for name in names]
+
+    def delete_collection(self, name):
+        with self.lock:
+            collection = self.collections.pop(name, None)
+            if collection is not None:
+                collection.close()
+            folder = self.collection_folder(name)
+            if not os.path.exists(os.path.join(folder, 'meta.json')):
+                raise ValueError(f"Collection {name} does not exist.")
+            shutil.rmtree(folder)
+
+    def get_max_batch_size(self):
+        return 100000
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy collections between the vector store backends of Chroma_Database.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    copy_parser = subparsers.add_parser('copy', help="copy collections to the other backend")
+    copy_parser.add_argument('--to', required=True, choices=('numpy', 'chroma'), help="backend receiving the collections")
+    copy_parser.add_argument('--collection', action='append', default=None, help="collection to copy (default: all of them)")
+    copy_parser.add_argument('--config', default=None, help="config file (default: config.json next to this script)")
+    args = parser.parse_args()
+
+    config_path = args.config or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.json')
+    with open(config_path, 'r') as json_file:
+        chroma_config = json.load(json_file)['chroma_config']
+    source = open_backend('chroma' if args.to == 'numpy' else 'numpy', chroma_config)
+    target = open_backend(args.to, chroma_config)
+    target_names = {collection.name for collection in target.list_collections()}
+    for name in args.collection or [collection.name for collection in source.list_collections()]:
+        if name in target_names:
+            print(f"Skipping '{name}': it already exists in the {args.to} store")
+            continue
+        source_collection = source.get_collection(name)
+        target_collection = target.create_collection(name, metadata=source_collection.metadata or None)
+        copy_collection(source_collection, target_collection)
+        print(f"Copied '{name}': {target_collection.count()} chunks")
+    print(f"Set chroma_config.vector_store.backend to '{args.to}' in {config_path} to use them")
+
+if __name__ == "__main__":
+    main()